@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Compare the output discovery backends (see chrandr.backends).
+
+Run against the current X display (ie a local Xvfb) :
+    $ Xvfb :99 & DISPLAY=:99 python3 benchmarks/bench_backends.py
+or against the fake xrandr command (only the 'xrandr' backend is available without X) :
+    $ python3 benchmarks/bench_backends.py --fake
+"""
+
+import os
+import sys
+import argparse
+import statistics
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import chrandr.backends
+import fake_xrandr
+
+
+def bench(backend, iterations):
+    """Returns the list of durations (in seconds) of `iterations` queries."""
+    durations = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        backend.get_connected_outputs()
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare chrandr output backends.")
+    parser.add_argument('-n', '--iterations', type=int, default=50, help="queries per backend")
+    parser.add_argument('--fake', action='store_true', help="use the fake xrandr command")
+    parser.add_argument('--latency', type=float, default=0.0, help="fake xrandr latency in seconds")
+    parser.add_argument('--outputs', type=int, default=2, help="fake xrandr connected outputs")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        if args.fake:
+            fake_xrandr.install(tmpdir)
+            os.environ['FAKE_XRANDR_LATENCY'] = str(args.latency)
+            os.environ['FAKE_XRANDR_OUTPUTS'] = str(args.outputs)
+        results = {}
+        for name in chrandr.backends.DEFAULT_BACKENDS:
+            try:
+                backend = chrandr.backends.create_backend(name)
+            except chrandr.backends.BackendUnavailable as e:
+                print("{:8} unavailable: {}".format(name, e))
+                continue
+            try:
+                outputs = backend.get_connected_outputs()
+                durations = bench(backend, args.iterations)
+            finally:
+                backend.close()
+            results[name] = outputs
+            print("{:8} min {:8.3f} ms  median {:8.3f} ms  max {:8.3f} ms  outputs {}".format(
+                name, min(durations) * 1000, statistics.median(durations) * 1000,
+                max(durations) * 1000, outputs))
+        if len(set(tuple(o) for o in results.values())) > 1:
+            print("WARNING: backends do not return the same outputs")
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
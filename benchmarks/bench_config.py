@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the configuration loading (see ChrandrConfig.load()).
+
+For generated configurations of 10, 100 and 1000 profiles, compare :
+    * cold : no compiled cache, the file is parsed with configparser and the cache is written
+    * warm : the compiled cache is valid, the file is not parsed
+    * no cache : the compiled cache is disabled
+    $ python3 benchmarks/bench_config.py
+"""
+
+import os
+import sys
+import argparse
+import statistics
+import time
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import chrandr.config
+import confgen
+
+
+def timing(func, iterations, setup=None):
+    durations = []
+    for _ in range(iterations):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - start)
+    return statistics.median(durations)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the configuration loading.")
+    parser.add_argument('-n', '--iterations', type=int, default=50)
+    parser.add_argument('--profiles', type=int, nargs='*', default=[10, 100, 1000])
+    parser.add_argument('--ports', type=int, default=8)
+    args = parser.parse_args()
+
+    print("{:>10} {:>10} {:>12} {:>12} {:>12}".format("profiles", "size", "no cache ms", "cold ms", "warm ms"))
+    with tempfile.TemporaryDirectory(prefix='chrandr-bench-') as directory:
+        for nb_profiles in args.profiles:
+            filename = os.path.join(directory, 'chrandr-{}.conf'.format(nb_profiles))
+            with open(filename, 'w') as fd:
+                confgen.write_config(fd, nb_profiles, args.ports)
+            cache_filename = os.path.join(directory, 'chrandr-{}.marshal'.format(nb_profiles))
+
+            def load(use_cache=True):
+                config = chrandr.config.ChrandrConfig(filename, use_cache=use_cache)
+                if use_cache:
+                    config.cache_filename = cache_filename
+                config.load()
+                return config
+
+            def remove_cache():
+                if os.path.exists(cache_filename):
+                    os.unlink(cache_filename)
+
+            no_cache = timing(lambda: load(False), args.iterations)
+            cold = timing(load, args.iterations, setup=remove_cache)
+            warm = timing(load, args.iterations)
+            if [r.code for r in load().randr] != [r.code for r in load(False).randr]:
+                print("WARNING: {} profiles : cached and parsed configurations differ".format(nb_profiles))
+            print("{:10d} {:9d}k {:12.3f} {:12.3f} {:12.3f}".format(nb_profiles, os.path.getsize(filename) // 1024,
+                no_cache * 1000, cold * 1000, warm * 1000))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the xrandr output parser (see chrandr.model).
+
+For each recorded output in benchmarks/data (and synthetic verbose outputs generated by the fake xrandr),
+compare the regex scan of the whole text (previous get_connected_outputs implementation)
+with the streaming parser, in time and memory peak.
+    $ python3 benchmarks/bench_parser.py
+"""
+
+import io
+import os
+import re
+import sys
+import glob
+import argparse
+import statistics
+import time
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import chrandr.model
+import fake_xrandr
+
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+_CONNECTED_RE = re.compile(r"^([\w\d-]*) connected .*$", re.MULTILINE)
+
+
+def regex_scan(text):
+    return _CONNECTED_RE.findall(text)
+
+
+def stream_parse(text):
+    return chrandr.model.parse(io.StringIO(text))[0].connected_outputs()
+
+
+def timing(func, text, iterations):
+    durations = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func(text)
+        durations.append(time.perf_counter() - start)
+    return statistics.median(durations)
+
+
+def memory_peak(func):
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+
+def samples(outputs, modes):
+    """Returns a list of (name, text) : recorded outputs and synthetic verbose outputs."""
+    result = []
+    for filename in sorted(glob.glob(os.path.join(DATA_DIR, '*.txt'))):
+        with open(filename) as fd:
+            result.append((os.path.basename(filename), fd.read()))
+    for nb_modes in modes:
+        out = io.StringIO()
+        fake_xrandr.write_verbose(out, outputs, 4, nb_modes)
+        result.append(("synthetic {} outputs x {} modes".format(outputs, nb_modes), out.getvalue()))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the xrandr output parser.")
+    parser.add_argument('-n', '--iterations', type=int, default=50)
+    parser.add_argument('--outputs', type=int, default=6, help="connected outputs of synthetic outputs")
+    parser.add_argument('--modes', type=int, nargs='*', default=[20, 100, 400],
+        help="modes per output of synthetic outputs")
+    args = parser.parse_args()
+
+    print("{:40} {:>8} {:>12} {:>12} {:>12} {:>12}".format("sample", "lines", "regex ms", "parse ms",
+        "read-all peak", "stream peak"))
+    for name, text in samples(args.outputs, args.modes):
+        if regex_scan(text) != stream_parse(text):
+            print("WARNING: {} : regex and parser do not find the same outputs".format(name))
+        # memory peak : whole text in memory then parsed, versus parsed line by line from a file
+        fd, path = tempfile.mkstemp(prefix='chrandr-bench-')
+        with os.fdopen(fd, 'w') as fd:
+            fd.write(text)
+        def read_all():
+            with open(path) as fd:
+                chrandr.model.parse(fd.read().splitlines())
+        def streaming():
+            with open(path) as fd:
+                chrandr.model.parse(fd)
+        read_peak = memory_peak(read_all)
+        stream_peak = memory_peak(streaming)
+        os.unlink(path)
+        print("{:40} {:8d} {:12.3f} {:12.3f} {:11d}kB {:10d}kB".format(name, text.count('\n'),
+            timing(regex_scan, text, args.iterations) * 1000, timing(stream_parse, text, args.iterations) * 1000,
+            read_peak // 1024, stream_peak // 1024))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
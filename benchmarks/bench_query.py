@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Compare the outputs query policies (see chrandr.utils.query_outputs()).
+
+For each policy, measure the latency of the first result (outputs displayed by the window),
+and the latency of the exact outputs (probed) when a hotplug is not yet known without probe.
+Run against the current X display (ie a local Xvfb) :
+    $ Xvfb :99 & DISPLAY=:99 python3 benchmarks/bench_query.py
+or against the fake xrandr command :
+    $ python3 benchmarks/bench_query.py --fake --latency 0.2 --hotplug
+"""
+
+import os
+import sys
+import argparse
+import statistics
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import chrandr.backends
+import chrandr.utils
+import fake_xrandr
+
+
+def bench(backend, policy, iterations, timeout=10.0):
+    """
+    Returns (first durations, exact durations) in seconds of `iterations` queries.
+    The exact duration is the first one if the outputs were right, the background probe duration otherwise.
+    """
+    expected = backend.get_connected_outputs(probe=True)
+    firsts = []
+    exacts = []
+    for _ in range(iterations):
+        probed = threading.Event()
+        start = time.perf_counter()
+        outputs = chrandr.utils.query_outputs(policy, backend=backend, on_probed=lambda outputs: probed.set())
+        first = time.perf_counter() - start
+        firsts.append(first)
+        if outputs == expected:
+            exacts.append(first)
+        elif policy == chrandr.utils.QUERY_TIERED and probed.wait(timeout):
+            exacts.append(time.perf_counter() - start)
+        # wait for the end of the background probe (identical outputs), not measured
+        for thread in threading.enumerate():
+            if thread.name == 'chrandr-probe':
+                thread.join()
+    return firsts, exacts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare chrandr outputs query policies.")
+    parser.add_argument('-n', '--iterations', type=int, default=20, help="queries per policy")
+    parser.add_argument('--backend', choices=tuple(chrandr.backends.BACKENDS),
+        help="backend (default: first available)")
+    parser.add_argument('--fake', action='store_true', help="use the fake xrandr command")
+    parser.add_argument('--latency', type=float, default=0.1, help="fake xrandr probe latency in seconds")
+    parser.add_argument('--current-latency', type=float, default=0.0,
+        help="fake xrandr latency without probe in seconds")
+    parser.add_argument('--outputs', type=int, default=2, help="fake xrandr connected outputs")
+    parser.add_argument('--hotplug', action='store_true',
+        help="fake xrandr : one output is connected but not known without probe")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        if args.fake:
+            fake_xrandr.install(tmpdir)
+            os.environ['FAKE_XRANDR_LATENCY'] = str(args.latency)
+            os.environ['FAKE_XRANDR_CURRENT_LATENCY'] = str(args.current_latency)
+            os.environ['FAKE_XRANDR_OUTPUTS'] = str(args.outputs)
+            if args.hotplug:
+                os.environ['FAKE_XRANDR_CURRENT_OUTPUTS'] = str(args.outputs - 1)
+        backend = chrandr.backends.create_backend('xrandr' if args.fake else args.backend)
+        print("backend {}".format(backend.name))
+        try:
+            for policy in chrandr.utils.QUERY_POLICIES:
+                firsts, exacts = bench(backend, policy, args.iterations)
+                exact = "{:8.3f} ms".format(statistics.median(exacts) * 1000) if exacts else "   never   "
+                print("{:8} first median {:8.3f} ms  max {:8.3f} ms  exact median {}  ({}/{} exact)".format(
+                    policy, statistics.median(firsts) * 1000, max(firsts) * 1000, exact,
+                    len(exacts), len(firsts)))
+        finally:
+            backend.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
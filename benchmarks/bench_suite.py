@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark suite of chrandr, the results are written in a JSON file to be compared between commits.
+
+The fake xrandr command is put on the PATH (see fake_xrandr.py) and configurations of N profiles
+using M ports are generated (see confgen.py). Measured phases, headless (without GTK) :
+    * startup : python start, chrandr.cli import, `chrandr list` command
+    * load : ChrandrConfig.load() without (cold) and with (warm) the compiled cache
+    * available : configurations available with the connected outputs (available_randr())
+    * refresh : outputs query and available configurations (ChrandrService 'available' request),
+                with generated and recorded (benchmarks/data) xrandr outputs
+    * prepare : commands plans of the available configurations (ChrandrConfig.prepare_plans())
+    * apply : configuration apply (ChrandrService.apply_randr()), with prepared or unprepared commands,
+              with and without commands planning
+
+    $ python3 benchmarks/bench_suite.py --output bench-$(git rev-parse --short HEAD).json
+    $ python3 benchmarks/bench_suite.py --compare bench-1234567.json
+"""
+
+import os
+import sys
+import glob
+import json
+import argparse
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+sys.path.insert(0, ROOT_DIR)
+
+import chrandr.backends
+import chrandr.config
+import chrandr.daemon
+import chrandr.utils
+import confgen
+import fake_xrandr
+
+
+def timing(func, iterations, setup=None):
+    """Returns the list of durations (in seconds) of `iterations` calls."""
+    durations = []
+    for _ in range(iterations):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def result(durations, **extra):
+    """Returns the JSON result of durations, in milliseconds."""
+    values = sorted(d * 1000 for d in durations)
+    p95 = values[min(len(values) - 1, int(len(values) * 0.95))]
+    res = {'iterations': len(values), 'median_ms': statistics.median(values), 'p95_ms': p95,
+        'min_ms': values[0], 'max_ms': values[-1]}
+    res.update(extra)
+    return res
+
+
+def bench_startup(results, env, config_filename, iterations):
+    def run(args):
+        subprocess.run([sys.executable] + args, cwd=ROOT_DIR, env=env, check=True, stdout=subprocess.DEVNULL)
+
+    results['startup.python'] = result(timing(lambda: run(['-c', 'pass']), iterations))
+    results['startup.import'] = result(timing(lambda: run(['-c', 'import chrandr.cli']), iterations))
+    results['startup.list'] = result(timing(
+        lambda: run(['chrandr-dev.py', '--config', config_filename, '--no-daemon', 'list']), iterations))
+
+
+def load_config(filename, cache_filename, status_filename):
+    config = chrandr.config.ChrandrConfig(filename, use_cache=cache_filename is not None)
+    config.cache_filename = cache_filename
+    config.status_filename = status_filename
+    config.load()
+    return config
+
+
+def bench_config(results, filename, nb_profiles, status_filename, iterations):
+    """Returns the loaded configuration."""
+    cache_filename = filename + '.marshal'
+
+    def remove_cache():
+        if os.path.exists(cache_filename):
+            os.unlink(cache_filename)
+
+    results['load.cold[{}]'.format(nb_profiles)] = result(timing(
+        lambda: load_config(filename, cache_filename, status_filename), iterations, setup=remove_cache))
+    results['load.warm[{}]'.format(nb_profiles)] = result(timing(
+        lambda: load_config(filename, cache_filename, status_filename), iterations))
+    config = load_config(filename, cache_filename, status_filename)
+    outputs = chrandr.utils.get_connected_outputs()
+    results['available[{}]'.format(nb_profiles)] = result(timing(
+        lambda: config.available_randr(outputs), iterations * 10),
+        available=len(config.available_randr(outputs)))
+    return config
+
+
+def bench_refresh(results, name, config, iterations):
+    service = chrandr.daemon.ChrandrService(config)
+    results['refresh[{}]'.format(name)] = result(timing(lambda: service.request('available'), iterations),
+        outputs=len(service.get_outputs()))
+
+
+def bench_apply(results, config, nb_profiles, log_filename, iterations):
+    service = chrandr.daemon.ChrandrService(config)
+    outputs = service.get_outputs()
+    randr = config.available_randr(outputs)[-1]
+
+    def prepare(outputs):
+        # other outputs : the plans are prepared again
+        config.prepare_plans([])
+        start = time.perf_counter()
+        config.prepare_plans(outputs)
+        return time.perf_counter() - start
+
+    results['prepare[{}]'.format(nb_profiles)] = result([prepare(outputs) for _ in range(iterations)])
+    for name, skip_unchanged, prepared in (('apply', True, True), ('apply.unprepared', True, False),
+            ('apply.unplanned', False, True), ('apply.unplanned.unprepared', False, False)):
+        config.skip_unchanged = skip_unchanged
+        # plans of other outputs : the configuration commands are not prepared
+        config.prepare_plans(outputs if prepared else [])
+        open(log_filename, 'w').close()
+        durations = timing(lambda: service.apply_randr(randr), iterations)
+        with open(log_filename) as fd:
+            invocations = sum(1 for line in fd)
+        results['{}[{}]'.format(name, nb_profiles)] = result(durations, xrandr_calls=invocations / iterations)
+
+
+def compare(previous, current):
+    """Print the median durations of the current results compared with previous ones."""
+    print("{:<40} {:>12} {:>12} {:>8}".format("benchmark", "before ms", "after ms", "ratio"))
+    for name, res in current['results'].items():
+        old = previous['results'].get(name)
+        if old is None:
+            print("{:<40} {:>12} {:12.3f}".format(name, "-", res['median_ms']))
+            continue
+        ratio = res['median_ms'] / old['median_ms'] if old['median_ms'] else float('inf')
+        print("{:<40} {:12.3f} {:12.3f} {:7.2f}x{}".format(name, old['median_ms'], res['median_ms'], ratio,
+            "  slower" if ratio > 1.2 else ""))
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT_DIR, universal_newlines=True,
+            stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the chrandr benchmark suite.")
+    parser.add_argument('-n', '--iterations', type=int, default=20, help="iterations per benchmark")
+    parser.add_argument('--profiles', type=int, nargs='*', default=[10, 100, 1000], help="generated profiles")
+    parser.add_argument('--ports', type=int, default=8, help="generated ports")
+    parser.add_argument('--outputs', type=int, default=2, help="fake xrandr connected outputs")
+    parser.add_argument('--latency', type=float, default=0.0, help="fake xrandr latency in seconds")
+    parser.add_argument('--output', help="write the results in this JSON file")
+    parser.add_argument('--compare', help="compare the results with a previous JSON file")
+    args = parser.parse_args()
+
+    report = {
+        'commit': git_commit(),
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'parameters': vars(args).copy(),
+        'results': {},
+    }
+    results = report['results']
+    with tempfile.TemporaryDirectory(prefix='chrandr-bench-') as directory:
+        fake_xrandr.install(directory)
+        log_filename = os.path.join(directory, 'xrandr.log')
+        os.environ.update({
+            'FAKE_XRANDR_OUTPUTS': str(args.outputs),
+            'FAKE_XRANDR_DISCONNECTED': str(max(0, args.ports - args.outputs)),
+            'FAKE_XRANDR_LATENCY': str(args.latency),
+            'FAKE_XRANDR_LOG': log_filename,
+            # status and cache files of the commands in the temporary directory
+            'HOME': directory,
+            'XDG_RUNTIME_DIR': directory,
+            'XDG_CACHE_HOME': directory,
+        })
+        # the fake xrandr command is only used by the xrandr backend
+        chrandr.backends.set_backend('xrandr')
+        status_filename = os.path.join(directory, 'chrandr.state')
+        names = fake_xrandr.output_names(args.ports)
+        configs = {}
+        for nb_profiles in args.profiles:
+            filename = os.path.join(directory, 'chrandr-{}.conf'.format(nb_profiles))
+            with open(filename, 'w') as fd:
+                confgen.write_config(fd, nb_profiles, args.ports, names)
+            configs[nb_profiles] = filename
+
+        bench_startup(results, os.environ.copy(), configs[args.profiles[0]], args.iterations)
+        for nb_profiles, filename in configs.items():
+            config = bench_config(results, filename, nb_profiles, status_filename, args.iterations)
+            bench_refresh(results, nb_profiles, config, args.iterations)
+            bench_apply(results, config, nb_profiles, log_filename, args.iterations)
+        config = load_config(configs[args.profiles[0]], None, status_filename)
+        for recorded in sorted(glob.glob(os.path.join(DATA_DIR, '*.txt'))):
+            os.environ['FAKE_XRANDR_RECORDED'] = recorded
+            bench_refresh(results, os.path.basename(recorded), config, args.iterations)
+        del os.environ['FAKE_XRANDR_RECORDED']
+
+    for name, res in results.items():
+        print("{:<40} median {:10.3f} ms  p95 {:10.3f} ms".format(name, res['median_ms'], res['p95_ms']))
+    if args.output:
+        with open(args.output, 'w') as fd:
+            json.dump(report, fd, indent=2)
+    if args.compare:
+        with open(args.compare) as fd:
+            previous = json.load(fd)
+        print()
+        compare(previous, report)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Generator of chrandr configuration files, used by the benchmarks.
+
+Each profile uses 1 or 2 ports out of the generated ports, and one xrandr command per port.
+    $ python3 benchmarks/confgen.py --profiles 100 --ports 8 > /tmp/chrandr.conf
+"""
+
+import sys
+import argparse
+
+
+def port_names(nb_ports):
+    """Returns the generated port names, ie ['DP-1', 'DP-2', ...]."""
+    return ["DP-{}".format(index + 1) for index in range(nb_ports)]
+
+
+def write_config(out, nb_profiles, nb_ports=8, names=None):
+    """
+    Write a configuration with nb_profiles profiles using nb_ports ports.
+
+    Args:
+        * out (file): Output file
+        * nb_profiles (int): Number of randr configurations
+        * nb_ports (int): Number of ports used by the configurations
+        * names (list of str): Port names, ie fake_xrandr.output_names(), None for port_names()
+    """
+    ports = list(names[:nb_ports]) if names is not None else port_names(nb_ports)
+    out.write("[general]\ninitial = profile0\n\n")
+    for index in range(nb_profiles):
+        used = [ports[index % nb_ports]]
+        if index % 3 and nb_ports > 1:
+            used.append(ports[(index + 1) % nb_ports])
+        out.write("[profile{}]\n".format(index))
+        out.write("title = Profile {} ({})\n".format(index, ', '.join(used)))
+        out.write("ports = {}\n".format(', '.join(used)))
+        out.write("commands = xrandr --output {} --auto\n".format(used[0]))
+        for position, port in enumerate(used[1:]):
+            out.write("    xrandr --output {} --auto --right-of {}\n".format(port, used[position]))
+        out.write("\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a chrandr configuration file.")
+    parser.add_argument('--profiles', type=int, default=10, help="number of configurations")
+    parser.add_argument('--ports', type=int, default=8, help="number of ports")
+    args = parser.parse_args()
+    write_config(sys.stdout, args.profiles, args.ports)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Fake `xrandr` command used by the benchmarks.
+
+Behaviour is set with environment variables :
+    * FAKE_XRANDR_OUTPUTS : number of connected outputs (default 2)
+    * FAKE_XRANDR_OUTPUTS_<n> : number of connected outputs of the display :n (DISPLAY environment variable),
+                                ie to simulate several X servers (default FAKE_XRANDR_OUTPUTS)
+    * FAKE_XRANDR_FAIL_<n> : exit status of the commands other than queries on the display :n (default 0)
+    * FAKE_XRANDR_DISCONNECTED : number of disconnected outputs (default 4)
+    * FAKE_XRANDR_MODES : number of modes per connected output (default 10)
+    * FAKE_XRANDR_LATENCY : seconds to sleep before answering, simulates the probe (default 0)
+    * FAKE_XRANDR_CURRENT_LATENCY : seconds to sleep before answering --current, without probe (default 0)
+    * FAKE_XRANDR_CURRENT_OUTPUTS : number of connected outputs known without probe, ie before a hotplug
+                                    is probed (default FAKE_XRANDR_OUTPUTS)
+    * FAKE_XRANDR_RECORDED : recorded xrandr output file (ie in benchmarks/data) printed by query commands,
+                             instead of the generated output
+    * FAKE_XRANDR_LOG : file where the arguments of each invocation are appended, one line per invocation
+
+Query commands (no argument, --query, --current, with or without --verbose) print a xrandr-like output,
+any other command is accepted and does nothing.
+"""
+
+import os
+import sys
+import time
+
+
+PORT_NAMES = ('eDP', 'DP', 'HDMI', 'VGA', 'DVI-D', 'DVI-I')
+MODES = ((3840, 2160), (2560, 1440), (1920, 1200), (1920, 1080), (1680, 1050),
+    (1600, 900), (1440, 900), (1366, 768), (1280, 1024), (1280, 800),
+    (1280, 720), (1024, 768), (800, 600), (640, 480))
+
+
+def output_names(count):
+    """Returns `count` output names, ie ['eDP-1', 'DP-1', 'HDMI-1', ...]."""
+    names = []
+    index = 0
+    while len(names) < count:
+        names.append("{}-{}".format(PORT_NAMES[index % len(PORT_NAMES)], index // len(PORT_NAMES) + 1))
+        index += 1
+    return names
+
+
+def mode_list(count):
+    """Returns `count` (width, height, refresh) modes, in decreasing size."""
+    modes = []
+    for i in range(count):
+        width, height = MODES[i % len(MODES)]
+        modes.append((width, height, 60.0 - (i // len(MODES)) * 10.0))
+    return modes
+
+
+def write_query(out, connected, disconnected, nb_modes):
+    """Write a `xrandr --query` like output."""
+    names = output_names(connected + disconnected)
+    width, height = MODES[0] if nb_modes else (0, 0)
+    out.write("Screen 0: minimum 8 x 8, current {} x {}, maximum 32767 x 32767\n".format(
+        width * connected, height))
+    for index, name in enumerate(names):
+        if index < connected:
+            out.write("{} connected {}{}x{}+{}+0 (normal left inverted right x axis y axis) 527mm x 296mm\n".format(
+                name, 'primary ' if index == 0 else '', width, height, width * index))
+            for mode_index, (w, h, rate) in enumerate(mode_list(nb_modes)):
+                flags = '*+' if mode_index == 0 else '  '
+                out.write("   {:<13} {:6.2f}{}\n".format("{}x{}".format(w, h), rate, flags))
+        else:
+            out.write("{} disconnected (normal left inverted right x axis y axis)\n".format(name))
+
+
+def install(directory):
+    """
+    Install an executable `xrandr` wrapper calling this script in `directory`,
+    and put `directory` at the beginning of the PATH environment variable.
+    """
+    filename = os.path.join(directory, 'xrandr')
+    with open(filename, 'w') as fd:
+        fd.write("#!/bin/sh\nexec '{}' '{}' \"$@\"\n".format(sys.executable, os.path.abspath(__file__)))
+    os.chmod(filename, 0o755)
+    os.environ['PATH'] = directory + os.pathsep + os.environ.get('PATH', '')
+    return filename
+
+
+def fake_edid(index):
+    """Returns a fake 256 bytes EDID for the output index."""
+    header = bytes.fromhex('00ffffffffffff00')
+    return header + bytes((index * 7 + i) % 256 for i in range(256 - len(header)))
+
+
+def write_verbose(out, connected, disconnected, nb_modes):
+    """Write a `xrandr --query --verbose` like output."""
+    names = output_names(connected + disconnected)
+    width, height = MODES[0] if nb_modes else (0, 0)
+    modes = mode_list(nb_modes)
+    out.write("Screen 0: minimum 8 x 8, current {} x {}, maximum 32767 x 32767\n".format(
+        width * connected, height))
+    for index, name in enumerate(names):
+        mode_base = 0x40 + index * nb_modes
+        if index < connected:
+            out.write("{} connected {}{}x{}+{}+0 (0x{:x}) normal (normal left inverted right x axis y axis)"
+                " 527mm x 296mm\n".format(name, 'primary ' if index == 0 else '', width, height, width * index,
+                mode_base))
+        else:
+            out.write("{} disconnected (normal left inverted right x axis y axis)\n".format(name))
+        out.write("\tIdentifier: 0x{:x}\n\tTimestamp:  12345678\n\tSubpixel:   unknown\n".format(0x100 + index))
+        if index < connected:
+            out.write("\tGamma:      1.0:1.0:1.0\n\tBrightness: 1.0\n\tClones:    \n\tCRTC:       {}\n".format(index))
+        out.write("\tCRTCs:      0 1 2 3\n")
+        out.write("\tTransform:  1.000000 0.000000 0.000000\n"
+            "\t            0.000000 1.000000 0.000000\n"
+            "\t            0.000000 0.000000 1.000000\n"
+            "\t           filter: \n")
+        if index < connected:
+            edid = fake_edid(index).hex()
+            out.write("\tEDID: \n")
+            for offset in range(0, len(edid), 32):
+                out.write("\t\t" + edid[offset:offset + 32] + "\n")
+            out.write("\tscaling mode: None \n\t\tsupported: None, Full, Center, Full aspect\n")
+            for mode_index, (w, h, rate) in enumerate(modes):
+                flags = ' *current +preferred' if mode_index == 0 else ''
+                out.write("  {}x{} (0x{:x}) {:.3f}MHz +HSync -VSync{}\n".format(w, h, mode_base + mode_index,
+                    w * h * rate * 1.25 / 1000000, flags))
+                out.write("        h: width  {} start {} end {} total {} skew    0 clock  {:.2f}KHz\n".format(
+                    w, w + 48, w + 80, w + 160, h * rate * 1.03 / 1000))
+                out.write("        v: height {} start {} end {} total {}           clock  {:.2f}Hz\n".format(
+                    h, h + 3, h + 8, h + 31, rate))
+
+
+def main(argv):
+    log_filename = os.getenv('FAKE_XRANDR_LOG')
+    if log_filename:
+        with open(log_filename, 'a') as fd:
+            fd.write(' '.join(argv) + '\n')
+    current = '--current' in argv
+    latency = float(os.getenv('FAKE_XRANDR_CURRENT_LATENCY' if current else 'FAKE_XRANDR_LATENCY', '0'))
+    if latency:
+        time.sleep(latency)
+    display = os.getenv('DISPLAY', '').lstrip(':').split('.')[0]
+    if len(argv) == 0 or argv[0] in ('-q', '--query', '--current', '--verbose'):
+        recorded = os.getenv('FAKE_XRANDR_RECORDED')
+        if recorded:
+            with open(recorded) as fd:
+                sys.stdout.write(fd.read())
+            return 0
+        write = write_verbose if '--verbose' in argv else write_query
+        connected = int(os.getenv('FAKE_XRANDR_OUTPUTS_' + display) or os.getenv('FAKE_XRANDR_OUTPUTS', '2'))
+        # same connectors, only their connection state differs without probe
+        total = connected + int(os.getenv('FAKE_XRANDR_DISCONNECTED', '4'))
+        if current:
+            connected = min(int(os.getenv('FAKE_XRANDR_CURRENT_OUTPUTS', str(connected))), total)
+        write(sys.stdout, connected, total - connected, int(os.getenv('FAKE_XRANDR_MODES', '10')))
+        return 0
+    status = int(os.getenv('FAKE_XRANDR_FAIL_' + display, '0'))
+    if status:
+        sys.stderr.write("xrandr: cannot apply on display :{}\n".format(display))
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
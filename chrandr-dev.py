@@ -6,7 +6,7 @@ Helper script to execute Rename Episode main method
 """
 
 import sys
-from chrandr import simple_gui
+from chrandr import cli
 
 if __name__ == '__main__':
-    sys.exit(simple_gui.main())
+    sys.exit(cli.main())
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+chrandr - Built-in actions
+
+Programs replaced by an in-process implementation, instead of being executed :
+    * notify-send : desktop notification sent over D-Bus (org.freedesktop.Notifications, gi module)
+
+An action raises ActionUnavailable when it cannot handle a command (unsupported option, no D-Bus...),
+the program is then executed (see chrandr.utils.run_command()).
+"""
+
+import os.path
+import getopt
+import logging
+
+
+class ActionUnavailable(Exception):
+    """Raised when an action cannot handle a command, the program must be executed."""
+    pass
+
+
+# actions by program name
+ACTIONS = {}
+
+
+def action(program):
+    """
+    Decorator registering a built-in action replacing a program.
+    The action is called with (args, timeout), args[0] being the program, and returns the command output.
+    """
+    def register(func):
+        ACTIONS[program] = func
+        return func
+    return register
+
+
+def get_action(program):
+    """Returns the built-in action replacing a program (name or path), None if there is no one."""
+    return ACTIONS.get(os.path.basename(program))
+
+
+_URGENCIES = {'low': 0, 'normal': 1, 'critical': 2}
+
+
+@action('notify-send')
+def notify_send(args, timeout=None):
+    """
+    Send a desktop notification, as `notify-send [options] <summary> [body]`.
+    Supported options : --urgency, --expire-time, --app-name, --icon, --category, --transient.
+    """
+    logger = logging.getLogger('notify_send')
+    try:
+        options, arguments = getopt.gnu_getopt(args[1:], 'u:t:a:i:c:e',
+            ['urgency=', 'expire-time=', 'app-name=', 'icon=', 'category=', 'transient'])
+    except getopt.GetoptError as e:
+        raise ActionUnavailable("notify-send : " + str(e)) from e
+    if not 1 <= len(arguments) <= 2:
+        raise ActionUnavailable("notify-send : invalid arguments")
+    try:
+        import gi
+        gi.require_version('Gio', '2.0')
+        from gi.repository import Gio
+        from gi.repository import GLib
+    except (ImportError, ValueError) as e:
+        raise ActionUnavailable("gi module not found") from e
+    app_name = 'notify-send'
+    icon = ''
+    expire = -1
+    hints = {}
+    for option, value in options:
+        if option in ('-u', '--urgency'):
+            if value not in _URGENCIES:
+                raise ActionUnavailable("notify-send : invalid urgency " + value)
+            hints['urgency'] = GLib.Variant('y', _URGENCIES[value])
+        elif option in ('-t', '--expire-time'):
+            try:
+                expire = int(value)
+            except ValueError as e:
+                raise ActionUnavailable("notify-send : invalid expire time " + value) from e
+        elif option in ('-a', '--app-name'):
+            app_name = value
+        elif option in ('-i', '--icon'):
+            icon = value
+        elif option in ('-c', '--category'):
+            hints['category'] = GLib.Variant('s', value)
+        elif option in ('-e', '--transient'):
+            hints['transient'] = GLib.Variant('b', True)
+    summary = arguments[0]
+    body = arguments[1] if len(arguments) > 1 else ''
+    try:
+        bus = Gio.bus_get_sync(Gio.BusType.SESSION, None)
+        bus.call_sync('org.freedesktop.Notifications', '/org/freedesktop/Notifications',
+            'org.freedesktop.Notifications', 'Notify',
+            GLib.Variant('(susssasa{sv}i)', (app_name, 0, icon, summary, body, [], hints, expire)),
+            GLib.VariantType('(u)'), Gio.DBusCallFlags.NONE, -1 if timeout is None else int(timeout * 1000), None)
+    except GLib.Error as e:
+        raise ActionUnavailable("D-Bus notification failed: " + str(e)) from e
+    logger.debug("Notification sent: %s", summary)
+    return ''
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""
+chrandr - Automatic configuration selection.
+
+The last configuration applied for a set of connected outputs is remembered,
+the set is identified by a fingerprint of the outputs names and EDID.
+When outputs change, the remembered configuration is selected,
+or the available configuration covering the most connected outputs.
+"""
+
+import os
+import hashlib
+import logging
+import configparser
+
+from chrandr.config import _get_data_filename
+
+
+def fingerprint(outputs, edids=None):
+    """
+    Returns the fingerprint (str) of a set of connected outputs.
+
+    Args:
+        * outputs (list of str): Connected outputs, ie ['LVDS-1', 'VGA-1']
+        * edids (dict): EDID (bytes) of the outputs, by output name
+    """
+    edids = edids or {}
+    digest = hashlib.sha1()
+    for output in sorted(outputs):
+        digest.update(output.encode('utf-8'))
+        digest.update(b'\0')
+        digest.update(hashlib.sha1(edids.get(output, b'')).digest())
+    return digest.hexdigest()
+
+
+def best_match(randr_configs, outputs):
+    """
+    Returns the configuration whose ports cover the most connected outputs,
+    the first one in configuration order on equality. None if no configuration covers an output.
+
+    Args:
+        * randr_configs (list of RandrConfig): Available configurations
+        * outputs (list of str): Connected outputs
+    """
+    best = None
+    best_coverage = 0
+    for randr in randr_configs:
+        coverage = len(randr.matched_outputs(outputs))
+        if coverage > best_coverage:
+            best = randr
+            best_coverage = coverage
+    return best
+
+
+class OutputsMemory:
+    """
+    Persistent map from an outputs fingerprint to the last configuration code applied.
+    Stored in the data directory ($XDG_DATA_HOME/chrandr/outputs.memory).
+
+    Fields:
+        * filename (str): Memory filename
+    """
+
+    SECTION = 'memory'
+
+    def __init__(self, filename=None):
+        self._logger = logging.getLogger(self.__class__.__name__)
+        self.filename = filename if filename else _get_data_filename('outputs.memory')
+        self._codes = {}
+
+    def load(self):
+        """Load the memory file, a missing file is an empty memory."""
+        memory = configparser.ConfigParser(interpolation=None)
+        memory.read(self.filename, encoding='UTF-8')
+        if self.SECTION in memory:
+            self._codes = dict(memory[self.SECTION])
+        self._logger.debug("%d outputs sets remembered", len(self._codes))
+
+    def save(self):
+        """Save the memory file."""
+        memory = configparser.ConfigParser(interpolation=None)
+        memory[self.SECTION] = self._codes
+        tmp_filename = self.filename + '.tmp'
+        with open(tmp_filename, 'w') as fd:
+            memory.write(fd, space_around_delimiters=True)
+        os.replace(tmp_filename, self.filename)
+
+    def get(self, key):
+        """Returns the configuration code remembered for the fingerprint, None if unknown."""
+        return self._codes.get(key)
+
+    def remember(self, key, code):
+        """Remember the configuration code for the fingerprint, the file is saved if changed."""
+        if self._codes.get(key) != code:
+            self._codes[key] = code
+            self.save()
+
+
+class AutoSelector:
+    """
+    Select the configuration to apply when outputs change.
+
+    Fields:
+        * config (ChrandrConfig): Configuration
+        * memory (OutputsMemory): Remembered configurations
+        * key (str): Fingerprint of the current outputs, None before the first update
+    """
+
+    def __init__(self, config, memory=None):
+        self._logger = logging.getLogger(self.__class__.__name__)
+        self.config = config
+        if memory is None:
+            memory = OutputsMemory()
+            memory.load()
+        self.memory = memory
+        self.key = None
+
+    def update(self, outputs, edids=None):
+        """
+        Update the current outputs.
+
+        Returns:
+            The RandrConfig to apply, None if nothing to apply (no match or already active).
+        """
+        self.key = fingerprint(outputs, edids)
+        code = self.memory.get(self.key)
+        randr = None
+        if code is not None:
+            randr = self.config.get_randr(code)
+            if randr is not None and not randr.available(outputs):
+                randr = None
+        if randr is None:
+            randr = best_match(self.config.available_randr(outputs), outputs)
+        if randr is None or randr.code == self.config.active:
+            self._logger.debug("Outputs %s : nothing to apply", outputs)
+            return None
+        self._logger.debug("Outputs %s : configuration '%s' selected", outputs, randr.code)
+        return randr
+
+    def remember(self, randr):
+        """Remember the configuration applied for the current outputs."""
+        if self.key is not None and randr is not None:
+            self.memory.remember(self.key, randr.code)
@@ -0,0 +1,310 @@
+# -*- coding: utf-8 -*-
+"""
+chrandr - Output discovery backends
+
+A backend returns the list of connected outputs (ie ['LVDS-1', 'VGA-1']).
+The outputs are probed (slow, the X server checks every connector) or not (last known outputs of the X server).
+Backends also return the whole screen state (see chrandr.model).
+Two backends are available :
+    * 'randr' : in-process RandR query over the X socket (python-xlib module)
+    * 'xrandr' : execute `xrandr --query` and parse its output (fallback)
+A backend queries the display of the DISPLAY environment variable, or another one given to create_backend().
+"""
+
+import os
+import logging
+import subprocess
+import re
+import threading
+
+import chrandr.model
+
+
+class BackendUnavailable(Exception):
+    """Raised when a backend cannot be used (missing module, no display...)."""
+    pass
+
+
+class OutputBackend:
+    """
+    Base class of the output discovery backends.
+
+    Fields:
+        * name (str): Backend name used in get_backend()
+    """
+
+    name = None
+
+    def get_connected_outputs(self, probe=True):
+        """
+        Returns the list of connected outputs, in the RandR outputs order.
+
+        Args:
+            * probe (bool): Probe the outputs, False to get the last known outputs (faster, could be outdated)
+        """
+        raise NotImplementedError()
+
+    def get_output_edids(self, probe=True):
+        """
+        Returns the EDID of the connected outputs, in a dict {output name: EDID bytes}.
+        Outputs without EDID are not in the dict.
+
+        Args:
+            * probe (bool): Probe the outputs, False to get the last known outputs (faster, could be outdated)
+        """
+        return {o.name: o.edid for o in self.get_state(probe).outputs if o.connected and o.edid}
+
+    def get_state(self, probe=True):
+        """
+        Returns the current state of the screen (chrandr.model.Screen).
+
+        Args:
+            * probe (bool): Probe the outputs, False to get the last known state (faster, could be outdated)
+        """
+        raise NotImplementedError()
+
+    def close(self):
+        """Release resources hold by the backend."""
+        pass
+
+    def __str__(self):
+        return "{}(name={})".format(self.__class__.__name__, self.name)
+    def __repr__(self):
+        return self.__str__()
+
+
+class XrandrBackend(OutputBackend):
+    """Backend executing the `xrandr --query` command and parsing its output."""
+
+    name = 'xrandr'
+
+    _CONNECTED_RE = re.compile(r"^([\w\d-]*) connected .*$", re.MULTILINE)
+
+    def __init__(self, display=None):
+        """
+        Args:
+            * display (str): X display (ie ':1'), None for the DISPLAY environment variable
+        """
+        # xrandr is executed with DISPLAY set to the display
+        self._env = None if display is None else dict(os.environ, DISPLAY=display)
+
+    def get_connected_outputs(self, probe=True):
+        logger = logging.getLogger('XrandrBackend')
+        # execute xrandr query command
+        xrandr_output = subprocess.check_output(args=["xrandr", "--query" if probe else "--current"],
+            universal_newlines=True, env=self._env)
+        # logger.debug("xrandr --query output :\n%s", xrandr_output)
+        # match output to find all connected outputs
+        connected_outputs = self._CONNECTED_RE.findall(xrandr_output)
+        logger.debug("Connected outputs: %s", connected_outputs)
+        return connected_outputs
+
+    def get_output_edids(self, probe=True):
+        screen = chrandr.model.query_state(verbose=True, current=not probe, env=self._env)
+        return {o.name: o.edid for o in screen.outputs if o.connected and o.edid}
+
+    def get_state(self, probe=True):
+        return chrandr.model.query_state(verbose=True, current=not probe, env=self._env)
+
+
+class RandrBackend(OutputBackend):
+    """
+    Backend querying the RandR extension in-process, using python-xlib.
+    The X connection is opened once and reused by following queries, queries are serialized.
+    """
+
+    name = 'randr'
+
+    def __init__(self, display_name=None):
+        """
+        Open the X display connection.
+
+        Args:
+            * display_name (str): X display (ie ':1'), None for the DISPLAY environment variable
+        Raises:
+            BackendUnavailable: If python-xlib is missing or the display/extension is not available.
+        """
+        try:
+            from Xlib import display
+            from Xlib.ext import randr
+            from Xlib.error import DisplayError
+        except ImportError as e:
+            raise BackendUnavailable("python-xlib module not found") from e
+        self._randr = randr
+        try:
+            self._display = display.Display(display_name)
+        except DisplayError as e:
+            raise BackendUnavailable("Cannot open the X display") from e
+        if not self._display.has_extension('RANDR'):
+            self._display.close()
+            raise BackendUnavailable("RANDR extension not available")
+        self._root = self._display.screen().root
+        self._lock = threading.RLock()
+
+    def _connected(self, probe=True):
+        """Returns the connected outputs, as a list of (output id, output info)."""
+        if probe:
+            resources = self._root.xrandr_get_screen_resources()
+        else:
+            resources = self._root.xrandr_get_screen_resources_current()
+        connected = []
+        for output in resources.outputs:
+            info = self._display.xrandr_get_output_info(output, resources.config_timestamp)
+            if info.connection == self._randr.Connected:
+                connected.append((output, info))
+        return connected
+
+    def get_connected_outputs(self, probe=True):
+        logger = logging.getLogger('RandrBackend')
+        with self._lock:
+            connected_outputs = [info.name for output, info in self._connected(probe)]
+        logger.debug("Connected outputs: %s", connected_outputs)
+        return connected_outputs
+
+    def _get_edid(self, output):
+        """Returns the EDID (bytes) of an output, None if not available."""
+        # AnyPropertyType (0), EDID is at most 256 bytes with its extension block
+        prop = self._display.xrandr_get_output_property(output, self._display.get_atom('EDID'), 0, 0, 64)
+        return bytes(prop.value) if prop.value else None
+
+    def get_output_edids(self, probe=True):
+        edids = {}
+        with self._lock:
+            for output, info in self._connected(probe):
+                edid = self._get_edid(output)
+                if edid:
+                    edids[info.name] = edid
+        return edids
+
+    def get_state(self, probe=True):
+        with self._lock:
+            return self._get_state(probe)
+
+    def _get_state(self, probe=True):
+        if probe:
+            resources = self._root.xrandr_get_screen_resources()
+        else:
+            resources = self._root.xrandr_get_screen_resources_current()
+        timestamp = resources.config_timestamp
+        geometry = self._root.get_geometry()
+        size_range = self._root.xrandr_get_screen_size_range()
+        screen = chrandr.model.Screen(self._display.get_default_screen(), width=geometry.width,
+            height=geometry.height, minimum=(size_range.min_width, size_range.min_height),
+            maximum=(size_range.max_width, size_range.max_height))
+        primary = self._root.xrandr_get_output_primary().output
+        # mode names are concatenated in resources.mode_names
+        modes = {}
+        offset = 0
+        mode_names = resources.mode_names
+        if isinstance(mode_names, bytes):
+            mode_names = mode_names.decode('latin-1')
+        for mode_info in resources.modes:
+            name = mode_names[offset:offset + mode_info.name_length]
+            offset += mode_info.name_length
+            refresh = None
+            if mode_info.h_total and mode_info.v_total:
+                refresh = mode_info.dot_clock / (mode_info.h_total * mode_info.v_total)
+            modes[mode_info.id] = (name, mode_info.width, mode_info.height, refresh)
+        crtcs = {}
+        for output_id in resources.outputs:
+            info = self._display.xrandr_get_output_info(output_id, timestamp)
+            output = chrandr.model.Output(info.name, connected=(info.connection == self._randr.Connected),
+                primary=(output_id == primary))
+            crtc = None
+            if info.crtc:
+                if info.crtc not in crtcs:
+                    crtcs[info.crtc] = self._display.xrandr_get_crtc_info(info.crtc, timestamp)
+                crtc = crtcs[info.crtc]
+                output.crtc = info.crtc
+                output.x, output.y = crtc.x, crtc.y
+                output.width, output.height = crtc.width, crtc.height
+                output.rotation, output.reflection = _rotation_names(crtc.rotation)
+            for index, mode_id in enumerate(info.modes):
+                name, width, height, refresh = modes[mode_id]
+                output.modes.append(chrandr.model.Mode(name, width, height, refresh=refresh, id=mode_id,
+                    current=(crtc is not None and crtc.mode == mode_id),
+                    preferred=(index < info.num_preferred)))
+            if output.connected:
+                output.edid = self._get_edid(output_id)
+            screen.outputs.append(output)
+        return screen
+
+    def close(self):
+        self._display.close()
+
+
+def _rotation_names(rotation):
+    """Returns (rotation name, reflection name or None) of a RandR rotation bits mask."""
+    # rotation bits : 1 normal, 2 left, 4 inverted, 8 right ; reflection bits : 16 X, 32 Y
+    name = 'normal'
+    for bit, rotation_name in zip((1, 2, 4, 8), chrandr.model.ROTATIONS):
+        if rotation & bit:
+            name = rotation_name
+    reflection = None
+    if rotation & 48 == 48:
+        reflection = 'X and Y axis'
+    elif rotation & 16:
+        reflection = 'X axis'
+    elif rotation & 32:
+        reflection = 'Y axis'
+    return name, reflection
+
+
+# Backends in preference order
+BACKENDS = {
+    RandrBackend.name: RandrBackend,
+    XrandrBackend.name: XrandrBackend,
+}
+DEFAULT_BACKENDS = (RandrBackend.name, XrandrBackend.name)
+
+_backend = None
+
+
+def create_backend(name=None, display=None):
+    """
+    Create an output discovery backend.
+
+    Args:
+        * name (str): Backend name ('randr' or 'xrandr'), None to use the first available
+        * display (str): X display (ie ':1'), None for the DISPLAY environment variable
+    Returns:
+        The created OutputBackend.
+    Raises:
+        BackendUnavailable: If the requested backend cannot be used.
+        KeyError: If the backend name is unknown.
+    """
+    logger = logging.getLogger('create_backend')
+    if name is not None:
+        return BACKENDS[name](display)
+    for backend_name in DEFAULT_BACKENDS:
+        try:
+            backend = BACKENDS[backend_name](display)
+        except BackendUnavailable as e:
+            logger.info("Backend '%s' unavailable: %s", backend_name, e)
+        else:
+            logger.debug("Using output backend '%s'", backend_name)
+            return backend
+    raise BackendUnavailable("No output backend available")
+
+
+def get_backend():
+    """Returns the shared default backend, created on first call."""
+    global _backend
+    if _backend is None:
+        _backend = create_backend()
+    return _backend
+
+
+def set_backend(backend):
+    """
+    Set the shared default backend.
+
+    Args:
+        * backend (OutputBackend or str): Backend instance or backend name
+    """
+    global _backend
+    if isinstance(backend, str):
+        backend = create_backend(backend)
+    if _backend is not None and _backend is not backend:
+        _backend.close()
+    _backend = backend
@@ -0,0 +1,393 @@
+# -*- coding: utf-8 -*-
+"""
+chrandr - Command line interface.
+
+Without subcommand, the GTK window is opened (GTK is only imported in this case).
+Subcommands are headless, ie to bind configurations to hotkeys :
+    * list : list all configurations
+    * status : show the active configuration and connected outputs
+    * available : list the configurations available with the connected outputs
+    * apply <code> : apply a configuration
+    * daemon : run the daemon, the previous commands are then sent to it (see chrandr.daemon)
+    * layouts : list the layouts history, captured before each apply (see chrandr.snapshot)
+    * rollback [<index>] : restore a layout of the history, the one before the last apply by default
+    * displays [<display>...] : select and apply configurations on several X displays (see chrandr.displays)
+    * metrics : export the applies and commands metrics (see chrandr.metrics)
+    * trace-summary <file>... : print the phases durations of trace files written with --trace (see chrandr.trace)
+"""
+
+import os
+import os.path
+import sys
+import logging
+import argparse
+import signal
+import threading
+
+import chrandr.utils
+import chrandr.config
+import chrandr.backends
+import chrandr.client
+import chrandr.trace
+from chrandr.config import ChrandrConfig
+
+
+class _VersionAction(argparse.Action):
+    """Print the version, computed only when the option is used."""
+
+    def __init__(self, option_strings, dest=argparse.SUPPRESS, default=argparse.SUPPRESS, help=None):
+        super().__init__(option_strings=option_strings, dest=dest, default=default, nargs=0, help=help)
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        try:
+            from importlib import metadata
+            current_version = metadata.version('chrandr')
+        except Exception:
+            current_version = 'dev'
+        parser.exit(message="{} {}\n".format(parser.prog, current_version))
+
+
+def _configure_logging(args):
+    """Configure application logging."""
+    log_root = logging.getLogger()
+    if args.verbose:
+        log_root.setLevel(logging.DEBUG)
+        log_handler = logging.StreamHandler(sys.stdout)
+        log_formatter = logging.Formatter(
+            "%(asctime)s:%(levelname)s:%(name)s: %(message)s",
+            '%H:%M:%S')
+    else:
+        log_root.setLevel(logging.WARN)
+        log_handler = logging.StreamHandler(sys.stderr)
+        log_formatter = logging.Formatter(
+            os.path.basename(sys.argv[0]) + ": %(asctime)s:%(levelname)s:%(name)s: %(message)s",
+            '%H:%M:%S')
+    # add to format for debugging :
+    #   function name : %(funcName)s
+    log_handler.setFormatter(log_formatter)
+    log_root.addHandler(log_handler)
+
+
+def _error(message):
+    """Write an error message and exit."""
+    sys.stderr.write(sys.argv[0] + ": " + message + "\n")
+    sys.exit(1)
+
+
+def _load_config(args):
+    """Returns the loaded ChrandrConfig, the default configuration is created if needed."""
+    logger = logging.getLogger('_load_config')
+    if args.config is None:
+        config_filename = chrandr.config.DEFAULT_CONFIGURATION_FILENAME
+        if not os.path.exists(config_filename):
+            logger.info("Create default configuration file: %s", config_filename)
+            try:
+                chrandr.config.create_default_configuration(config_filename)
+            except Exception as e:
+                logger.error("Failed to create default configuration", exc_info=True)
+                _error("Failed to create the configuration file : " + str(e))
+    else:
+        config_filename = os.path.expanduser(args.config)
+
+    config = ChrandrConfig(config_filename)
+    try:
+        config.load()
+    except FileNotFoundError as e:
+        _error("Failed to open the configuration file : " + str(e))
+    if args.auto:
+        config.auto_apply = True
+    if args.query is not None:
+        config.query = args.query
+    # applies and commands of this process are recorded
+    config.get_metrics()
+    return config
+
+
+def _get_local_service(args):
+    """Returns a ChrandrService using the configuration file."""
+    import chrandr.daemon
+    return chrandr.daemon.ChrandrService(_load_config(args))
+
+
+def _request(args, command, **params):
+    """
+    Send a request to the daemon if it is running, or to a local ChrandrService.
+    Exit on error.
+    """
+    logger = logging.getLogger('_request')
+    service = None
+    # the daemon is not used with another configuration file
+    if not args.no_daemon and args.config is None:
+        client = chrandr.client.ChrandrClient(timeout=args.daemon_timeout)
+        if os.path.exists(client.socket_filename):
+            logger.debug("Using the daemon on %s", client.socket_filename)
+            service = client
+    if service is None:
+        service = _get_local_service(args)
+    try:
+        try:
+            return service.request(command, **params)
+        except (ConnectionRefusedError, FileNotFoundError) as e:
+            # daemon not running (stale socket)
+            logger.info("Daemon not reachable: %s", e)
+            return _get_local_service(args).request(command, **params)
+    except chrandr.client.DaemonError as e:
+        sys.stderr.write(sys.argv[0] + ": " + str(e) + "\n")
+        if e.response.get('output'):
+            sys.stderr.write(e.response['output'])
+        sys.exit(1)
+    except OSError as e:
+        _error("Cannot connect to the daemon : " + str(e))
+
+
+def cmd_gui(args):
+    """Open the GTK window."""
+    config = _load_config(args)
+    # GTK is imported only when the window is requested
+    import chrandr.simple_gui
+    chrandr.simple_gui.run(config, watch=not args.no_watch)
+    return 0
+
+
+def cmd_daemon(args):
+    """Run the daemon until SIGTERM/SIGINT."""
+    import chrandr.daemon
+    service = _get_local_service(args)
+    try:
+        server = chrandr.daemon.ChrandrDaemon(service)
+    except OSError as e:
+        _error("Cannot start the daemon : " + str(e))
+    # shutdown() must be called from another thread than serve_forever()
+    def stop(signum, frame):
+        threading.Thread(target=server.shutdown).start()
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    if not args.no_watch:
+        server.watch_outputs()
+        server.watch_config()
+    server.serve()
+    return 0
+
+
+def cmd_list(args):
+    """Print all configurations, the active one is marked with '*'."""
+    response = _request(args, 'list')
+    for randr in response['randr']:
+        print("{} {}\t{}\t{}".format('*' if randr['code'] == response['active'] else ' ', randr['code'],
+            randr['title'] or '', ','.join(randr['ports'])))
+    return 0
+
+
+def cmd_status(args):
+    """Print the active configuration and the connected outputs."""
+    response = _request(args, 'status')
+    print("active: {}".format(response['active'] or ''))
+    print("outputs: {}".format(','.join(response['outputs'])))
+    return 0
+
+
+def cmd_available(args):
+    """Print the configurations available with the connected outputs."""
+    for code in _request(args, 'available')['codes']:
+        print(code)
+    return 0
+
+
+def cmd_apply(args):
+    """Apply a configuration, the previous layout is restored if it is not confirmed in time."""
+    response = _request(args, 'apply', code=args.code, force=args.force)
+    if args.confirm is None:
+        return 0
+    if response.get('layout') is None:
+        _error("No previous layout captured (rollback disabled ?), the configuration is kept")
+    if not _confirm("Keep this configuration ? [y/N] ", args.confirm):
+        # the layout captured by this apply, not the last one of the history (another apply, or no history)
+        response = _request(args, 'rollback', layout=response['layout'])
+        print("Previous layout restored: {}".format(response['layout']))
+    return 0
+
+
+def _confirm(question, timeout):
+    """Ask a question on the terminal, returns True if answered 'y' before timeout (in seconds)."""
+    import select
+    sys.stderr.write("{}({:g}s) ".format(question, timeout))
+    sys.stderr.flush()
+    readable, _, _ = select.select([sys.stdin], [], [], timeout)
+    if not readable:
+        sys.stderr.write("\n")
+        return False
+    return sys.stdin.readline().strip().lower() in ('y', 'yes')
+
+
+def cmd_layouts(args):
+    """Print the layouts history, most recent first."""
+    import time
+    for index, layout in enumerate(_request(args, 'layouts')['layouts']):
+        print("{}\t{}\t{}\t{}".format(index, time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(layout['time'])),
+            layout['code'] or '-', layout['layout']))
+    return 0
+
+
+def cmd_rollback(args):
+    """Restore a layout of the history."""
+    response = _request(args, 'rollback', index=args.index)
+    print("Layout restored: {}".format(response['layout']))
+    return 0
+
+
+def cmd_displays(args):
+    """Select (and apply) the configuration of each display, print the report."""
+    import chrandr.displays
+    config = _load_config(args)
+    displays = args.displays or chrandr.displays.discover_displays()
+    if not displays:
+        _error("No X display found in " + chrandr.displays.X11_SOCKET_DIR)
+    results = chrandr.displays.run_displays(config, displays, apply=args.apply, code=args.code,
+        backend_name=args.backend)
+    if args.json:
+        import json
+        print(json.dumps([result.as_dict() for result in results], indent=2))
+    else:
+        for result in results:
+            status = "error: " + result.error if result.error else ('applied' if result.applied else 'selected')
+            print("{}\t{}\t{}\t{}".format(result.display, result.code or '-', ','.join(result.outputs or []),
+                status))
+            if result.output:
+                sys.stderr.write(result.output)
+    return 1 if any(result.error for result in results) else 0
+
+
+def cmd_trace_summary(args):
+    """Print the durations percentiles of each phase recorded in trace files."""
+    try:
+        summary = chrandr.trace.summarize(args.files)
+    except (OSError, ValueError, KeyError) as e:
+        _error("Cannot read the trace files : " + str(e))
+    print("{:<16} {:>6} {:>10} {:>10} {:>10}".format("phase", "count", "p50 ms", "p95 ms", "max ms"))
+    for name, count, p50, p95, maximum in summary:
+        print("{:<16} {:6d} {:10.3f} {:10.3f} {:10.3f}".format(name, count, p50, p95, maximum))
+    return 0
+
+
+def cmd_metrics(args):
+    """Export the recorded metrics, in the Prometheus text format or in JSON."""
+    import chrandr.metrics_file
+    try:
+        series = chrandr.metrics_file.read(chrandr.config.get_metrics_filename())
+    except (OSError, ValueError) as e:
+        _error("Cannot read the metrics : " + str(e))
+    if args.format == 'json':
+        text = chrandr.metrics_file.format_json(series)
+    else:
+        text = chrandr.metrics_file.format_prometheus(series)
+    if args.output is None:
+        sys.stdout.write(text)
+        return 0
+    # written then renamed : the textfile collector never reads a partial file
+    tmp_filename = args.output + '.tmp'
+    try:
+        with open(tmp_filename, 'w') as fd:
+            fd.write(text)
+        os.replace(tmp_filename, args.output)
+    except OSError as e:
+        _error("Cannot write the metrics : " + str(e))
+    return 0
+
+
+def _write_trace(filename):
+    """Write the recorded spans in a trace file."""
+    logger = logging.getLogger('_write_trace')
+    try:
+        filename = chrandr.trace.get_tracer().write(filename)
+    except OSError as e:
+        logger.error("Cannot write the trace file: %s", e)
+    else:
+        logger.info("Trace written in %s", filename)
+
+
+def main(argv=None):
+    """Entry point of chrandr."""
+    # command line arguments
+    parser = argparse.ArgumentParser(
+        description="Change screen configuration."
+    )
+    parser.add_argument('--version', action=_VersionAction, help="show program's version number and exit")
+    parser.add_argument('--verbose', help="verbose output messages", action='store_true')
+    parser.add_argument('--config', help="set the configuration file")
+    parser.add_argument('--backend', help="set the output discovery backend",
+        choices=sorted(chrandr.backends.BACKENDS))
+    parser.add_argument('--no-watch', help="do not watch outputs and configuration changes, use the refresh button",
+        action='store_true')
+    parser.add_argument('--auto', help="apply a configuration automatically when outputs change",
+        action='store_true')
+    parser.add_argument('--query', help="outputs query policy, probe or not the outputs (default: configuration)",
+        choices=chrandr.utils.QUERY_POLICIES)
+    parser.add_argument('--no-daemon', help="do not use the daemon, even if it is running",
+        action='store_true')
+    parser.add_argument('--daemon-timeout', help="daemon requests timeout in seconds (default: %(default)s)",
+        type=float, default=120.0)
+    parser.add_argument('--trace', metavar='FILE',
+        help="write the phases durations in a Chrome trace events file, or a new file in a directory")
+    parser.set_defaults(func=cmd_gui)
+    subparsers = parser.add_subparsers(title="commands", metavar='COMMAND')
+    subparser = subparsers.add_parser('gui', help="open the window (default)")
+    subparser.set_defaults(func=cmd_gui)
+    subparser = subparsers.add_parser('list', help="list all configurations")
+    subparser.set_defaults(func=cmd_list)
+    subparser = subparsers.add_parser('status', help="show the active configuration and connected outputs")
+    subparser.set_defaults(func=cmd_status)
+    subparser = subparsers.add_parser('available', help="list the available configurations")
+    subparser.set_defaults(func=cmd_available)
+    subparser = subparsers.add_parser('daemon', help="run the daemon, used by following commands")
+    subparser.set_defaults(func=cmd_daemon)
+    subparser = subparsers.add_parser('apply', help="apply a configuration")
+    subparser.add_argument('code', help="configuration code")
+    subparser.add_argument('--force', action='store_true',
+        help="apply even if the configuration is not available")
+    subparser.add_argument('--confirm', type=float, metavar='SECONDS',
+        help="restore the previous layout if the configuration is not confirmed in time")
+    subparser.set_defaults(func=cmd_apply)
+    subparser = subparsers.add_parser('layouts', help="list the previous layouts")
+    subparser.set_defaults(func=cmd_layouts)
+    subparser = subparsers.add_parser('rollback', help="restore a previous layout")
+    subparser.add_argument('index', type=int, nargs='?', default=0,
+        help="layout index in the history (default: %(default)s, the layout before the last apply)")
+    subparser.set_defaults(func=cmd_rollback)
+    subparser = subparsers.add_parser('displays', help="select and apply configurations on several X displays")
+    subparser.add_argument('displays', nargs='*', metavar='DISPLAY',
+        help="X display, ie :1 (default: local displays of /tmp/.X11-unix)")
+    subparser.add_argument('--apply', action='store_true', help="apply the selected configurations")
+    subparser.add_argument('--code', help="configuration selected on each display, instead of the best matching one")
+    subparser.add_argument('--json', action='store_true', help="print the report in JSON")
+    subparser.set_defaults(func=cmd_displays)
+    subparser = subparsers.add_parser('metrics', help="export the applies and commands metrics")
+    subparser.add_argument('--format', choices=('prometheus', 'json'), default='prometheus',
+        help="export format (default: %(default)s)")
+    subparser.add_argument('--output', metavar='FILE',
+        help="write the metrics in this file, ie in the node_exporter textfile directory (default: stdout)")
+    subparser.set_defaults(func=cmd_metrics)
+    subparser = subparsers.add_parser('trace-summary', help="print the phases durations of trace files")
+    subparser.add_argument('files', nargs='+', metavar='FILE', help="trace file or directory of trace files")
+    subparser.set_defaults(func=cmd_trace_summary)
+
+    args = parser.parse_args(argv)
+    # configure logging
+    _configure_logging(args)
+    if args.trace is not None:
+        chrandr.trace.enable()
+
+    # restore default signal handler on SIGINT
+    # see also : https://bugzilla.gnome.org/show_bug.cgi?id=622084
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+
+    if args.backend is not None:
+        try:
+            chrandr.backends.set_backend(args.backend)
+        except chrandr.backends.BackendUnavailable as e:
+            _error("Failed to use the output backend : " + str(e))
+
+    try:
+        return args.func(args)
+    finally:
+        if args.trace is not None:
+            _write_trace(args.trace)
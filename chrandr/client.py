@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+chrandr - Client of the chrandr daemon (see chrandr.daemon).
+
+Only the standard library is used, to start fast :
+    $ python3 -m chrandr.client apply <code>
+
+Protocol : one JSON object per line on a UNIX socket.
+    * request : {"command": "list"|"status"|"available"|"apply"|"layouts"|"rollback", "code": "...", "index": 0,
+                 "layout": {...}}
+    * response : {"ok": true, ...} or {"ok": false, "error": "...", "cmd": "...", "output": "..."}
+"""
+
+import sys
+import json
+import socket
+
+from chrandr.runtime import _get_socket_filename
+
+
+class DaemonError(Exception):
+    """Error returned by the daemon, the response is in the `response` field."""
+    def __init__(self, response):
+        super().__init__(response.get('error'))
+        self.response = response
+
+
+class ChrandrClient:
+    """
+    Client of the chrandr daemon.
+
+    Fields:
+        * socket_filename (str): Daemon socket filename
+        * timeout (float): Socket timeout in seconds, None for no limit
+    """
+
+    def __init__(self, socket_filename=None, timeout=None):
+        self.socket_filename = socket_filename if socket_filename else _get_socket_filename()
+        self.timeout = timeout
+
+    def request(self, command, **params):
+        """
+        Send a request and returns the response (dict).
+
+        Raises:
+            OSError: If the daemon cannot be reached.
+            DaemonError: If the daemon returns an error.
+        """
+        params['command'] = command
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(self.timeout)
+            sock.connect(self.socket_filename)
+            sock.sendall(json.dumps(params).encode('utf-8') + b'\n')
+            with sock.makefile('rb') as reader:
+                line = reader.readline()
+        if not line:
+            raise ConnectionError("No response from the daemon")
+        response = json.loads(line.decode('utf-8'))
+        if not response.get('ok'):
+            raise DaemonError(response)
+        return response
+
+
+def main(argv=None):
+    """Minimal command line client : <command> [code]."""
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv:
+        sys.stderr.write("usage: python3 -m chrandr.client list|status|available|apply <code>\n")
+        return 2
+    params = {}
+    if len(argv) > 1:
+        params['code'] = argv[1]
+    try:
+        response = ChrandrClient().request(argv[0], **params)
+    except OSError as e:
+        sys.stderr.write("chrandr: Cannot connect to the daemon : " + str(e) + "\n")
+        return 1
+    except DaemonError as e:
+        sys.stderr.write("chrandr: " + str(e) + "\n")
+        if e.response.get('output'):
+            sys.stderr.write(e.response['output'])
+        return 1
+    del response['ok']
+    print(json.dumps(response, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
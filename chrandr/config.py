@@ -5,9 +5,16 @@ chrandr - Configuration classes/utils
 
 import os
 import os.path
+import re
+import fnmatch
+import functools
+import hashlib
+import marshal
 import logging
 
-import configparser
+import chrandr.trace
+from chrandr.runtime import _get_runtime_filename
+from chrandr.utils import QUERY_POLICIES, QUERY_TIERED, PreparedCommand
 
 
 # Generate the default configuration filename
@@ -21,33 +28,67 @@ except ImportError:
 DEFAULT_CONFIGURATION_FILENAME = os.path.join(_config_dir, 'chrandr.conf')
 
 
-def _get_status_filename():
+def _get_data_filename(basename):
     """
-    Get the status filename.
-    Filename generated from xdg module, in $XDG_RUNTIME_DIR or in /tmp (in this order).
+    Get a filename in the data directory ($XDG_DATA_HOME/chrandr), the directory is created if needed.
+
+    Args:
+        * basename (str): Filename without directory
     """
-    logger = logging.getLogger('_get_status_filename')
-    status_basename = 'chrandr.state'
-    runtime_dir = None
     try:
         from xdg import BaseDirectory
-        runtime_dir = BaseDirectory.get_runtime_dir()
+        data_dir = BaseDirectory.save_data_path('chrandr')
     except ImportError:
-        logger.info("xdg module not found")
-        runtime_dir = os.getenv('XDG_RUNTIME_DIR')
-    except KeyError:
-        pass
-    if runtime_dir is None:
-        logger.debug("No environment variable XDG_RUNTIME_DIR")
-        # no runtime dir, use /tmp
-        import tempfile
-        runtime_dir = tempfile.gettempdir()
-        status_basename = 'chrandr.' + str(os.getuid()) + '.state'
-    filename = os.path.join(runtime_dir, status_basename)
+        data_dir = os.path.join(os.getenv('XDG_DATA_HOME') or os.path.expanduser(os.path.join('~', '.local', 'share')),
+            'chrandr')
+        os.makedirs(data_dir, 0o700, exist_ok=True)
+    return os.path.join(data_dir, basename)
+
+
+def _get_cache_filename(source_filename):
+    """
+    Get the compiled cache filename of a configuration file, in $XDG_CACHE_HOME/chrandr.
+
+    Args:
+        * source_filename (str): Configuration filename
+    """
+    try:
+        from xdg import BaseDirectory
+        cache_dir = BaseDirectory.save_cache_path('chrandr')
+    except ImportError:
+        cache_dir = os.path.join(os.getenv('XDG_CACHE_HOME') or os.path.expanduser(os.path.join('~', '.cache')),
+            'chrandr')
+    source_key = hashlib.sha1(os.path.abspath(source_filename).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(cache_dir, 'config-' + source_key + '.marshal')
+
+
+def _get_status_filename():
+    """Get the status filename, see _get_runtime_filename()."""
+    logger = logging.getLogger('_get_status_filename')
+    filename = _get_runtime_filename('state')
     logger.debug("Status filename: %s", filename)
     return filename
 
 
+def _get_log_filename():
+    """Get the commands log filename, see _get_runtime_filename()."""
+    return _get_runtime_filename('log')
+
+
+def _get_layouts_filename():
+    """Get the layouts history filename, see _get_runtime_filename()."""
+    return _get_runtime_filename('layouts')
+
+
+def get_metrics_filename():
+    """Get the metrics filename, see _get_runtime_filename()."""
+    return _get_runtime_filename('metrics')
+
+
+# name of the commands field in the groups dependencies (see RandrConfig)
+MAIN_GROUP = 'main'
+
+
 class RandrConfig:
     """
     Represents a RandR configuration.
@@ -55,24 +96,40 @@ class RandrConfig:
     Fields:
         * code (str): Configuration code
         * title (str): Configuration title used in the button
-        * ports (str list): List of xrandr ports, ie ['VGA', 'HDMI']
-        * commands (str list): List of commands to execute
+        * ports (str list): List of xrandr ports, ie ['VGA', 'HDMI'],
+                            could be wildcard patterns matching one connected output, ie ['DP-*', 'HDMI-?']
+        * commands (str list): List of commands to execute (the main commands group)
         * icon (str) : Filename icon used in the button
+        * groups (dict): Other commands groups {group name: list of commands}, executed concurrently
+        * after (dict): Groups dependencies {group name: list of groups names executed before},
+                        MAIN_GROUP is the name of the commands field
     """
 
-    def __init__(self, code, title=None, ports=None, commands=None, icon=None):
+    def __init__(self, code, title=None, ports=None, commands=None, icon=None, groups=None, after=None):
         """Constructs a xrandr configuration."""
         self.code = code
         self.title = title
         self.ports = ports
         self.commands = commands
         self.icon = icon
+        self.groups = groups or {}
+        self.after = after or {}
 
     def __str__(self):
         return "XrandrConfig(code={})".format(self.code)
     def __repr__(self):
         return self.__str__()
 
+    def as_tuple(self):
+        """Returns the fields values : (code, title, ports, commands, icon, groups, after)."""
+        return self.code, self.title, self.ports, self.commands, self.icon, self.groups, self.after
+
+    def command_groups(self):
+        """Returns all the commands groups {group name: list of commands}, the main group first."""
+        groups = {MAIN_GROUP: self.commands or []}
+        groups.update(self.groups)
+        return groups
+
     def available(self, connected_outputs):
         """
         Returns if this configuration is available (True) or not (False).
@@ -85,10 +142,164 @@ class RandrConfig:
         """
         if self.ports:
             for port in self.ports:
-                if port not in connected_outputs:
+                if is_port_pattern(port):
+                    match = compile_port_pattern(port)
+                    if not any(match(output) for output in connected_outputs):
+                        return False
+                elif port not in connected_outputs:
                     return False
         return True
 
+    def matched_outputs(self, connected_outputs):
+        """Returns the set of connected outputs matched by the ports of this configuration."""
+        matched = set()
+        for port in self.ports or []:
+            if is_port_pattern(port):
+                match = compile_port_pattern(port)
+                matched.update(output for output in connected_outputs if match(output))
+            elif port in connected_outputs:
+                matched.add(port)
+        return matched
+
+
+class PortIndex:
+    """
+    Inverted index from ports to configurations, to find the available configurations
+    in a time depending on the connected outputs, not on the number of configurations.
+    Literal ports are bits of a mask : a configuration is available
+    if its ports mask is included in the connected outputs mask, and all its patterns match an output.
+    """
+
+    def __init__(self, randr_configs):
+        """
+        Args:
+            * randr_configs (list of RandrConfig): Indexed configurations, in configuration order
+        """
+        self._configs = list(randr_configs)
+        # literal port => bit
+        self._bits = {}
+        # literal port => positions of the configurations using it
+        self._by_port = {}
+        # pattern => (compiled pattern, positions of the configurations using it)
+        self._patterns = {}
+        # by configuration position : ports mask and patterns
+        self._masks = []
+        self._config_patterns = []
+        # positions of the configurations without port
+        self._always = []
+        for position, randr in enumerate(self._configs):
+            mask = 0
+            patterns = []
+            for port in randr.ports or []:
+                if is_port_pattern(port):
+                    if port not in self._patterns:
+                        self._patterns[port] = (compile_port_pattern(port), [])
+                    self._patterns[port][1].append(position)
+                    patterns.append(port)
+                else:
+                    if port not in self._bits:
+                        self._bits[port] = 1 << len(self._bits)
+                        self._by_port[port] = []
+                    self._by_port[port].append(position)
+                    mask |= self._bits[port]
+            self._masks.append(mask)
+            self._config_patterns.append(patterns)
+            if not randr.ports:
+                self._always.append(position)
+
+    def available(self, connected_outputs):
+        """Returns the available configurations (list of RandrConfig), in configuration order."""
+        connected = 0
+        candidates = set(self._always)
+        for output in connected_outputs:
+            bit = self._bits.get(output)
+            if bit is not None:
+                connected |= bit
+                candidates.update(self._by_port[output])
+        matched_patterns = set()
+        for pattern, (match, positions) in self._patterns.items():
+            if any(match(output) for output in connected_outputs):
+                matched_patterns.add(pattern)
+                candidates.update(positions)
+        return [self._configs[position] for position in sorted(candidates)
+            if not self._masks[position] & ~connected
+            and all(p in matched_patterns for p in self._config_patterns[position])]
+
+
+_PORT_PATTERN_RE = re.compile(r"[*?\[]")
+
+
+def is_port_pattern(port):
+    """Returns True if the port is a wildcard pattern (ie 'DP-*', 'HDMI-?')."""
+    return _PORT_PATTERN_RE.search(port) is not None
+
+
+@functools.lru_cache(maxsize=256)
+def compile_port_pattern(pattern):
+    """Returns the match function of a wildcard port pattern (see fnmatch), case sensitive."""
+    return re.compile(fnmatch.translate(pattern)).match
+
+
+class ConfigChanges:
+    """
+    Changes of the configuration file, returned by ChrandrConfig.reload().
+    A ConfigChanges is false if nothing changed.
+
+    Fields:
+        * added (list of RandrConfig): New configurations
+        * removed (list of RandrConfig): Removed configurations
+        * changed (list of RandrConfig): Modified configurations (new objects, with the same codes)
+        * reordered (bool): True if the configurations order changed
+        * general (bool): True if the general options changed
+    """
+
+    def __init__(self, added=None, removed=None, changed=None, reordered=False, general=False):
+        self.added = added or []
+        self.removed = removed or []
+        self.changed = changed or []
+        self.reordered = reordered
+        self.general = general
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.changed or self.reordered or self.general)
+
+    def __str__(self):
+        return "ConfigChanges(added={}, removed={}, changed={}, reordered={}, general={})".format(
+            self.added, self.removed, self.changed, self.reordered, self.general)
+    def __repr__(self):
+        return self.__str__()
+
+
+def _split_sections(content):
+    """
+    Split a configuration file content into sections, without parsing them.
+    Lines before the first section are returned with the None section name.
+
+    Returns:
+        List of (section name, section text), in file order.
+    """
+    import configparser
+    sections = []
+    name = None
+    lines = []
+    for line in content.splitlines(keepends=True):
+        # indented lines are values continuations
+        if line[:1] == '[':
+            match = configparser.ConfigParser.SECTCRE.match(line.rstrip())
+            if match:
+                sections.append((name, ''.join(lines)))
+                name = match.group('header')
+                lines = []
+        lines.append(line)
+    sections.append((name, ''.join(lines)))
+    return sections
+
+
+def _hash_sections(sections):
+    """Returns {section name: sha1 of section text}, None if a section name is duplicated."""
+    hashes = dict((name, hashlib.sha1(text.encode('utf-8')).hexdigest()) for name, text in sections)
+    return hashes if len(hashes) == len(sections) else None
+
 
 class ChrandrConfig:
     """
@@ -101,21 +312,67 @@ class ChrandrConfig:
         * default (str) : Default randr configuration code to use if no active choice
         * randr (RandrConfig list): List of defined xrandr configurations
         * active (str): Current active configuration code
+        * timeout (float): Maximum duration of a command in seconds, None for no limit
+        * total_timeout (float): Maximum duration of a configuration commands in seconds, None for no limit
+        * auto_apply (bool): Apply a configuration automatically when outputs change (see chrandr.autoselect)
+        * skip_unchanged (bool): Do not execute xrandr changes already in effect (see chrandr.layout)
+        * merge_xrandr (bool): Merge adjacent xrandr commands into one invocation (see chrandr.layout)
+        * command_log (bool): Write the whole commands output into a log file of the runtime directory
+        * query (str): Outputs query policy of the window (see chrandr.utils.query_outputs())
+        * rollback (bool): Restore the previous layout when the commands fail (see chrandr.snapshot)
+        * confirm_timeout (float): Seconds to confirm an applied configuration in the window
+                                   before the previous layout is restored, None for no confirmation
+        * layout_history (int): Number of previous layouts kept in the history
+        * metrics (bool): Record the applies and commands metrics in the runtime directory (see chrandr.metrics)
     """
 
-    def __init__(self, filename):
+    DEFAULT_TIMEOUT = 30.0
+    DEFAULT_TOTAL_TIMEOUT = 60.0
+    DEFAULT_LAYOUT_HISTORY = 8
+    # incremented when the compiled cache format changes
+    CACHE_VERSION = 7
+    # general options stored in the compiled cache
+    _GENERAL_FIELDS = ('initial', 'timeout', 'total_timeout', 'auto_apply', 'skip_unchanged', 'merge_xrandr',
+        'command_log', 'query', 'rollback', 'confirm_timeout', 'layout_history', 'metrics')
+
+    def __init__(self, filename, use_cache=True):
         """
         Initialize a configuration.
 
         Args:
             filename (str): Filename to load
+            use_cache (bool): Use the compiled cache of the configuration (see load())
         """
         self._logger = logging.getLogger(self.__class__.__name__)
         self.filename = os.path.expanduser(filename)
         self.status_filename = _get_status_filename()
+        self.cache_filename = _get_cache_filename(self.filename) if use_cache else None
         self.initial = None
         self.randr = []
         self.active = None
+        self.timeout = self.DEFAULT_TIMEOUT
+        self.total_timeout = self.DEFAULT_TOTAL_TIMEOUT
+        self.auto_apply = False
+        self.skip_unchanged = True
+        self.merge_xrandr = True
+        self.command_log = False
+        self._command_log = None
+        self.query = QUERY_TIERED
+        self.rollback = True
+        self.confirm_timeout = None
+        self.layout_history = self.DEFAULT_LAYOUT_HISTORY
+        self._layout_history = None
+        self.metrics = True
+        self._apply_generation = 0
+        self._index = None
+        self._by_code = None
+        # (modification time in ns, size, sha1) of the loaded file, and sha1 of its sections (see reload())
+        self._source = None
+        self._section_hashes = None
+        # prepared commands groups by configuration code {code: (RandrConfig, groups)}, and their key
+        # (outputs, source, $PATH), see prepare_plans()
+        self._plans = {}
+        self._plans_key = None
 
     def _load_randr(self, config, section_name):
         """Load a RandrConfig from the ConfigParser in argument and return it."""
@@ -129,7 +386,49 @@ class ChrandrConfig:
         if commands_raw:
             commands = list(filter(None, (x.strip() for x in commands_raw.split('\n'))))
         icon = config.get(section_name, 'icon', fallback=None)
-        return RandrConfig(section_name, title=title, ports=ports, commands=commands, icon=icon)
+        # commands groups : 'commands.<name>' and 'after.<name>' options
+        groups = {}
+        after = {}
+        for option, value in config.items(section_name):
+            prefix, dot, name = option.partition('.')
+            if not dot or not name:
+                continue
+            if prefix == 'commands' and name != MAIN_GROUP:
+                groups[name] = list(filter(None, (x.strip() for x in value.split('\n'))))
+            elif prefix == 'after':
+                after[name] = list(filter(None, (x.strip() for x in value.split(','))))
+        self._check_groups(section_name, groups, after)
+        return RandrConfig(section_name, title=title, ports=ports, commands=commands, icon=icon, groups=groups,
+            after=after)
+
+    def _check_groups(self, section_name, groups, after):
+        """Remove the unknown groups and the dependencies cycles of the groups dependencies (after)."""
+        names = set(groups)
+        names.add(MAIN_GROUP)
+        for name in list(after):
+            unknown = [d for d in after[name] if d not in names]
+            if name not in names or unknown:
+                self._logger.warning("Section '%s' : unknown commands group %s ignored", section_name,
+                    ', '.join(unknown) if name in names else name)
+                after[name] = [d for d in after[name] if d in names]
+            if name not in names or not after[name]:
+                del after[name]
+
+        def depends_on(name, target, seen):
+            for dependency in after.get(name, ()):
+                if dependency == target:
+                    return True
+                if dependency not in seen:
+                    seen.add(dependency)
+                    if depends_on(dependency, target, seen):
+                        return True
+            return False
+
+        for name in list(after):
+            if depends_on(name, name, set()):
+                self._logger.warning("Section '%s' : commands group '%s' dependencies cycle ignored",
+                    section_name, name)
+                del after[name]
 
     def _save_randr(self, config, rc):
         """Save a RandrConfig (rc) into the ConfigParser (config)."""
@@ -143,10 +442,161 @@ class ChrandrConfig:
             config[rc.code]['commands'] = '\n'.join(rc.commands)
         if rc.icon:
             config[rc.code]['icon'] = rc.icon
+        for name, commands in rc.groups.items():
+            config[rc.code]['commands.' + name] = '\n'.join(commands)
+        for name, dependencies in rc.after.items():
+            config[rc.code]['after.' + name] = ','.join(dependencies)
+
+    def _get_timeout(self, config, option, default):
+        """Returns a timeout option of the general section, 0 means no limit (None)."""
+        try:
+            value = config.getfloat('general', option, fallback=default)
+        except ValueError:
+            self._logger.warning("Invalid value for option '%s', using %s", option, default)
+            value = default
+        return value if value > 0 else None
+
+    def _get_boolean(self, config, option, default):
+        """Returns a boolean option of the general section."""
+        try:
+            return config.getboolean('general', option, fallback=default)
+        except ValueError:
+            self._logger.warning("Invalid value for option '%s', using %s", option, default)
+            return default
+
+    def invalidate_index(self):
+        """Must be called when the configurations (randr field) are modified."""
+        self._index = None
+        self._by_code = None
+
+    def get_randr(self, code):
+        """Returns the RandrConfig with the code, None if not found."""
+        if self._by_code is None:
+            self._by_code = dict((r.code, r) for r in self.randr)
+        return self._by_code.get(code)
+
+    def available_randr(self, connected_outputs):
+        """
+        Returns the configurations available with the connected outputs (see PortIndex).
+
+        Args:
+            * connected_outputs (list of str): List of connected outputs, ie ['VGA', 'DVI']
+        Returns:
+            List of RandrConfig, in configuration order.
+        """
+        if self._index is None:
+            self._index = PortIndex(self.randr)
+        return self._index.available(connected_outputs)
+
+    def prepare_plans(self, connected_outputs):
+        """
+        Prepare the commands of the configurations available with the connected outputs (see PreparedCommand) :
+        applying them with plan_groups() does not split the commands or search their programs again.
+        The plans are kept while the outputs, the configuration file and $PATH are unchanged.
+
+        Args:
+            * connected_outputs (list of str): List of connected outputs, ie ['VGA', 'DVI']
+        """
+        key = (frozenset(connected_outputs), self._source, os.environ.get('PATH'))
+        if key == self._plans_key:
+            return
+        with chrandr.trace.span('apply.prepare') as span:
+            # same command in several configurations : prepared once
+            prepared = {}
+            plans = {}
+            for randr in self.available_randr(connected_outputs):
+                groups = {}
+                for name, commands in randr.command_groups().items():
+                    groups[name] = []
+                    for cmd in commands:
+                        if cmd not in prepared:
+                            prepared[cmd] = PreparedCommand(cmd)
+                        groups[name].append(prepared[cmd])
+                plans[randr.code] = (randr, groups)
+            self._plans = plans
+            self._plans_key = key
+            span.set_args(plans=len(plans), commands=len(prepared))
+        self._logger.debug("%d configurations plans prepared", len(plans))
+
+    def _command_groups(self, randr_config):
+        """Returns the commands groups of a configuration, prepared if its plan is valid (see prepare_plans())."""
+        plan = self._plans.get(randr_config.code)
+        if plan is None or plan[0] is not randr_config:
+            return randr_config.command_groups()
+        return {name: list(commands) for name, commands in plan[1].items()}
+
+    def plan_commands(self, randr_config, backend=None):
+        """
+        Returns the commands to execute to apply a configuration.
+        The xrandr changes already in effect are removed if skip_unchanged is set,
+        and adjacent xrandr commands are merged if merge_xrandr is set (see chrandr.layout).
+
+        Args:
+            * randr_config (RandrConfig): Configuration to apply
+            * backend (OutputBackend): Backend querying the screen state, None to use the default one
+        """
+        return self._plan_main(self._command_groups(randr_config)[MAIN_GROUP], backend)
+
+    def _plan_main(self, commands, backend, screen=None):
+        """Plan the commands of the main group, see plan_commands()."""
+        if not commands:
+            return []
+        import chrandr.layout
+        if self.skip_unchanged:
+            commands = chrandr.layout.plan_commands(commands, backend=backend, screen=screen)
+        if self.merge_xrandr:
+            commands = chrandr.layout.merge_commands(commands)
+        return commands
+
+    def get_command_log(self):
+        """Returns the commands log (chrandr.utils.CommandLog), None if command_log is not set."""
+        if not self.command_log:
+            return None
+        if self._command_log is None:
+            import chrandr.utils
+            self._command_log = chrandr.utils.CommandLog(_get_log_filename())
+        return self._command_log
+
+    def get_layout_history(self):
+        """Returns the layouts history (chrandr.snapshot.LayoutHistory), None if layout_history is 0."""
+        if not self.layout_history:
+            return None
+        if self._layout_history is None:
+            import chrandr.snapshot
+            self._layout_history = chrandr.snapshot.LayoutHistory(_get_layouts_filename(), self.layout_history)
+        return self._layout_history
+
+    def get_metrics(self):
+        """
+        Returns the metrics recorder (chrandr.metrics.Metrics), None if metrics is not set.
+        Metrics are then recorded by the whole process (see chrandr.metrics.enable()).
+        """
+        if not self.metrics:
+            return None
+        import chrandr.metrics
+        return chrandr.metrics.enable(get_metrics_filename())
+
+    def plan_groups(self, randr_config, backend=None, screen=None):
+        """
+        Returns the commands groups to execute to apply a configuration {group name: list of commands}.
+        The main group is planned with plan_commands(), other groups are kept as is.
+
+        Args:
+            * randr_config (RandrConfig): Configuration to apply
+            * backend (OutputBackend): Backend querying the screen state, None to use the default one
+            * screen (chrandr.model.Screen): Screen state already queried (see chrandr.snapshot.capture()),
+                                             modified by the planning
+        """
+        with chrandr.trace.span('apply.plan', code=randr_config.code):
+            groups = self._command_groups(randr_config)
+            groups[MAIN_GROUP] = self._plan_main(groups[MAIN_GROUP], backend, screen)
+        return groups
 
     def load(self):
         """
         Load the configuration from a file.
+        If the compiled cache is valid (same file modification time, size and content hash),
+        the configurations are loaded from it, without parsing the file.
 
         Raises:
             FileNotFoundError: If filename cannot be read.
@@ -154,30 +604,196 @@ class ChrandrConfig:
         if not os.access(self.filename, os.R_OK):
             raise FileNotFoundError("Cannot open or read the file: " + self.filename)
         self._logger.debug("Loading the configuration file : %s", self.filename)
+        with chrandr.trace.span('config.load') as span:
+            stat = os.stat(self.filename)
+            with open(self.filename, 'rb') as fd:
+                content = fd.read()
+            source = (stat.st_mtime_ns, stat.st_size, hashlib.sha1(content).hexdigest())
+            cached = self._load_cache(source)
+            if not cached:
+                self._parse(content.decode('UTF-8'))
+                self._save_cache(source)
+            span.set_args(cached=cached, profiles=len(self.randr))
+        self._source = source
+        self.invalidate_index()
+        self._logger.debug("%d randr outputs loaded", len(self.randr))
+
+        # read the active configuration
+        self._logger.debug("Loading status file in %s", self.status_filename)
+        active = _read_status_active(self.status_filename)
+        if active is not None:
+            self.active = active
+        else:
+            self._logger.debug("No status file or no active found")
+            # state file does not exist (or does not contain active value) => use initial
+            self.active = self.initial
+        self._logger.debug("Active configuration code is : %s", self.active)
+
+    def _parse(self, content):
+        """Parse the configuration file content (str) with configparser."""
+        # only imported to parse : the compiled cache is loaded without it
+        import configparser
         config = configparser.ConfigParser()
         config['general'] = {}
-        config.read(self.filename, encoding='UTF-8')
+        config.read_string(content, source=self.filename)
 
         # general options
         self.initial = config.get('general', 'initial', fallback=None)
+        self.timeout = self._get_timeout(config, 'timeout', self.DEFAULT_TIMEOUT)
+        self.total_timeout = self._get_timeout(config, 'total_timeout', self.DEFAULT_TOTAL_TIMEOUT)
+        self.auto_apply = self._get_boolean(config, 'auto', False)
+        self.skip_unchanged = self._get_boolean(config, 'skip_unchanged', True)
+        self.merge_xrandr = self._get_boolean(config, 'merge_xrandr', True)
+        self.command_log = self._get_boolean(config, 'command_log', False)
+        self.query = config.get('general', 'query', fallback=QUERY_TIERED)
+        if self.query not in QUERY_POLICIES:
+            self._logger.warning("Invalid value for option 'query', using %s", QUERY_TIERED)
+            self.query = QUERY_TIERED
+        self.rollback = self._get_boolean(config, 'rollback', True)
+        self.confirm_timeout = self._get_timeout(config, 'confirm_timeout', 0)
+        try:
+            self.layout_history = max(0, config.getint('general', 'layout_history',
+                fallback=self.DEFAULT_LAYOUT_HISTORY))
+        except ValueError:
+            self._logger.warning("Invalid value for option 'layout_history', using %s", self.DEFAULT_LAYOUT_HISTORY)
+            self.layout_history = self.DEFAULT_LAYOUT_HISTORY
+        self.metrics = self._get_boolean(config, 'metrics', True)
         # read all randr configurations
         self.randr = []
         for code in config.sections():
             if code != 'general':
                 self.randr.append(self._load_randr(config, code))
-        self._logger.debug("%d randr outputs loaded", len(self.randr))
+        self._section_hashes = _hash_sections(_split_sections(content))
 
-        # read the active configuration
-        self._logger.debug("Loading status file in %s", self.status_filename)
-        status = configparser.ConfigParser()
-        status.read(self.status_filename, encoding='UTF-8')
-        if 'chrandr' in status and 'active' in status['chrandr']:
-            self.active = status['chrandr']['active']
+    def reload(self):
+        """
+        Reload the configuration file if it changed.
+        Only the changed sections are parsed, unchanged configurations keep their RandrConfig objects.
+        The general options and the whole file are parsed if the general section changed.
+        The active configuration is not reloaded.
+
+        Returns:
+            The ConfigChanges, false if nothing changed.
+        Raises:
+            FileNotFoundError: If filename cannot be read.
+            configparser.Error: If the file is invalid, the configuration is unchanged.
+        """
+        if not os.access(self.filename, os.R_OK):
+            raise FileNotFoundError("Cannot open or read the file: " + self.filename)
+        stat = os.stat(self.filename)
+        with open(self.filename, 'rb') as fd:
+            content = fd.read()
+        source = (stat.st_mtime_ns, stat.st_size, hashlib.sha1(content).hexdigest())
+        if source == self._source:
+            return ConfigChanges()
+        import configparser
+        content = content.decode('UTF-8')
+        sections = _split_sections(content)
+        hashes = _hash_sections(sections)
+        old_randr = self.randr
+        old_hashes = self._section_hashes or {}
+        general_fields = tuple(getattr(self, field) for field in self._GENERAL_FIELDS)
+        if hashes is None or configparser.DEFAULTSECT in hashes \
+                or any(hashes.get(name) != old_hashes.get(name) for name in (None, 'general')):
+            self._logger.debug("General section changed, parsing the whole file")
+            self._parse(content)
+            new_randr = self.randr
         else:
-            self._logger.debug("No status file or no active found")
-            # state file does not exist (or does not contain active value) => use initial
-            self.active = self.initial
-        self._logger.debug("Active configuration code is : %s", self.active)
+            old_by_code = dict((r.code, r) for r in old_randr)
+            new_randr = []
+            for name, text in sections:
+                if name in (None, 'general'):
+                    continue
+                if name in old_by_code and hashes[name] == old_hashes.get(name):
+                    new_randr.append(old_by_code[name])
+                else:
+                    self._logger.debug("Parsing changed section '%s'", name)
+                    config = configparser.ConfigParser()
+                    config.read_string(text, source=self.filename)
+                    new_randr.append(self._load_randr(config, name))
+            self._section_hashes = hashes
+        changes = self._diff_randr(old_randr, new_randr)
+        changes.general = general_fields != tuple(getattr(self, field) for field in self._GENERAL_FIELDS)
+        self.randr = new_randr
+        self._source = source
+        self._save_cache(source)
+        self.invalidate_index()
+        self._logger.debug("Configuration reloaded: %s", changes)
+        return changes
+
+    @staticmethod
+    def _diff_randr(old_randr, new_randr):
+        """
+        Returns the ConfigChanges between two configurations lists.
+        Configurations of new_randr equal to the old ones are replaced by the old objects.
+        """
+        old_by_code = dict((r.code, r) for r in old_randr)
+        changes = ConfigChanges()
+        for index, randr in enumerate(new_randr):
+            old = old_by_code.pop(randr.code, None)
+            if old is None:
+                changes.added.append(randr)
+            elif old is randr:
+                continue
+            elif old.as_tuple() == randr.as_tuple():
+                new_randr[index] = old
+            else:
+                changes.changed.append(randr)
+        changes.removed = [r for r in old_randr if r.code in old_by_code]
+        # order of the configurations kept
+        added_codes = set(r.code for r in changes.added)
+        kept = [r.code for r in old_randr if r.code not in old_by_code]
+        changes.reordered = kept != [r.code for r in new_randr if r.code not in added_codes]
+        return changes
+
+    def _load_cache(self, source):
+        """
+        Load the configuration from the compiled cache.
+
+        Args:
+            * source (tuple): (modification time in ns, size, sha1) of the configuration file
+        Returns:
+            True if loaded, False if there is no valid cache.
+        """
+        if self.cache_filename is None:
+            return False
+        try:
+            with open(self.cache_filename, 'rb') as fd:
+                data = marshal.load(fd)
+        except (OSError, EOFError, ValueError, TypeError):
+            self._logger.debug("No compiled cache %s", self.cache_filename)
+            return False
+        if not isinstance(data, dict) or data.get('version') != self.CACHE_VERSION \
+                or data.get('source') != source:
+            self._logger.debug("Compiled cache %s is outdated", self.cache_filename)
+            return False
+        for field, value in zip(self._GENERAL_FIELDS, data['general']):
+            setattr(self, field, value)
+        self.randr = [RandrConfig(code, title=title, ports=ports, commands=commands, icon=icon, groups=groups,
+            after=after) for code, title, ports, commands, icon, groups, after in data['randr']]
+        self._section_hashes = data['sections']
+        self._logger.debug("Configuration loaded from the compiled cache %s", self.cache_filename)
+        return True
+
+    def _save_cache(self, source):
+        """Save the compiled cache, errors are ignored (the cache is optional)."""
+        if self.cache_filename is None:
+            return
+        data = {
+            'version': self.CACHE_VERSION,
+            'source': source,
+            'general': tuple(getattr(self, field) for field in self._GENERAL_FIELDS),
+            'randr': [r.as_tuple() for r in self.randr],
+            'sections': self._section_hashes,
+        }
+        tmp_filename = self.cache_filename + '.' + str(os.getpid()) + '.tmp'
+        try:
+            os.makedirs(os.path.dirname(self.cache_filename), 0o700, exist_ok=True)
+            with open(tmp_filename, 'wb') as fd:
+                marshal.dump(data, fd)
+            os.replace(tmp_filename, self.cache_filename)
+        except OSError:
+            self._logger.info("Cannot write the compiled cache %s", self.cache_filename, exc_info=True)
 
     def save(self):
         """
@@ -185,6 +801,7 @@ class ChrandrConfig:
 
         Important: Due to ConfigParser implementation, all comments are removed when writing the file.
         """
+        import configparser
         config = configparser.ConfigParser()
         config['general'] = {}
         config.read(self.filename, encoding='UTF-8')
@@ -197,7 +814,18 @@ class ChrandrConfig:
             config.write(fd, space_around_delimiters=True)
         self._logger.debug("Configuration saved")
 
-    def save_active_randr(self, randr_config):
+    def begin_apply(self):
+        """
+        Declare the start of a configuration apply.
+        Previous applies are superseded : save_active_randr() ignores them.
+
+        Returns:
+            The apply generation (int) to give to save_active_randr().
+        """
+        self._apply_generation += 1
+        return self._apply_generation
+
+    def save_active_randr(self, randr_config, generation=None):
         """
         Save the current active configuration in the status file.
 
@@ -205,7 +833,14 @@ class ChrandrConfig:
 
         Args:
             * randr_config (RandrConfig): Configuration to set as active, could be None
+            * generation (int): Apply generation returned by begin_apply(), None to always save
+        Returns:
+            True if saved, False if the apply generation is superseded.
         """
+        if generation is not None and generation != self._apply_generation:
+            self._logger.debug("Apply generation %d superseded, active configuration not saved", generation)
+            return False
+        import configparser
         status = configparser.ConfigParser()
         status['chrandr'] = {}
         if randr_config is None:
@@ -217,6 +852,30 @@ class ChrandrConfig:
         with open(self.status_filename, 'w') as statusfile:
             status.write(statusfile, space_around_delimiters=True)
         self._logger.debug("Active configuration (code '%s') saved", self.active)
+        return True
+
+
+def _read_status_active(filename):
+    """
+    Returns the active configuration code of the status file, None if not found.
+    The status file is written by configparser (see ChrandrConfig.save_active_randr()),
+    it is read without configparser : only the 'active' option of the 'chrandr' section.
+    """
+    try:
+        with open(filename, encoding='UTF-8') as fd:
+            lines = fd.readlines()
+    except OSError:
+        return None
+    section = None
+    for line in lines:
+        line = line.strip()
+        if line.startswith('[') and line.endswith(']'):
+            section = line[1:-1]
+        elif section == 'chrandr':
+            key, sep, value = line.partition('=')
+            if sep and key.strip() == 'active':
+                return value.strip()
+    return None
 
 
 def create_default_configuration(filename):
@@ -236,7 +895,8 @@ def create_default_configuration(filename):
     # example configuration
     title = 'This is an chrandr configuration example'
     ports = []
-    commands = [ "xmessage \"You've launch the example configuration :)\"",
+    # the message is closed before the commands timeout (see ChrandrConfig.DEFAULT_TIMEOUT)
+    commands = [ "xmessage -timeout 5 \"You've launch the example configuration :)\"",
         "echo \"Another command of the example\"" ]
     icon = ''
     cfg.randr.append(RandrConfig('example', title=title, ports=ports, commands=commands, icon=icon))
@@ -0,0 +1,349 @@
+# -*- coding: utf-8 -*-
+"""
+chrandr - Resident daemon.
+
+The daemon keeps the configuration, the connected outputs and the active configuration in memory,
+and serves requests on a UNIX socket in the runtime directory (see chrandr.client for the protocol).
+Clients are served concurrently, applies are serialized.
+"""
+
+import os
+import json
+import socket
+import socketserver
+import logging
+import threading
+import time
+
+import chrandr.metrics
+import chrandr.snapshot
+import chrandr.trace
+import chrandr.utils
+import chrandr.watcher
+from chrandr.runtime import _get_socket_filename
+from chrandr.client import DaemonError
+
+
+class RequestError(Exception):
+    """Invalid request (unknown configuration...), returned to the client."""
+    pass
+
+
+class ChrandrService:
+    """
+    Requests handling, shared by the daemon and the command line interface.
+
+    Fields:
+        * config (ChrandrConfig): Loaded configuration
+        * cache_outputs (bool): Keep the connected outputs between requests (outputs changes are watched)
+        * selector (AutoSelector): Automatic configuration selection, None if disabled
+    """
+
+    COMMANDS = ('list', 'status', 'available', 'apply', 'layouts', 'rollback')
+
+    def __init__(self, config):
+        self._logger = logging.getLogger(self.__class__.__name__)
+        self.config = config
+        self.cache_outputs = False
+        self._outputs = None
+        self._outputs_lock = threading.Lock()
+        # reentrant : the automatic apply checks its selection before applying (see refresh_outputs())
+        self._apply_lock = threading.RLock()
+        self.selector = None
+        if config.auto_apply:
+            import chrandr.autoselect
+            self.selector = chrandr.autoselect.AutoSelector(config)
+
+    def refresh_outputs(self, auto_apply=False):
+        """
+        Query the connected outputs and returns them.
+
+        Args:
+            * auto_apply (bool): Apply the configuration selected for the outputs, if automatic selection is enabled
+        """
+        # requests need the exact outputs : no tiered query
+        policy = chrandr.utils.QUERY_CURRENT if self.config.query == chrandr.utils.QUERY_CURRENT \
+            else chrandr.utils.QUERY_PROBE
+        with self._outputs_lock:
+            outputs = self._outputs = chrandr.utils.query_outputs(policy)
+            self.config.prepare_plans(outputs)
+            randr = key = active = None
+            if self.selector is not None:
+                # EDID of the outputs just queried, not probed again
+                randr = self.selector.update(outputs, chrandr.utils.get_output_edids(probe=False))
+                key, active = self.selector.key, self.config.active
+        if auto_apply and randr is not None:
+            with self._apply_lock:
+                # selection outdated by another outputs change or by an apply since the query
+                if self.selector.key != key or self.config.active != active:
+                    self._logger.debug("Configuration '%s' selection outdated, not applied", randr.code)
+                    return outputs
+                self._logger.info("Outputs changed, applying configuration '%s'", randr.code)
+                try:
+                    self.apply_randr(randr)
+                except chrandr.utils.ProcessException as e:
+                    self._logger.error("Automatic apply of '%s' failed: %s", randr.code, e)
+        return outputs
+
+    def on_outputs_changed(self):
+        """Outputs changes callback : refresh the outputs and apply the selected configuration."""
+        self.refresh_outputs(auto_apply=True)
+
+    def on_config_changed(self):
+        """Configuration file changes callback : reload the changed configurations."""
+        import configparser
+        # not reloaded while a configuration is applied
+        with self._apply_lock:
+            try:
+                changes = self.config.reload()
+            except (OSError, configparser.Error) as e:
+                self._logger.warning("Configuration not reloaded: %s", e)
+                return
+        if changes:
+            self._logger.info("Configuration reloaded: %s", changes)
+            with self._outputs_lock:
+                outputs = self._outputs
+                if outputs is not None:
+                    self.config.prepare_plans(outputs)
+
+    def invalidate_outputs(self):
+        """Forget the connected outputs, they are queried by the next request."""
+        self._outputs = None
+
+    def get_outputs(self):
+        """Returns the connected outputs, queried only if unknown."""
+        outputs = self._outputs if self.cache_outputs else None
+        if outputs is None:
+            outputs = self.refresh_outputs()
+        return outputs
+
+    def handle(self, request):
+        """
+        Handle a request (dict) and returns the response (dict).
+        Errors are returned in the response.
+        """
+        command = request.get('command')
+        if command not in self.COMMANDS:
+            return {'ok': False, 'error': "Unknown command : {}".format(command)}
+        try:
+            response = getattr(self, 'do_' + command)(request)
+        except chrandr.utils.ProcessException as e:
+            return {'ok': False, 'error': str(e), 'cmd': e.cmd, 'output': e.output}
+        except RequestError as e:
+            return {'ok': False, 'error': str(e)}
+        except Exception as e:
+            self._logger.error("Request '%s' failed", command, exc_info=True)
+            return {'ok': False, 'error': str(e)}
+        response['ok'] = True
+        return response
+
+    def request(self, command, **params):
+        """
+        Handle a request, same interface as ChrandrClient.request().
+
+        Raises:
+            DaemonError: If the request fails.
+        """
+        params['command'] = command
+        response = self.handle(params)
+        if not response['ok']:
+            raise DaemonError(response)
+        return response
+
+    def do_list(self, request):
+        randr = [{'code': r.code, 'title': r.title, 'ports': r.ports or []} for r in self.config.randr]
+        return {'active': self.config.active, 'randr': randr}
+
+    def do_status(self, request):
+        return {'active': self.config.active, 'outputs': self.get_outputs()}
+
+    def do_available(self, request):
+        outputs = self.get_outputs()
+        return {'codes': [r.code for r in self.config.available_randr(outputs)]}
+
+    def do_apply(self, request):
+        code = request.get('code')
+        randr = self.config.get_randr(code)
+        if randr is None:
+            raise RequestError("Unknown configuration : {}".format(code))
+        if not request.get('force') and not randr.available(self.get_outputs()):
+            raise RequestError("Configuration not available with the connected outputs : {}".format(code))
+        layout = self.apply_randr(randr)
+        # the captured layout is returned to restore exactly this one (ie apply --confirm)
+        return {'active': randr.code, 'rollback': layout is not None,
+            'layout': layout.as_dict() if layout is not None else None}
+
+    def do_layouts(self, request):
+        history = self.config.get_layout_history()
+        layouts = history.list() if history is not None else []
+        return {'layouts': [{'time': layout.time, 'code': layout.code, 'layout': layout.describe()}
+            for layout in layouts]}
+
+    def do_rollback(self, request):
+        if request.get('layout') is not None:
+            # layout returned by an apply request
+            try:
+                layout = chrandr.snapshot.Layout.from_dict(request['layout'])
+            except (KeyError, TypeError, ValueError):
+                raise RequestError("Invalid layout : {}".format(request['layout']))
+        else:
+            index = request.get('index', 0)
+            history = self.config.get_layout_history()
+            layout = history.get(index) if history is not None and isinstance(index, int) else None
+            if layout is None:
+                raise RequestError("No layout in the history at index {}".format(index))
+        self.restore_layout(layout)
+        return {'active': self.config.active, 'layout': layout.describe()}
+
+    def apply_randr(self, randr):
+        """
+        Apply a configuration, applies are serialized.
+        The previous layout is restored if a command fails (see chrandr.snapshot).
+
+        Returns:
+            The previous Layout, added to the history if commands are executed, None if not captured.
+        Raises:
+            ProcessException: If a command fails.
+        """
+        with self._apply_lock, chrandr.trace.span('apply', code=randr.code):
+            self._logger.debug("Apply the output code '%s'", randr.code)
+            start = time.monotonic()
+            layout, screen = chrandr.snapshot.capture(self.config)
+            try:
+                groups = self.config.plan_groups(randr, screen=screen)
+                if any(groups.values()):
+                    chrandr.snapshot.record(self.config, layout)
+                    chrandr.utils.execute_groups(groups, after=randr.after,
+                        timeout=self.config.timeout, total_timeout=self.config.total_timeout,
+                        log=self.config.get_command_log())
+            except chrandr.utils.ProcessException as e:
+                chrandr.metrics.record_apply(randr.code, time.monotonic() - start, e)
+                self.config.save_active_randr(None)
+                if layout is not None:
+                    self._rollback(layout)
+                raise
+            finally:
+                self.invalidate_outputs()
+            chrandr.metrics.record_apply(randr.code, time.monotonic() - start)
+            self.config.save_active_randr(randr)
+            if self.selector is not None:
+                self.selector.remember(randr)
+            return layout
+
+    def _rollback(self, layout):
+        """Restore the layout captured before a failed apply, errors are only logged."""
+        try:
+            chrandr.snapshot.restore(layout, timeout=self.config.timeout, log=self.config.get_command_log())
+        except chrandr.utils.ProcessException as e:
+            self._logger.error("Previous layout not restored: %s", e)
+        else:
+            self.config.save_active_randr(self.config.get_randr(layout.code))
+
+    def restore_layout(self, layout):
+        """
+        Restore a layout of the history, its configuration becomes the active one.
+
+        Raises:
+            ProcessException: If xrandr fails.
+        """
+        with self._apply_lock:
+            try:
+                chrandr.snapshot.restore(layout, timeout=self.config.timeout, log=self.config.get_command_log())
+            finally:
+                self.invalidate_outputs()
+            self.config.save_active_randr(self.config.get_randr(layout.code))
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    """Handle the requests of a client connection, one JSON object per line."""
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line.decode('utf-8'))
+            except ValueError:
+                response = {'ok': False, 'error': "Invalid request"}
+            else:
+                response = self.server.service.handle(request)
+            self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+            self.wfile.flush()
+
+
+class ChrandrDaemon(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    UNIX socket server of the chrandr daemon.
+
+    Fields:
+        * service (ChrandrService): Requests handling
+        * socket_filename (str): Socket filename
+    """
+
+    daemon_threads = True
+
+    def __init__(self, service, socket_filename=None):
+        """
+        Raises:
+            OSError: If the socket cannot be created or another daemon is running.
+        """
+        self._logger = logging.getLogger(self.__class__.__name__)
+        self.service = service
+        self.socket_filename = socket_filename if socket_filename else _get_socket_filename()
+        self._remove_stale_socket()
+        old_umask = os.umask(0o077)
+        try:
+            super().__init__(self.socket_filename, _RequestHandler)
+        finally:
+            os.umask(old_umask)
+        self._watcher = None
+        self._watcher_stop = threading.Event()
+
+    def _remove_stale_socket(self):
+        """Remove the socket file left by a dead daemon, raises OSError if a daemon is running."""
+        if not os.path.exists(self.socket_filename):
+            return
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            try:
+                sock.connect(self.socket_filename)
+            except OSError:
+                self._logger.debug("Removing stale socket %s", self.socket_filename)
+                os.unlink(self.socket_filename)
+            else:
+                raise OSError("A chrandr daemon is already running on " + self.socket_filename)
+
+    def watch_outputs(self, delay=0.3):
+        """Refresh the connected outputs when they change, in a background thread."""
+        self._watcher = chrandr.watcher.OutputWatcher(self.service.on_outputs_changed, delay=delay)
+        if not self._watcher.available():
+            self._logger.info("Outputs changes cannot be watched, outputs queried on each request")
+            self._watcher = None
+            return
+        self.service.cache_outputs = True
+        thread = threading.Thread(target=self._watcher.run, args=(self._watcher_stop,),
+            name='chrandr-watcher', daemon=True)
+        thread.start()
+
+    def watch_config(self, delay=0.3):
+        """Reload the configuration file when it changes, in a background thread."""
+        watcher = chrandr.watcher.FileWatcher(self.service.config.filename, self.service.on_config_changed,
+            delay=delay)
+        thread = threading.Thread(target=watcher.run, args=(self._watcher_stop,),
+            name='chrandr-config-watcher', daemon=True)
+        thread.start()
+
+    def serve(self):
+        """Serve requests until shutdown() is called (ie by SIGTERM)."""
+        self._logger.info("Listening on %s", self.socket_filename)
+        self.service.refresh_outputs()
+        try:
+            self.serve_forever()
+        finally:
+            self.close()
+
+    def close(self):
+        """Stop the watcher, close and remove the socket."""
+        self._watcher_stop.set()
+        self.server_close()
+        try:
+            os.unlink(self.socket_filename)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+chrandr - Several X displays at once.
+
+Hosts running several X servers (kiosks, meeting rooms...) are handled by one chrandr :
+the displays are given (ie [':0', ':1']) or discovered from the X sockets in /tmp/.X11-unix.
+The outputs of each display are queried concurrently, with a backend opened on the display,
+the configuration matching the outputs is selected (see chrandr.autoselect.best_match()) or given,
+and applied with DISPLAY set in the commands environment.
+The results and errors of all displays are collected in one report (list of DisplayResult).
+
+The active configuration (status file) is not updated, it is shared by all displays.
+"""
+
+import os
+import re
+import time
+import logging
+import concurrent.futures
+
+import chrandr.backends
+import chrandr.metrics
+import chrandr.utils
+from chrandr.autoselect import best_match
+
+
+# X sockets directory, one socket 'X<number>' per local display
+X11_SOCKET_DIR = '/tmp/.X11-unix'
+_SOCKET_RE = re.compile(r"^X(\d+)$")
+# Maximum number of displays handled concurrently
+DEFAULT_MAX_WORKERS = 8
+
+
+def discover_displays(socket_dir=X11_SOCKET_DIR):
+    """Returns the local displays (ie [':0', ':1']) from the X sockets, in display number order."""
+    try:
+        names = os.listdir(socket_dir)
+    except OSError:
+        return []
+    numbers = sorted(int(match.group(1)) for match in map(_SOCKET_RE.match, names) if match)
+    return [":{}".format(number) for number in numbers]
+
+
+class DisplayResult:
+    """
+    Result of a display.
+
+    Fields:
+        * display (str): X display, ie ':1'
+        * outputs (list of str): Connected outputs, None if the query failed
+        * code (str): Code of the selected configuration, None if no configuration is available
+        * applied (bool): True if the configuration was applied
+        * error (str): Error message, None on success
+        * output (str): Output of the failed command, None if unknown
+        * duration (float): Duration in seconds
+    """
+
+    __slots__ = ('display', 'outputs', 'code', 'applied', 'error', 'output', 'duration')
+
+    def __init__(self, display):
+        self.display = display
+        self.outputs = None
+        self.code = None
+        self.applied = False
+        self.error = None
+        self.output = None
+        self.duration = None
+
+    def as_dict(self):
+        """Returns the result as a dict (JSON serializable)."""
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __str__(self):
+        return "DisplayResult(display={}, code={}, error={})".format(self.display, self.code, self.error)
+    def __repr__(self):
+        return self.__str__()
+
+
+def run_display(config, display, apply=False, code=None, backend_name=None):
+    """
+    Query the outputs of a display, select its configuration and apply it.
+
+    Args:
+        * config (ChrandrConfig): Loaded configuration
+        * display (str): X display, ie ':1'
+        * apply (bool): Apply the selected configuration, False to only select it
+        * code (str): Configuration to select if available, None to select the one matching the outputs
+        * backend_name (str): Backend name (see chrandr.backends.create_backend()), None for the first available
+    Returns:
+        The DisplayResult, errors are not raised.
+    """
+    logger = logging.getLogger('run_display')
+    result = DisplayResult(display)
+    start = time.monotonic()
+    try:
+        backend = chrandr.backends.create_backend(backend_name, display=display)
+    except chrandr.backends.BackendUnavailable as e:
+        result.error = str(e)
+        result.duration = time.monotonic() - start
+        return result
+    try:
+        result.outputs = backend.get_connected_outputs()
+        available = config.available_randr(result.outputs)
+        if code is None:
+            randr = best_match(available, result.outputs)
+        else:
+            randr = next((r for r in available if r.code == code), None)
+        if randr is None:
+            result.error = "No configuration available" if code is None \
+                else "Configuration not available : {}".format(code)
+        else:
+            result.code = randr.code
+            if apply:
+                logger.debug("Apply the output code '%s' on %s", randr.code, display)
+                apply_start = time.monotonic()
+                groups = config.plan_groups(randr, backend=backend)
+                if any(groups.values()):
+                    chrandr.utils.execute_groups(groups, after=randr.after, timeout=config.timeout,
+                        total_timeout=config.total_timeout, log=config.get_command_log(),
+                        env=dict(os.environ, DISPLAY=display))
+                chrandr.metrics.record_apply(randr.code, time.monotonic() - apply_start)
+                result.applied = True
+    except chrandr.utils.ProcessException as e:
+        if result.code is not None and apply:
+            chrandr.metrics.record_apply(result.code, time.monotonic() - apply_start, e)
+        result.error = str(e)
+        result.output = e.output
+    except Exception as e:
+        logger.debug("Display %s failed", display, exc_info=True)
+        result.error = str(e) or e.__class__.__name__
+    finally:
+        backend.close()
+    result.duration = time.monotonic() - start
+    return result
+
+
+def run_displays(config, displays, apply=False, code=None, backend_name=None, max_workers=DEFAULT_MAX_WORKERS):
+    """
+    Handle several displays concurrently, see run_display().
+
+    Returns:
+        The list of DisplayResult, in displays order.
+    """
+    if not displays:
+        return []
+    # build the ports index before the threads use it
+    config.available_randr([])
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(max_workers, len(displays)),
+            thread_name_prefix='chrandr-display') as pool:
+        futures = [pool.submit(run_display, config, display, apply, code, backend_name) for display in displays]
+        return [future.result() for future in futures]
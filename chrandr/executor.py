@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+chrandr - Asynchronous commands execution
+
+Commands are executed on a worker thread, so the GTK main loop is not blocked.
+Callbacks are called through a dispatch function, ie to call them in the main loop.
+"""
+
+import logging
+import threading
+
+import chrandr.utils
+from chrandr.config import MAIN_GROUP
+
+
+def _direct_dispatch(func, *args):
+    """Dispatch function calling func in the current thread."""
+    func(*args)
+
+
+def _as_groups(commands):
+    """Returns the commands groups of a list of commands (one group) or of commands groups."""
+    return commands if isinstance(commands, dict) else {MAIN_GROUP: commands}
+
+
+class Execution:
+    """
+    An execution of commands groups, running on a worker thread (see chrandr.utils.execute_groups()).
+
+    Fields:
+        * groups (dict): Commands groups to execute {group name: list of str}
+        * after (dict): Groups dependencies {group name: list of groups names}
+        * error (ProcessException): Error of the execution, None if succeeded or not finished
+        * finished (bool): True when the execution is finished
+    """
+
+    def __init__(self, groups, after=None, timeout=None, total_timeout=None):
+        self.groups = groups
+        self.after = after or {}
+        self.timeout = timeout
+        self.total_timeout = total_timeout
+        self.error = None
+        self.finished = False
+        self._cancel_event = threading.Event()
+        self._thread = None
+
+    @property
+    def commands(self):
+        """All the commands to execute (list of str), in groups order."""
+        return [cmd for commands in self.groups.values() for cmd in commands]
+
+    def cancel(self):
+        """Cancel the execution, the running commands are killed."""
+        self._cancel_event.set()
+
+    @property
+    def cancelled(self):
+        return self._cancel_event.is_set()
+
+    def wait(self, timeout=None):
+        """Wait the end of the execution. Returns True if finished."""
+        if self._thread is not None:
+            self._thread.join(timeout)
+        return self.finished
+
+
+class AsyncExecutor:
+    """
+    Execute commands on a worker thread, one execution at a time.
+    Starting an execution cancels the previous one (the previous one is superseded),
+    the new one is started once the previous one is finished.
+    """
+
+    def __init__(self, dispatch=None):
+        """
+        Args:
+            * dispatch (callable): Called with (func, *args) to call the callbacks,
+                                   ie to call them in the GTK main loop. None to call them in the worker thread.
+        """
+        self._logger = logging.getLogger(self.__class__.__name__)
+        self._dispatch = dispatch if dispatch is not None else _direct_dispatch
+        self.current = None
+
+    def start(self, commands, on_progress=None, on_done=None, timeout=None, total_timeout=None, prepare=None,
+            after=None, on_output=None, log=None, finish=None):
+        """
+        Start the execution of commands.
+
+        Args:
+            * commands (list of str or dict): Commands to execute, or commands groups {group name: list of str}
+            * on_progress (callable): Called with (execution, index, command) before each command
+            * on_done (callable): Called with (execution) when the execution is finished,
+                                  execution.error is set on failure
+            * timeout (float): Maximum duration of each command in seconds
+            * total_timeout (float): Maximum duration of all commands in seconds
+            * prepare (callable): Called in the worker thread with (commands) before the execution,
+                                  after the end of the superseded execution,
+                                  returns the commands (or commands groups) to execute
+            * after (dict): Groups dependencies {group name: list of groups names executed before}
+            * on_output (callable): Called with (execution, text) while the commands output is read
+            * log (CommandLog): Log of the whole commands output
+            * finish (callable): Called in the worker thread with (execution) after the execution,
+                                 before on_done, ie to restore the previous state on error
+        Returns:
+            The started Execution.
+        """
+        previous = self.current
+        if previous is not None and not previous.finished:
+            self._logger.debug("Previous execution superseded")
+            previous.cancel()
+        execution = Execution(_as_groups(commands), after=after, timeout=timeout, total_timeout=total_timeout)
+
+        def progress(index, command):
+            if on_progress is not None:
+                self._dispatch(on_progress, execution, index, command)
+
+        def output(text):
+            if on_output is not None:
+                self._dispatch(on_output, execution, text)
+
+        def run():
+            if previous is not None:
+                # the superseded execution could still be killing its commands or restoring its previous state
+                previous.wait()
+            try:
+                if prepare is not None:
+                    execution.groups = _as_groups(prepare(commands))
+                chrandr.utils.execute_groups(execution.groups, after=execution.after, timeout=timeout,
+                    total_timeout=total_timeout, cancel_event=execution._cancel_event, on_progress=progress,
+                    on_output=output, log=log)
+            except chrandr.utils.ProcessException as e:
+                execution.error = e
+            except Exception as e:
+                # unexpected error (ie command cannot be started), reported as a process error
+                self._logger.error("Execution failed", exc_info=True)
+                execution.error = chrandr.utils.ProcessException(None, None, str(e))
+                execution.error.__cause__ = e
+            if finish is not None:
+                try:
+                    finish(execution)
+                except Exception:
+                    self._logger.error("Execution finish failed", exc_info=True)
+            execution.finished = True
+            if on_done is not None:
+                self._dispatch(on_done, execution)
+
+        execution._thread = threading.Thread(target=run, name='chrandr-executor', daemon=True)
+        self.current = execution
+        execution._thread.start()
+        return execution
+
+    def cancel(self):
+        """Cancel the current execution, if any."""
+        if self.current is not None:
+            self.current.cancel()
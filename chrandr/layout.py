@@ -0,0 +1,333 @@
+# -*- coding: utf-8 -*-
+"""
+chrandr - Layout of xrandr commands.
+
+Simple xrandr commands (ie `xrandr --output VGA-1 --auto --output LVDS-1 --off`) are parsed,
+and compared with the current screen state (see chrandr.model) :
+the outputs already in the requested state are removed from the command,
+and the command is not executed if nothing changes (no useless mode-set, no screen blanking).
+Other commands (not xrandr, shell syntax, unknown xrandr options) are kept as is.
+
+Adjacent xrandr commands changing different outputs are also merged into one invocation
+(one process and one CRTC reconfiguration instead of several).
+"""
+
+import re
+import shlex
+import logging
+
+import chrandr.backends
+from chrandr.utils import PreparedCommand, split_command
+
+
+# per output options compared with the screen state, and their number of arguments
+_DIFF_OPTIONS = {
+    '--auto': 0, '--off': 0, '--primary': 0,
+    '--mode': 1, '--rate': 1, '-r': 1, '--refresh': 1, '--pos': 1, '--rotate': 1, '--reflect': 1,
+}
+# other per output options (kept, never compared), and their number of arguments
+_OUTPUT_OPTIONS = {
+    '--preferred': 0, '--left-of': 1, '--right-of': 1, '--above': 1, '--below': 1, '--same-as': 1,
+    '--scale': 1, '--scale-from': 1, '--transform': 1, '--brightness': 1, '--gamma': 1, '--crtc': 1,
+    '--panning': 1, '--filter': 1, '--set': 2,
+}
+_REFLECTIONS = {'normal': None, 'x': 'X axis', 'y': 'Y axis', 'xy': 'X and Y axis'}
+
+
+class OutputChange:
+    """
+    Options given to an output in a xrandr command (`--output <name> <options>`).
+
+    Fields:
+        * name (str): Output name
+        * options (list of tuple): Options with their arguments, ie [('--mode', '1920x1080'), ('--auto',)]
+    """
+
+    __slots__ = ('name', 'options')
+
+    def __init__(self, name):
+        self.name = name
+        self.options = []
+
+    def args(self):
+        """Returns the xrandr arguments of this change."""
+        args = ['--output', self.name]
+        for option in self.options:
+            args.extend(option)
+        return args
+
+    def diffable(self):
+        """Returns True if all options could be compared with the screen state."""
+        return all(option[0] in _DIFF_OPTIONS for option in self.options)
+
+    def is_noop(self, output):
+        """
+        Returns True if the output (chrandr.model.Output) is already in the requested state.
+        The change must be diffable.
+        """
+        if output is None:
+            return False
+        mode = output.current_mode
+        for option in self.options:
+            name = option[0]
+            if name == '--off':
+                if output.enabled:
+                    return False
+            elif name == '--auto':
+                # --auto : preferred mode if connected, disabled otherwise
+                if output.connected:
+                    if mode is None or not mode.preferred:
+                        return False
+                elif output.enabled:
+                    return False
+            elif name == '--primary':
+                if not output.primary:
+                    return False
+            elif name == '--mode':
+                if mode is None or option[1] not in (mode.name, _mode_id(mode)):
+                    return False
+            elif name in ('--rate', '-r', '--refresh'):
+                try:
+                    rate = float(option[1])
+                except ValueError:
+                    return False
+                if mode is None or mode.refresh is None or abs(mode.refresh - rate) > 0.05:
+                    return False
+            elif name == '--pos':
+                if not output.enabled or option[1] != "{}x{}".format(output.x, output.y):
+                    return False
+            elif name == '--rotate':
+                if output.rotation != option[1]:
+                    return False
+            elif name == '--reflect':
+                if option[1] not in _REFLECTIONS or output.reflection != _REFLECTIONS[option[1]]:
+                    return False
+        return True
+
+    def apply_to(self, screen):
+        """
+        Update the screen state (chrandr.model.Screen) as xrandr would do.
+        The change must be diffable.
+
+        Returns:
+            False if the resulting state cannot be known (ie position of a newly enabled output).
+        """
+        output = screen.get_output(self.name)
+        if output is None:
+            return False
+        was_enabled = output.enabled
+        options = dict((option[0], option[1:]) for option in self.options)
+        new_mode = None
+        if '--off' in options or ('--auto' in options and not output.connected):
+            output.x = output.y = output.width = output.height = None
+            for mode in output.modes:
+                mode.current = False
+            return True
+        if '--mode' in options:
+            new_mode = next((m for m in output.modes if options['--mode'][0] in (m.name, _mode_id(m))), None)
+        elif '--auto' in options:
+            new_mode = output.preferred_mode
+        elif '--rotate' in options:
+            # size is swapped by the rotation
+            new_mode = output.current_mode
+        rate = options.get('--rate') or options.get('-r') or options.get('--refresh')
+        if rate is not None:
+            return False
+        if '--rotate' in options:
+            output.rotation = options['--rotate'][0]
+        if '--reflect' in options:
+            output.reflection = _REFLECTIONS.get(options['--reflect'][0])
+        if '--primary' in options:
+            for other in screen.outputs:
+                other.primary = other is output
+        if new_mode is not None:
+            for mode in output.modes:
+                mode.current = mode is new_mode
+            if output.rotation in ('left', 'right'):
+                output.width, output.height = new_mode.height, new_mode.width
+            else:
+                output.width, output.height = new_mode.width, new_mode.height
+        if '--pos' in options:
+            match = re.match(r"^(-?\d+)x(-?\d+)$", options['--pos'][0])
+            if not match or not output.enabled:
+                return False
+            output.x, output.y = int(match.group(1)), int(match.group(2))
+        elif output.enabled and not was_enabled:
+            # position chosen by xrandr
+            return False
+        return True
+
+
+def _mode_id(mode):
+    """Returns the xrandr hexadecimal id of a mode (ie '0x48'), None if unknown."""
+    return None if mode.id is None else "0x{:x}".format(mode.id)
+
+
+class XrandrCommand:
+    """
+    A parsed xrandr command.
+
+    Fields:
+        * program (str): xrandr program (ie 'xrandr' or '/usr/bin/xrandr')
+        * global_args (list of str): Arguments not related to an output
+        * changes (list of OutputChange): Outputs changes, in command order
+    """
+
+    __slots__ = ('program', 'global_args', 'changes')
+
+    def __init__(self, program):
+        self.program = program
+        self.global_args = []
+        self.changes = []
+
+    @classmethod
+    def parse(cls, cmd):
+        """Returns the XrandrCommand of a command line, None if it is not a simple xrandr command."""
+        args = cmd.args if isinstance(cmd, PreparedCommand) else split_command(cmd)
+        if not args or args[0].rsplit('/', 1)[-1] != 'xrandr':
+            return None
+        command = cls(args[0])
+        change = None
+        index = 1
+        while index < len(args):
+            arg = args[index]
+            if arg == '--output':
+                if index + 1 >= len(args):
+                    return None
+                change = OutputChange(args[index + 1])
+                command.changes.append(change)
+                index += 2
+                continue
+            nb_args = _DIFF_OPTIONS.get(arg, _OUTPUT_OPTIONS.get(arg))
+            if change is None or nb_args is None:
+                # global option, arguments unknown : the rest of the command is global
+                command.global_args.extend(args[index:])
+                break
+            if index + nb_args >= len(args):
+                # missing option arguments
+                return None
+            change.options.append(tuple(args[index:index + 1 + nb_args]))
+            index += 1 + nb_args
+        return command
+
+    def outputs(self):
+        """Returns the set of outputs names changed by the command."""
+        return set(change.name for change in self.changes)
+
+    def primary(self):
+        """Returns True if the command sets a primary output."""
+        return any(option[0] == '--primary' for change in self.changes for option in change.options)
+
+    def mergeable(self, other):
+        """
+        Returns True if the other command could be executed in the same invocation, after this one :
+        same program, no global argument, different outputs and at most one primary output.
+        """
+        return (self.program == other.program and not self.global_args and not other.global_args
+            and self.outputs().isdisjoint(other.outputs()) and not (self.primary() and other.primary()))
+
+    def merge(self, other):
+        """Add the other command changes to this command (see mergeable())."""
+        self.changes.extend(other.changes)
+
+    def args(self, changes=None):
+        """Returns the command arguments, with only the `changes` if given."""
+        args = [self.program]
+        for change in (self.changes if changes is None else changes):
+            args.extend(change.args())
+        args.extend(self.global_args)
+        return args
+
+
+def remove_unchanged(commands, screen):
+    """
+    Remove from the xrandr commands the outputs already in the requested state.
+    The screen state is updated with each command, following commands are compared with the expected state.
+    As soon as a command result is unknown, following commands are kept as is.
+
+    Args:
+        * commands (list of str): Commands to execute
+        * screen (chrandr.model.Screen): Current screen state, modified by this function
+    Returns:
+        The list of commands to execute.
+    """
+    logger = logging.getLogger('remove_unchanged')
+    result = []
+    known = screen is not None
+    for cmd in commands:
+        command = XrandrCommand.parse(cmd) if known else None
+        if command is None:
+            result.append(cmd)
+            continue
+        if command.global_args or not all(change.diffable() for change in command.changes):
+            # cannot predict the result of this command
+            result.append(cmd)
+            known = False
+            continue
+        changes = [c for c in command.changes if not c.is_noop(screen.get_output(c.name))]
+        if not changes:
+            logger.debug("Command skipped, outputs unchanged: %s", cmd)
+            continue
+        if len(changes) < len(command.changes):
+            reduced = shlex.join(command.args(changes))
+            logger.debug("Command reduced to changed outputs: %s", reduced)
+            result.append(reduced)
+        else:
+            result.append(cmd)
+        for change in changes:
+            if not change.apply_to(screen):
+                known = False
+    return result
+
+
+def merge_commands(commands):
+    """
+    Merge the adjacent xrandr commands which could be executed in one invocation (see XrandrCommand.mergeable()).
+
+    Args:
+        * commands (list of str): Commands to execute
+    Returns:
+        The list of commands to execute.
+    """
+    logger = logging.getLogger('merge_commands')
+    result = []
+    # last xrandr command and its index in result, None if the last command is not a xrandr one
+    previous = None
+    merged = False
+    for cmd in commands:
+        command = XrandrCommand.parse(cmd)
+        if command is not None and previous is not None and previous.mergeable(command):
+            previous.merge(command)
+            result[-1] = shlex.join(previous.args())
+            merged = True
+            continue
+        previous = command
+        result.append(cmd)
+    if merged:
+        logger.debug("xrandr commands merged: %d commands instead of %d", len(result), len(commands))
+    return result
+
+
+def plan_commands(commands, backend=None, screen=None):
+    """
+    Returns the commands to execute, the unchanged outputs are removed (see remove_unchanged()).
+    The current state is queried with the backend, all commands are kept if it fails.
+
+    Args:
+        * commands (list of str): Commands to execute
+        * backend (OutputBackend): Backend to use, None to use the default one (see chrandr.backends)
+        * screen (chrandr.model.Screen): Current screen state already queried, modified by this function
+    """
+    logger = logging.getLogger('plan_commands')
+    if not any(XrandrCommand.parse(cmd) for cmd in commands):
+        return list(commands)
+    if screen is not None:
+        return remove_unchanged(commands, screen)
+    try:
+        if backend is None:
+            backend = chrandr.backends.get_backend()
+        screen = backend.get_state()
+    except Exception:
+        logger.warning("Cannot get the screen state, all commands are executed", exc_info=True)
+        return list(commands)
+    return remove_unchanged(commands, screen)
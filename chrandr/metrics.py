@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""
+chrandr - Persistent apply metrics.
+
+When metrics are enabled (option `metrics`, see ChrandrConfig.get_metrics()), the applies, the commands
+and the outputs queries of the process are recorded in the metrics file (see chrandr.metrics_file).
+The recording functions (record_*()) do nothing when metrics are disabled, the metrics file module
+is only imported when they are enabled.
+"""
+
+import os
+import logging
+import threading
+
+
+_metrics = None
+_metrics_lock = threading.Lock()
+
+
+def enable(filename):
+    """
+    Enable the metrics recording in a file.
+
+    Returns:
+        The Metrics (see chrandr.metrics_file), None if the file cannot be opened (metrics are then not recorded).
+    """
+    global _metrics
+    with _metrics_lock:
+        if _metrics is None:
+            import chrandr.metrics_file
+            try:
+                _metrics = chrandr.metrics_file.Metrics(filename)
+            except OSError as e:
+                logging.getLogger('enable').warning("Cannot open the metrics file %s: %s", filename, e)
+        return _metrics
+
+
+def get_metrics():
+    """Returns the Metrics, None if metrics are disabled."""
+    return _metrics
+
+
+def exit_code_label(error):
+    """Returns the exit_code label of an error (ProcessException) : exit status, 'timeout', 'cancelled' or 'error'."""
+    import chrandr.utils
+    if isinstance(error, chrandr.utils.CommandsFailed):
+        error = error.errors[0]
+    if isinstance(error, chrandr.utils.CommandTimeout):
+        return 'timeout'
+    if isinstance(error, chrandr.utils.CommandCancelled):
+        return 'cancelled'
+    return 'error' if error.exit_code is None else str(error.exit_code)
+
+
+def command_label(cmd):
+    """Returns the command label of a command : its program name, ie 'xrandr'."""
+    args = getattr(cmd, 'args', None)
+    words = args if args else str(cmd).split(None, 1)
+    return os.path.basename(words[0]) if words else ''
+
+
+def record_apply(code, duration, error=None):
+    """Record a configuration apply, error is the ProcessException of a failed apply."""
+    if _metrics is None:
+        return
+    _metrics.observe('chrandr_apply_duration_seconds', duration, code=code)
+    if error is not None:
+        _metrics.increment('chrandr_apply_failures_total', code=code, exit_code=exit_code_label(error))
+
+
+def record_command(cmd, duration, error=None):
+    """Record a command execution, error is the ProcessException of a failed command."""
+    if _metrics is None:
+        return
+    command = command_label(cmd)
+    _metrics.observe('chrandr_command_duration_seconds', duration, command=command)
+    if error is not None:
+        _metrics.increment('chrandr_command_failures_total', command=command, exit_code=exit_code_label(error))
+
+
+def record_query(probe, duration):
+    """Record an outputs query, with or without probe."""
+    if _metrics is not None:
+        _metrics.observe('chrandr_query_duration_seconds', duration, mode='probe' if probe else 'current')
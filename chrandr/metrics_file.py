@@ -0,0 +1,319 @@
+# -*- coding: utf-8 -*-
+"""
+chrandr - Metrics file.
+
+Recorded metrics (see chrandr.metrics) :
+    * chrandr_apply_duration_seconds{code} : duration of the configurations applies (histogram)
+    * chrandr_apply_failures_total{code,exit_code} : failed applies
+    * chrandr_command_duration_seconds{command} : duration of each executed command, by program (histogram)
+    * chrandr_command_failures_total{command,exit_code} : failed commands
+    * chrandr_query_duration_seconds{mode} : duration of the outputs queries, with or without probe (histogram)
+The exit code label is the command exit status, or 'timeout', 'cancelled', 'error' (command not started...).
+
+Series are stored in a fixed-size file of the runtime directory, memory-mapped and shared by the processes
+(window, daemon, commands) : a header followed by slots, one per series (name and labels, count, sum and
+histogram buckets). Updates are serialized by a lock on the file. When all the slots are used, new series
+are dropped.
+
+The series are exported in the Prometheus text format (ie for the node_exporter textfile collector)
+or in JSON, see read(), format_prometheus() and format_json().
+"""
+
+import os
+import fcntl
+import struct
+from stat import S_ISREG
+import logging
+import threading
+
+
+COUNTER = 'counter'
+HISTOGRAM = 'histogram'
+
+# recorded metrics {name: (type, help)}
+METRICS = {
+    'chrandr_apply_duration_seconds': (HISTOGRAM, "Duration of the configurations applies."),
+    'chrandr_apply_failures_total': (COUNTER, "Failed configurations applies, by exit code."),
+    'chrandr_command_duration_seconds': (HISTOGRAM, "Duration of the executed commands, by program."),
+    'chrandr_command_failures_total': (COUNTER, "Failed commands, by program and exit code."),
+    'chrandr_query_duration_seconds': (HISTOGRAM, "Duration of the outputs queries, with or without probe."),
+}
+# upper bounds of the histograms buckets in seconds, the +Inf bucket is the count
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# number of series of the file
+DEFAULT_CAPACITY = 512
+
+_MAGIC = b'CHRMETR1'
+# magic, used slots, slots capacity
+_HEADER = struct.Struct('<8sII')
+_HEADER_SIZE = 64
+# kind (0 unused), series key, count, sum, buckets
+_SLOT = struct.Struct('<B191sQd{}Q'.format(len(BUCKETS)))
+_KEY_SIZE = 191
+_KINDS = {COUNTER: 1, HISTOGRAM: 2}
+# key separators : name, then label=value
+_SEP = '\x1f'
+
+
+def _file_size(capacity):
+    return _HEADER_SIZE + capacity * _SLOT.size
+
+
+def _series_key(name, labels):
+    """Returns the encoded key of a series, labels sorted by name."""
+    parts = [name]
+    for label, value in sorted(labels.items()):
+        parts.append("{}={}".format(label, str(value).replace(_SEP, ' ')))
+    return _SEP.join(parts).encode('utf-8')
+
+
+def _parse_key(key):
+    """Returns (name, labels dict) of an encoded key."""
+    name, *parts = key.decode('utf-8', 'replace').split(_SEP)
+    return name, dict(part.split('=', 1) for part in parts)
+
+
+class _FileLock:
+    """Exclusive lock of a file descriptor, in a `with` block."""
+
+    __slots__ = ('_fd',)
+
+    def __init__(self, fd):
+        self._fd = fd
+
+    def __enter__(self):
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+
+class Metrics:
+    """
+    Metrics file, memory-mapped.
+
+    Fields:
+        * filename (str): Metrics file
+        * capacity (int): Maximum number of series
+    """
+
+    def __init__(self, filename, capacity=DEFAULT_CAPACITY):
+        """
+        Open the metrics file, created (or reset if its format differs) if needed.
+
+        Raises:
+            OSError: If the file cannot be opened, or is not a metrics file of the user.
+        """
+        import mmap
+        self._logger = logging.getLogger(self.__class__.__name__)
+        self.filename = filename
+        self._lock = threading.Lock()
+        # slot index of the known series {key: index}, and number of slots read
+        self._slots = {}
+        self._read_slots = 0
+        self._dropped = set()
+        # not a symbolic link (predictable name in /tmp without runtime directory)
+        self._fd = os.open(filename, os.O_RDWR | os.O_CREAT | os.O_NOFOLLOW, 0o600)
+        try:
+            stat = os.fstat(self._fd)
+            if not S_ISREG(stat.st_mode) or stat.st_uid != os.getuid():
+                raise OSError("Not a regular file of the user: {}".format(filename))
+            with self._file_lock():
+                header = os.pread(self._fd, _HEADER.size, 0)
+                magic, used, capacity_found = _HEADER.unpack(header) if len(header) == _HEADER.size \
+                    else (None, 0, 0)
+                if magic != _MAGIC or os.fstat(self._fd).st_size != _file_size(capacity_found):
+                    # only a new file, or a metrics file of another format, is reset
+                    if header and not header.startswith(_MAGIC[:-1]):
+                        raise OSError("Not a metrics file: {}".format(filename))
+                    if magic is not None:
+                        self._logger.warning("Invalid metrics file %s, reset", filename)
+                    os.ftruncate(self._fd, 0)
+                    os.ftruncate(self._fd, _file_size(capacity))
+                    os.pwrite(self._fd, _HEADER.pack(_MAGIC, 0, capacity), 0)
+                    capacity_found = capacity
+            self.capacity = capacity_found
+            self._map = mmap.mmap(self._fd, _file_size(self.capacity))
+        except Exception:
+            os.close(self._fd)
+            raise
+
+    def _file_lock(self):
+        """Returns a context manager locking the file, exclusively between processes."""
+        return _FileLock(self._fd)
+
+    def _find_slot(self, kind, key):
+        """Returns the slot index of a series, a slot is allocated if needed, None if the file is full."""
+        index = self._slots.get(key)
+        if index is not None:
+            return index
+        # slots allocated by other processes
+        _, used, _ = _HEADER.unpack_from(self._map, 0)
+        for index in range(self._read_slots, used):
+            self._slots[_SLOT.unpack_from(self._map, _HEADER_SIZE + index * _SLOT.size)[1].rstrip(b'\0')] = index
+        self._read_slots = used
+        index = self._slots.get(key)
+        if index is not None:
+            return index
+        if used >= self.capacity:
+            if key not in self._dropped:
+                self._dropped.add(key)
+                self._logger.warning("Metrics file %s is full, series dropped: %s %s", self.filename, *_parse_key(key))
+            return None
+        _SLOT.pack_into(self._map, _HEADER_SIZE + used * _SLOT.size, kind, key, 0, 0.0, *([0] * len(BUCKETS)))
+        _HEADER.pack_into(self._map, 0, _MAGIC, used + 1, self.capacity)
+        self._slots[key] = used
+        self._read_slots = used + 1
+        return used
+
+    def _update(self, name, labels, value=None):
+        kind = _KINDS[METRICS[name][0]]
+        key = _series_key(name, labels)
+        if len(key) > _KEY_SIZE:
+            self._logger.debug("Series key too long, dropped: %s", key)
+            return
+        with self._lock, self._file_lock():
+            index = self._find_slot(kind, key)
+            if index is None:
+                return
+            offset = _HEADER_SIZE + index * _SLOT.size
+            _, _, count, total, *buckets = _SLOT.unpack_from(self._map, offset)
+            if value is not None:
+                total += value
+                for bucket, bound in enumerate(BUCKETS):
+                    if value <= bound:
+                        buckets[bucket] += 1
+                        break
+            _SLOT.pack_into(self._map, offset, kind, key, count + 1, total, *buckets)
+
+    def increment(self, name, **labels):
+        """Increment a counter series."""
+        self._update(name, labels)
+
+    def observe(self, name, value, **labels):
+        """Add a value (duration in seconds) to a histogram series."""
+        self._update(name, labels, value)
+
+    def close(self):
+        self._map.close()
+        os.close(self._fd)
+
+
+class Series:
+    """
+    A series read from the metrics file.
+
+    Fields:
+        * name (str): Metric name, ie 'chrandr_apply_duration_seconds'
+        * labels (dict): Labels {label: value}
+        * type (str): COUNTER or HISTOGRAM
+        * count (int): Counter value, or number of values of the histogram
+        * sum (float): Sum of the histogram values
+        * buckets (list of int): Number of values in each bucket of BUCKETS (not cumulative),
+                                 values greater than the last bound are only in the count
+    """
+
+    __slots__ = ('name', 'labels', 'type', 'count', 'sum', 'buckets')
+
+    def __init__(self, name, labels, type, count, sum=0.0, buckets=None):
+        self.name = name
+        self.labels = labels
+        self.type = type
+        self.count = count
+        self.sum = sum
+        self.buckets = buckets
+
+    def as_dict(self):
+        """Returns the series as a dict (JSON serializable), with cumulative buckets as in Prometheus."""
+        data = {'name': self.name, 'type': self.type, 'labels': self.labels, 'count': self.count}
+        if self.type == HISTOGRAM:
+            data['sum'] = self.sum
+            data['buckets'] = dict(zip(map(str, BUCKETS), _cumulate(self.buckets)))
+        return data
+
+    def __str__(self):
+        return "Series(name={}, labels={}, count={})".format(self.name, self.labels, self.count)
+    def __repr__(self):
+        return self.__str__()
+
+
+def _cumulate(buckets):
+    total = 0
+    cumulated = []
+    for value in buckets:
+        total += value
+        cumulated.append(total)
+    return cumulated
+
+
+def read(filename):
+    """
+    Returns the series of a metrics file (list of Series), in creation order.
+    A missing file has no series.
+
+    Raises:
+        OSError: If the file cannot be read.
+        ValueError: If the file is not a metrics file.
+    """
+    try:
+        fd = open(filename, 'rb')
+    except FileNotFoundError:
+        return []
+    with fd:
+        fcntl.flock(fd, fcntl.LOCK_SH)
+        data = fd.read()
+    if len(data) < _HEADER.size:
+        raise ValueError("Not a metrics file: {}".format(filename))
+    magic, used, capacity = _HEADER.unpack_from(data, 0)
+    if magic != _MAGIC or len(data) != _file_size(capacity):
+        raise ValueError("Not a metrics file: {}".format(filename))
+    types = {kind: metric_type for metric_type, kind in _KINDS.items()}
+    series = []
+    for index in range(used):
+        kind, key, count, total, *buckets = _SLOT.unpack_from(data, _HEADER_SIZE + index * _SLOT.size)
+        if kind not in types:
+            continue
+        name, labels = _parse_key(key.rstrip(b'\0'))
+        series.append(Series(name, labels, types[kind], count, total, buckets))
+    return series
+
+
+def _format_labels(labels, extra=None):
+    items = list(labels.items())
+    if extra is not None:
+        items.append(extra)
+    if not items:
+        return ''
+    escaped = ('{}="{}"'.format(label, value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for label, value in items)
+    return '{' + ','.join(escaped) + '}'
+
+
+def format_prometheus(series):
+    """Returns the series in the Prometheus text exposition format."""
+    lines = []
+    by_name = {}
+    for serie in series:
+        by_name.setdefault(serie.name, []).append(serie)
+    for name, name_series in by_name.items():
+        metric_type, description = METRICS.get(name, (name_series[0].type, None))
+        if description is not None:
+            lines.append("# HELP {} {}".format(name, description))
+        lines.append("# TYPE {} {}".format(name, metric_type))
+        for serie in name_series:
+            if serie.type == COUNTER:
+                lines.append("{}{} {}".format(name, _format_labels(serie.labels), serie.count))
+                continue
+            for bound, value in zip(BUCKETS, _cumulate(serie.buckets)):
+                lines.append("{}_bucket{} {}".format(name, _format_labels(serie.labels, ('le', repr(bound))), value))
+            lines.append("{}_bucket{} {}".format(name, _format_labels(serie.labels, ('le', '+Inf')), serie.count))
+            lines.append("{}_sum{} {!r}".format(name, _format_labels(serie.labels), serie.sum))
+            lines.append("{}_count{} {}".format(name, _format_labels(serie.labels), serie.count))
+    return ''.join(line + '\n' for line in lines)
+
+
+def format_json(series):
+    """Returns the series in JSON."""
+    import json
+    return json.dumps({'metrics': [serie.as_dict() for serie in series]}, indent=2) + '\n'
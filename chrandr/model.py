@@ -0,0 +1,327 @@
+# -*- coding: utf-8 -*-
+"""
+chrandr - Screen state model and xrandr output parser.
+
+The state of a X screen (outputs, modes, positions, rotations, EDID...) is represented by
+Screen, Output and Mode objects. It is built by :
+    * the xrandr parser, reading `xrandr --query [--verbose]` line by line (streaming, see query_state())
+    * the RandR backend (see chrandr.backends)
+"""
+
+import re
+import logging
+import subprocess
+
+
+ROTATIONS = ('normal', 'left', 'inverted', 'right')
+REFLECTIONS = ('X axis', 'Y axis', 'X and Y axis')
+
+
+class Mode:
+    """
+    A video mode of an output.
+
+    Fields:
+        * id (int): RandR mode id, None if unknown
+        * name (str): Mode name, ie '1920x1080'
+        * width (int), height (int): Mode size in pixels
+        * refresh (float): Refresh rate in Hz, None if unknown
+        * current (bool): True if the mode is used by the output
+        * preferred (bool): True if the mode is preferred by the output
+    """
+
+    __slots__ = ('id', 'name', 'width', 'height', 'refresh', 'current', 'preferred')
+
+    def __init__(self, name, width, height, refresh=None, id=None, current=False, preferred=False):
+        self.id = id
+        self.name = name
+        self.width = width
+        self.height = height
+        self.refresh = refresh
+        self.current = current
+        self.preferred = preferred
+
+    def __str__(self):
+        return "Mode(name={}, refresh={})".format(self.name, self.refresh)
+    def __repr__(self):
+        return self.__str__()
+
+
+class Output:
+    """
+    An output (VGA-1, HDMI-1...) of a screen.
+
+    Fields:
+        * name (str): Output name
+        * connected (bool): True if a monitor is connected
+        * primary (bool): True if it is the primary output
+        * x (int), y (int): Position in the screen, None if disabled
+        * width (int), height (int): Size in the screen (rotation applied), None if disabled
+        * rotation (str): One of ROTATIONS
+        * reflection (str): One of REFLECTIONS, None if no reflection
+        * crtc (int): CRTC index or id used by the output, None if disabled or unknown
+        * modes (list of Mode): Modes of the output
+        * edid (bytes): EDID of the connected monitor, None if unknown
+    """
+
+    __slots__ = ('name', 'connected', 'primary', 'x', 'y', 'width', 'height', 'rotation', 'reflection',
+        'crtc', 'modes', 'edid')
+
+    def __init__(self, name, connected=False, primary=False):
+        self.name = name
+        self.connected = connected
+        self.primary = primary
+        self.x = self.y = self.width = self.height = None
+        self.rotation = 'normal'
+        self.reflection = None
+        self.crtc = None
+        self.modes = []
+        self.edid = None
+
+    @property
+    def enabled(self):
+        """True if the output is used (has a CRTC)."""
+        return self.width is not None
+
+    @property
+    def current_mode(self):
+        """Returns the current Mode, None if disabled."""
+        return next((m for m in self.modes if m.current), None)
+
+    @property
+    def preferred_mode(self):
+        """Returns the preferred Mode, the first mode if no preferred one, None if no mode."""
+        return next((m for m in self.modes if m.preferred), self.modes[0] if self.modes else None)
+
+    def __str__(self):
+        return "Output(name={}, connected={})".format(self.name, self.connected)
+    def __repr__(self):
+        return self.__str__()
+
+
+class Screen:
+    """
+    A X screen.
+
+    Fields:
+        * number (int): Screen number
+        * width (int), height (int): Current screen size
+        * minimum (tuple), maximum (tuple): Minimum and maximum screen sizes (width, height)
+        * outputs (list of Output): Outputs, in RandR order
+    """
+
+    __slots__ = ('number', 'width', 'height', 'minimum', 'maximum', 'outputs')
+
+    def __init__(self, number, width=None, height=None, minimum=None, maximum=None):
+        self.number = number
+        self.width = width
+        self.height = height
+        self.minimum = minimum
+        self.maximum = maximum
+        self.outputs = []
+
+    def get_output(self, name):
+        """Returns the Output with the name, None if not found."""
+        return next((o for o in self.outputs if o.name == name), None)
+
+    def connected_outputs(self):
+        """Returns the names of the connected outputs."""
+        return [o.name for o in self.outputs if o.connected]
+
+    def __str__(self):
+        return "Screen(number={}, outputs={})".format(self.number, self.outputs)
+    def __repr__(self):
+        return self.__str__()
+
+
+# Screen 0: minimum 8 x 8, current 3840 x 1080, maximum 32767 x 32767
+_SCREEN_RE = re.compile(r"^Screen (\d+): minimum (\d+) x (\d+), current (\d+) x (\d+), maximum (\d+) x (\d+)")
+# eDP-1 connected primary 1920x1080+0+0 (0x48) left X axis (normal left inverted right x axis y axis) 309mm x 174mm
+_OUTPUT_RE = re.compile(r"^(\S+) (connected|disconnected|unknown connection)( primary)?"
+    r"(?: (\d+)x(\d+)\+(-?\d+)\+(-?\d+))?(?: \(0x[0-9a-fA-F]+\))?"
+    r"(?: (normal|left|inverted|right))?(?: (X axis|Y axis|X and Y axis))?")
+# verbose :   1920x1080 (0x48) 138.700MHz -HSync -VSync *current +preferred
+_VERBOSE_MODE_RE = re.compile(r"^  (\S+) \((0x[0-9a-fA-F]+)\) ")
+# not verbose :    1920x1080     60.02*+  59.93
+_MODE_RE = re.compile(r"^   (\S+)\s+(.*)$")
+_RATE_RE = re.compile(r"([\d.]+)([* ]?)([+ ]?)")
+_SIZE_RE = re.compile(r"^(\d+)x(\d+)")
+#         v: height 1080 start 1083 end 1088 total 1111           clock  60.02Hz
+_VCLOCK_RE = re.compile(r"clock\s+([\d.]+)Hz")
+
+
+def _mode_size(name):
+    """Returns (width, height) of a mode name, ie '1920x1080i' => (1920, 1080)."""
+    match = _SIZE_RE.match(name)
+    if match:
+        return int(match.group(1)), int(match.group(2))
+    return None, None
+
+
+class XrandrParser:
+    """
+    Incremental parser of `xrandr --query` and `xrandr --query --verbose` outputs.
+    Lines are given one by one with feed(), the whole output is never kept in memory.
+
+    Fields:
+        * screens (list of Screen): Parsed screens
+    """
+
+    def __init__(self):
+        self.screens = []
+        self._screen = None
+        self._output = None
+        self._mode = None
+        # EDID hexadecimal lines being read, None if not in an EDID property
+        self._edid = None
+        self._crtc_line = False
+
+    def feed(self, line):
+        """Parse a line (with or without the line ending)."""
+        line = line.rstrip('\n')
+        if not line:
+            return
+        first = line[0]
+        if first == '\t':
+            self._property_line(line)
+        elif first == ' ':
+            self._end_edid()
+            self._mode_line(line)
+        else:
+            self._end_edid()
+            self._mode = None
+            if line.startswith('Screen '):
+                self._screen_line(line)
+            else:
+                self._output_line(line)
+
+    def close(self):
+        """End of the output. Returns the parsed screens."""
+        self._end_edid()
+        return self.screens
+
+    def _screen_line(self, line):
+        match = _SCREEN_RE.match(line)
+        if match:
+            values = [int(v) for v in match.groups()]
+            self._screen = Screen(values[0], width=values[3], height=values[4],
+                minimum=(values[1], values[2]), maximum=(values[5], values[6]))
+            self.screens.append(self._screen)
+            self._output = None
+
+    def _output_line(self, line):
+        match = _OUTPUT_RE.match(line)
+        if not match:
+            self._output = None
+            return
+        if self._screen is None:
+            self._screen = Screen(0)
+            self.screens.append(self._screen)
+        name, connection, primary, width, height, x, y, rotation, reflection = match.groups()
+        output = Output(name, connected=(connection == 'connected'), primary=primary is not None)
+        if width is not None:
+            output.width, output.height = int(width), int(height)
+            output.x, output.y = int(x), int(y)
+        if rotation is not None:
+            output.rotation = rotation
+        output.reflection = reflection
+        self._screen.outputs.append(output)
+        self._output = output
+
+    def _property_line(self, line):
+        output = self._output
+        if output is None:
+            return
+        if self._edid is not None:
+            if line.startswith('\t\t'):
+                self._edid.append(line.strip())
+                return
+            self._end_edid()
+        stripped = line.strip()
+        if stripped == 'EDID:':
+            self._edid = []
+        elif stripped.startswith('CRTC:'):
+            value = stripped[5:].strip()
+            if value.isdigit():
+                output.crtc = int(value)
+
+    def _end_edid(self):
+        if self._edid is not None:
+            if self._output is not None and self._edid:
+                self._output.edid = bytes.fromhex(''.join(self._edid))
+            self._edid = None
+
+    def _mode_line(self, line):
+        output = self._output
+        if output is None:
+            return
+        match = _VERBOSE_MODE_RE.match(line)
+        if match:
+            name = match.group(1)
+            width, height = _mode_size(name)
+            self._mode = Mode(name, width, height, id=int(match.group(2), 16),
+                current='*current' in line, preferred='+preferred' in line)
+            output.modes.append(self._mode)
+            return
+        if self._mode is not None:
+            # verbose mode details : 'h: ...' and 'v: ...' lines
+            clock = _VCLOCK_RE.search(line)
+            if clock and line.lstrip().startswith('v:'):
+                self._mode.refresh = float(clock.group(1))
+            return
+        match = _MODE_RE.match(line)
+        if match:
+            name = match.group(1)
+            width, height = _mode_size(name)
+            # one mode per refresh rate
+            for rate, current, preferred in _RATE_RE.findall(match.group(2)):
+                output.modes.append(Mode(name, width, height, refresh=float(rate),
+                    current=(current == '*'), preferred=(preferred == '+')))
+
+
+def parse(lines):
+    """
+    Parse a xrandr output.
+
+    Args:
+        * lines (iterable of str): xrandr output lines, ie a file or a pipe
+    Returns:
+        The list of Screen.
+    """
+    parser = XrandrParser()
+    for line in lines:
+        parser.feed(line)
+    return parser.close()
+
+
+def query_state(verbose=True, current=False, args=None, env=None):
+    """
+    Execute xrandr and parse its output while it is written.
+
+    Args:
+        * verbose (bool): Use --verbose, to get EDID, CRTC and modes ids
+        * current (bool): Use --current, outputs are not probed
+        * args (list of str): Additional xrandr arguments, ie ['--display', ':1']
+        * env (dict): Environment of xrandr, None to inherit it
+    Returns:
+        The first Screen.
+    Raises:
+        subprocess.CalledProcessError: If xrandr fails.
+    """
+    logger = logging.getLogger('query_state')
+    command = ['xrandr', '--current' if current else '--query']
+    if verbose:
+        command.append('--verbose')
+    if args:
+        command.extend(args)
+    parser = XrandrParser()
+    with subprocess.Popen(command, stdout=subprocess.PIPE, universal_newlines=True, env=env) as process:
+        for line in process.stdout:
+            parser.feed(line)
+    if process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, command)
+    screens = parser.close()
+    if not screens:
+        raise subprocess.CalledProcessError(process.returncode, command, "No screen found")
+    logger.debug("Parsed screen: %s", screens[0])
+    return screens[0]
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""
+chrandr - Runtime files.
+
+Only the standard library is used : the daemon client (see chrandr.client) imports this module
+to find the daemon socket without importing the configuration.
+"""
+
+import os
+import logging
+
+
+def _get_runtime_filename(extension):
+    """
+    Get a runtime filename (ie 'chrandr.state').
+    Filename generated from xdg module, in $XDG_RUNTIME_DIR or in /tmp (in this order).
+    In /tmp, the user id is added to the filename (ie 'chrandr.1000.state').
+
+    Args:
+        * extension (str): Filename extension, ie 'state'
+    """
+    logger = logging.getLogger('_get_runtime_filename')
+    basename = 'chrandr.' + extension
+    runtime_dir = None
+    try:
+        from xdg import BaseDirectory
+        runtime_dir = BaseDirectory.get_runtime_dir()
+    except ImportError:
+        logger.info("xdg module not found")
+        runtime_dir = os.getenv('XDG_RUNTIME_DIR')
+    except KeyError:
+        pass
+    if runtime_dir is None:
+        logger.debug("No environment variable XDG_RUNTIME_DIR")
+        # no runtime dir, use /tmp
+        import tempfile
+        runtime_dir = tempfile.gettempdir()
+        basename = 'chrandr.' + str(os.getuid()) + '.' + extension
+    return os.path.join(runtime_dir, basename)
+
+
+def _get_socket_filename():
+    """Get the daemon socket filename, see _get_runtime_filename()."""
+    return _get_runtime_filename('sock')
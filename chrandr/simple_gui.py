@@ -6,39 +6,151 @@ Let the user to choose randr configuration in a radio button list.
 """
 
 import os
-import os.path
-import sys
+import math
+import time
 import logging
-import argparse
-import signal
-import subprocess
-import re
-import pkg_resources
+import threading
+import configparser
+import collections
+import functools
+from importlib import resources
 
 import gi
 gi.require_version('Gtk', '3.0')
+gi.require_version('GdkPixbuf', '2.0')
+from gi.repository import GdkPixbuf
 from gi.repository import GObject
+from gi.repository import GLib
+from gi.repository import Gio
 from gi.repository import Gtk
 
 import chrandr.utils
-import chrandr.config
-from chrandr.config import ChrandrConfig
+import chrandr.watcher
+import chrandr.executor
+import chrandr.metrics
+import chrandr.snapshot
+import chrandr.trace
+
+
+# UI definitions in the compiled resource bundle (see ui/chrandr.gresource.xml)
+_RESOURCE_PREFIX = '/org/chrandr/ui/'
+_GLADE_NAMES = ('simple_gui.glade', 'error_dialog.glade')
+
+
+@functools.lru_cache(maxsize=None)
+def _register_resource_bundle():
+    """
+    Register the compiled resource bundle (ui/chrandr.gresource), once per process.
+    The bundle is optional, it is ignored if it is older than the glade files.
+
+    Returns:
+        True if the bundle is registered.
+    """
+    logger = logging.getLogger('_register_resource_bundle')
+    ui_dir = resources.files('chrandr').joinpath('ui')
+    bundle = ui_dir.joinpath('chrandr.gresource')
+    try:
+        bundle_mtime = os.stat(bundle).st_mtime
+        if any(os.stat(ui_dir.joinpath(name)).st_mtime > bundle_mtime for name in _GLADE_NAMES):
+            logger.info("Resource bundle %s is outdated, glade files are used", bundle)
+            return False
+        Gio.resources_register(Gio.Resource.load(os.fspath(bundle)))
+    except (OSError, TypeError, GLib.Error) as e:
+        logger.debug("No resource bundle, glade files are used: %s", e)
+        return False
+    logger.debug("Resource bundle %s registered", bundle)
+    return True
+
+
+@functools.lru_cache(maxsize=None)
+def _get_template(glade_name):
+    """Returns the content of a glade file of the package ui directory, read once per process."""
+    return resources.files('chrandr').joinpath('ui').joinpath(glade_name).read_text(encoding='utf-8')
+
+
+def _load_builder(glade_name):
+    """Returns a Gtk.Builder loaded with a glade file, from the resource bundle if available."""
+    if _register_resource_bundle():
+        return Gtk.Builder.new_from_resource(_RESOURCE_PREFIX + glade_name)
+    builder = Gtk.Builder()
+    builder.add_from_string(_get_template(glade_name))
+    return builder
+
+
+def _idle_call(func, *args):
+    """Call func(*args) once in the GTK main loop, from any thread."""
+    def call():
+        func(*args)
+        return GLib.SOURCE_REMOVE
+    GLib.idle_add(call)
+
+
+class IconCache:
+    """
+    Size bounded LRU cache of the decoded buttons icons.
+    Icons larger than max_size are scaled down once, when decoded.
+
+    Fields:
+        * maxsize (int): Maximum number of icons kept
+        * max_size (int): Maximum width and height of the icons, in pixels
+    """
+
+    def __init__(self, maxsize=32, max_size=128):
+        self._logger = logging.getLogger(self.__class__.__name__)
+        self.maxsize = maxsize
+        self.max_size = max_size
+        self._pixbufs = collections.OrderedDict()
+
+    def get(self, filename):
+        """
+        Returns the GdkPixbuf.Pixbuf of an icon file, None if it cannot be loaded.
+        A modified file is decoded again.
+        """
+        try:
+            stat = os.stat(filename)
+        except OSError as e:
+            self._logger.warning("Cannot load icon %s: %s", filename, e)
+            return None
+        key = (filename, stat.st_mtime_ns, stat.st_size)
+        pixbuf = self._pixbufs.get(key)
+        if pixbuf is not None:
+            self._pixbufs.move_to_end(key)
+            return pixbuf
+        try:
+            file_format, width, height = GdkPixbuf.Pixbuf.get_file_info(filename)
+            if width > self.max_size or height > self.max_size:
+                pixbuf = GdkPixbuf.Pixbuf.new_from_file_at_scale(filename, self.max_size, self.max_size, True)
+            else:
+                pixbuf = GdkPixbuf.Pixbuf.new_from_file(filename)
+        except GLib.Error as e:
+            self._logger.warning("Cannot load icon %s: %s", filename, e)
+            return None
+        self._pixbufs[key] = pixbuf
+        if len(self._pixbufs) > self.maxsize:
+            self._pixbufs.popitem(last=False)
+        return pixbuf
+
+
+# icons shared by the windows
+_icon_cache = IconCache()
 
 
 class ChRandrErrorDialog:
     """
-    Error dialog with command output
+    Error dialog with command output.
+    The dialog is hidden when closed : it could be shown again with another command.
+    The output could be appended while the commands are running (see append_output()),
+    only the last max_output characters are kept.
     """
-    def __init__(self, parent_window):
+    def __init__(self, parent_window,
+            max_output=chrandr.utils.DEFAULT_OUTPUT_HEAD + chrandr.utils.DEFAULT_OUTPUT_TAIL):
         # self._logger = logging.getLogger(self.__class__.__name__)
-        builder = Gtk.Builder()
-        # load glade file using pkg_resources
-        glade_path = os.path.join('ui', 'error_dialog.glade')
-        glade_content = pkg_resources.resource_string(__name__, glade_path)
-        builder.add_from_string(str(glade_content, encoding='utf-8'))
+        builder = _load_builder('error_dialog.glade')
         self.dialog = builder.get_object('dialog_error')
         self._entry_command = builder.get_object('entry_command')
         self._textbuffer_output = builder.get_object('textbuffer_output')
+        self.max_output = max_output
+        self._truncated = 0
         # connect callbacks signals
         builder.connect_signals(self)
         self.dialog.set_transient_for(parent_window)
@@ -46,15 +158,41 @@ class ChRandrErrorDialog:
     def on_click_close(self, *args, **kwargs):
         self.dialog.response(Gtk.ResponseType.CLOSE)
 
+    def clear(self):
+        """Remove the output."""
+        self._textbuffer_output.set_text("", -1)
+        self._truncated = 0
+
+    def append_output(self, text):
+        """Append text to the output, the beginning of the output is dropped if it is too long."""
+        textbuffer = self._textbuffer_output
+        textbuffer.insert(textbuffer.get_end_iter(), text, -1)
+        excess = textbuffer.get_char_count() - self.max_output
+        if excess > 0:
+            textbuffer.delete(textbuffer.get_start_iter(), textbuffer.get_iter_at_offset(excess))
+            self._truncated += excess
+
     def show(self, command, output=None):
+        """
+        Show the dialog until it is closed.
+
+        Args:
+            * command (str) : Failed command
+            * output (str) : Command output, None to keep the appended output
+        """
         self._entry_command.set_text(str(command))
-        if output:
+        if output is not None:
+            self.clear()
             self._textbuffer_output.set_text(str(output), -1)
-        else:
-            self._textbuffer_output.set_text("", -1)
+        elif self._truncated:
+            self._textbuffer_output.insert(self._textbuffer_output.get_start_iter(),
+                "[... {} characters truncated ...]\n".format(self._truncated), -1)
+            self._truncated = 0
         self.dialog.run()
-        self.dialog.destroy()
+        self.dialog.hide()
 
+    def destroy(self):
+        self.dialog.destroy()
 
 
 class ChRandrSimpleUI:
@@ -75,21 +213,61 @@ class ChRandrSimpleUI:
         """
         self._logger = logging.getLogger(self.__class__.__name__)
         self.config = config
-        self._widgets = []
-        builder = Gtk.Builder()
-        # load glade file using pkg_resources
-        glade_path = os.path.join('ui', 'simple_gui.glade')
-        glade_content = pkg_resources.resource_string(__name__, glade_path)
-        builder.add_from_string(str(glade_content, encoding='utf-8'))
-        self._logger.debug("Loading GTK UI from pkg resource")
+        # buttons by configuration code, in display order
+        self._buttons = {}
+        self._outputs = []
+        # incremented by each outputs query, outdated background probes are ignored
+        self._query_generation = 0
+        self._selector = None
+        if config.auto_apply:
+            import chrandr.autoselect
+            self._selector = chrandr.autoselect.AutoSelector(config)
+        builder = _load_builder('simple_gui.glade')
+        self._logger.debug("Loading GTK UI from package resource")
         self.window = builder.get_object('chrandr')
         self._box_content = builder.get_object('box_content')
+        self._button_refresh = builder.get_object('button_refresh')
+        self._button_cancel = builder.get_object('button_cancel')
+        self._label_status = builder.get_object('label_status')
+        self._executor = chrandr.executor.AsyncExecutor(dispatch=_idle_call)
+        self._watcher = None
+        self._config_watcher = None
+        # error dialog, created on first error and reused
+        self._error_dialog = None
         # connect callbacks signals
         builder.connect_signals(self)
 
+    def watch_outputs(self, delay=0.3):
+        """
+        Refresh the UI when outputs change, instead of the refresh button.
+        The refresh button is kept if no event source is available.
+
+        Args:
+            * delay (float) : Debounce delay in seconds, events in this delay lead to one refresh
+        """
+        self._watcher = chrandr.watcher.OutputWatcher(self.on_outputs_changed, delay=delay)
+        if self._watcher.available():
+            self._watcher.attach_glib()
+            self._button_refresh.hide()
+        else:
+            self._logger.info("Outputs changes cannot be watched, use the refresh button")
+            self._watcher = None
+
+    def watch_config(self, delay=0.3):
+        """
+        Reload the configuration file when it changes, and update the buttons (see on_config_changed()).
+
+        Args:
+            * delay (float) : Debounce delay in seconds
+        """
+        self._config_watcher = chrandr.watcher.FileWatcher(self.config.filename, self.on_config_changed,
+            delay=delay)
+        self._config_watcher.attach_glib()
+
     def _apply_randr(self, widget, randr):
         """
         Execute commands associated with the selected choice.
+        Commands are executed on a worker thread, the UI is updated when they end.
 
         Args:
             * widget (Gtk.ToggleButton) : Button widget
@@ -97,35 +275,182 @@ class ChRandrSimpleUI:
         """
         self._logger.debug("Apply the output code '%s' : %s", randr.code, randr.title)
         # search previous selected button and unselect it
-        for wid in self._widgets:
+        for wid in self._buttons.values():
             if wid.get_active() and wid != widget:
                 wid.set_active(False)
 
-        try:
-            if not randr.commands:
-                self._logger.debug("Code '%s' : No command to execute.", randr.code);
-            else:
-                chrandr.utils.execute_commands(randr.commands)
-        except chrandr.utils.ProcessException as e:
-            self.config.save_active_randr(None)
-            widget.set_active(False)
-            # display the error
-            popup = ChRandrErrorDialog(self.window)
-            popup.show(e.cmd, e.output)
+        generation = self.config.begin_apply()
+        groups = randr.command_groups()
+        if not any(groups.values()):
+            self._logger.debug("Code '%s' : No command to execute.", randr.code);
+            self.config.save_active_randr(randr, generation)
+            if self._selector is not None:
+                self._selector.remember(randr)
+            return
+        # from the click to the end of the commands
+        span = chrandr.trace.span('ui.apply', code=randr.code)
+        start = time.monotonic()
+        # layout captured before the commands, restored if they fail (see chrandr.snapshot)
+        previous = None
+        restored = False
+
+        def prepare(groups):
+            nonlocal previous
+            previous, screen = chrandr.snapshot.capture(self.config)
+            # unchanged outputs are removed from the commands in the worker thread
+            groups = self.config.plan_groups(randr, screen=screen)
+            if any(groups.values()):
+                chrandr.snapshot.record(self.config, previous)
+            return groups
+
+        def finish(execution):
+            nonlocal restored
+            # a superseded apply is not restored : the next one changes the outputs
+            if execution.error is None or previous is None or execution is not self._executor.current:
+                return
+            try:
+                chrandr.snapshot.restore(previous, timeout=self.config.timeout, log=self.config.get_command_log())
+                restored = True
+            except chrandr.utils.ProcessException as e:
+                self._logger.error("Previous layout not restored: %s", e)
+
+        def on_progress(execution, index, command):
+            if execution is self._executor.current:
+                self._set_status("[{}/{}] {}".format(index + 1, len(execution.commands), command))
+
+        def on_output(execution, text):
+            if execution is self._executor.current:
+                self._get_error_dialog().append_output(text)
+
+        def on_done(execution):
+            if execution is self._executor.current:
+                self._set_status(None)
+            error = execution.error
+            span.end(error=None if error is None else error.__class__.__name__)
+            chrandr.metrics.record_apply(randr.code, time.monotonic() - start, error)
+            if error is None:
+                # update the active configuration in the status file
+                if self.config.save_active_randr(randr, generation):
+                    if self._selector is not None:
+                        self._selector.remember(randr)
+                    if previous is not None and self.config.confirm_timeout:
+                        self._confirm_apply(previous, generation)
+            elif self.config.save_active_randr(None, generation):
+                # not superseded by another apply
+                widget.set_active(False)
+                if restored:
+                    self._restored_layout(previous, generation)
+                if isinstance(error, chrandr.utils.CommandCancelled):
+                    pass
+                elif isinstance(error, chrandr.utils.CommandsFailed) or error.cmd is None:
+                    # outputs of concurrent groups are mixed in the streamed output,
+                    # an unexpected error is only in the error output
+                    self._get_error_dialog().show(error.cmd, error.output)
+                elif self._error_dialog is None:
+                    # no output streamed
+                    self._get_error_dialog().show(error.cmd, error.output)
+                else:
+                    # display the error with the streamed output
+                    self._error_dialog.show(error.cmd)
+
+        # the output is streamed into the error dialog (created on the first output), displayed if a command fails
+        if self._error_dialog is not None:
+            self._error_dialog.clear()
+        self._executor.start(groups, on_progress=on_progress, on_done=on_done,
+            timeout=self.config.timeout, total_timeout=self.config.total_timeout,
+            prepare=prepare, finish=finish, after=randr.after,
+            on_output=on_output, log=self.config.get_command_log())
+
+    def _confirm_apply(self, previous, generation):
+        """
+        Ask to keep the applied configuration, the previous layout is restored
+        if it is not confirmed before the confirm_timeout.
+
+        Args:
+            * previous (Layout) : Layout captured before the apply
+            * generation (int) : Apply generation of the configuration
+        """
+        remaining = math.ceil(self.config.confirm_timeout)
+        dialog = Gtk.MessageDialog(transient_for=self.window, modal=True,
+            message_type=Gtk.MessageType.QUESTION, buttons=Gtk.ButtonsType.NONE,
+            text="Keep this display configuration ?")
+        dialog.add_buttons("Revert", Gtk.ResponseType.REJECT, "Keep", Gtk.ResponseType.ACCEPT)
+        dialog.set_default_response(Gtk.ResponseType.REJECT)
+
+        def countdown():
+            nonlocal remaining
+            if remaining <= 0:
+                dialog.response(Gtk.ResponseType.REJECT)
+                return False
+            dialog.format_secondary_text("The previous layout is restored in {} seconds.".format(remaining))
+            remaining -= 1
+            return True
+
+        countdown()
+        source = GLib.timeout_add_seconds(1, countdown)
+        response = dialog.run()
+        if remaining > 0:
+            GLib.source_remove(source)
+        dialog.destroy()
+        if response == Gtk.ResponseType.ACCEPT:
+            return
+        if not self.config.save_active_randr(None, generation):
+            # another configuration applied meanwhile
+            return
+        self._logger.debug("Configuration not confirmed, restore the previous layout")
+        generation = self.config.begin_apply()
+
+        def on_done(execution):
+            if execution.error is None:
+                self._restored_layout(previous, generation)
+            elif not isinstance(execution.error, chrandr.utils.CommandCancelled):
+                self._get_error_dialog().show(execution.error.cmd, execution.error.output)
+
+        self._executor.start([previous.command()], on_done=on_done, timeout=self.config.timeout,
+            log=self.config.get_command_log())
+
+    def _restored_layout(self, layout, generation):
+        """Select the configuration active when the restored layout was captured, without applying it."""
+        randr = self.config.get_randr(layout.code) if layout.code is not None else None
+        if not self.config.save_active_randr(randr, generation):
+            return
+        for code, widget in self._buttons.items():
+            widget.handler_block_by_func(self.on_select_choice)
+            widget.set_active(code == self.config.active)
+            widget.handler_unblock_by_func(self.on_select_choice)
+
+    def _get_error_dialog(self):
+        """Returns the error dialog, created on first call."""
+        if self._error_dialog is None:
+            self._error_dialog = ChRandrErrorDialog(self.window)
+        return self._error_dialog
+
+    def _set_status(self, message):
+        """Display a message about the running commands, None to hide it."""
+        if message is None:
+            self._label_status.hide()
+            self._button_cancel.hide()
         else:
-            # update the active configuration in the status file
-            self.config.save_active_randr(randr)
+            self._label_status.set_text(message)
+            self._label_status.show()
+            self._button_cancel.show()
 
-    def on_select_choice(self, widget, cfg_data):
+    def on_click_cancel(self, *args, **kwargs):
+        """Gtk callback when cancel button is pressed, method name defined in glade file."""
+        self._logger.debug("Cancel the running commands")
+        self._executor.cancel()
+
+    def on_select_choice(self, widget, code):
         """
         Gtk callback when a button is clicked.
 
         Args:
             widget (Gtk.ToggleButton): the clicked button
-            cfg_data (XrandrConfig): the randr configuration associated with the button
+            code (str): code of the randr configuration associated with the button
         """
-        if widget.get_active():
-            # self._logger.debug("Output code '%s' is selected", cfg_data.code)
+        cfg_data = self.config.get_randr(code)
+        if widget.get_active() and cfg_data is not None:
+            # self._logger.debug("Output code '%s' is selected", code)
             self._apply_randr(widget, cfg_data)
 
     def on_click_refresh(self, *args, **kwargs):
@@ -133,104 +458,184 @@ class ChRandrSimpleUI:
         Refresh UI with availables configurations or not.
         Gtk callback when refresh button is pressed, method name defined in glade file.
         """
+        with chrandr.trace.span('ui.refresh'):
+            self._refresh_buttons(self.config.query)
+            # automatic selection : only remember the outputs, configuration is applied on outputs changes
+            if self._selector is not None:
+                # EDID of the outputs just queried, not probed again (see the tiered policy)
+                self._selector.update(self._outputs,
+                    chrandr.utils.get_output_edids(probe=(self.config.query == chrandr.utils.QUERY_PROBE)))
+
+    def _refresh_buttons(self, policy=chrandr.utils.QUERY_PROBE):
+        """
+        Query the connected outputs and display the availables configurations.
+
+        Args:
+            * policy (str): Outputs query policy (see chrandr.utils.query_outputs()),
+                            with the tiered policy the buttons are updated again if the probed outputs differ
+        """
         self._logger.debug("Refresh availables configurations...")
-        outputs = chrandr.utils.get_connected_outputs()
-        # Destroy previous widgets
-        for wid in self._widgets:
-            wid.destroy()
-        self.widgets = []
+        self._query_generation += 1
+        generation = self._query_generation
 
-        availables = filter(lambda r: r.available(outputs), self.config.randr)
+        def on_probed(probed):
+            # EDID read in the probe thread, from the outputs it just probed
+            edids = chrandr.utils.get_output_edids(probe=False) if self._selector is not None else None
+            _idle_call(self._on_outputs_probed, probed, edids, generation)
+
+        outputs = self._outputs = chrandr.utils.query_outputs(policy, on_probed=on_probed)
+        self._reconcile_buttons(self.config.available_randr(outputs))
+
+    def _on_outputs_probed(self, outputs, edids, generation, apply_selected=False):
+        """
+        Background probe callback (tiered query, outputs changes) : display the configurations of the probed outputs.
+
+        Args:
+            * outputs (list of str): Probed outputs
+            * edids (dict): EDID of the probed outputs, None without automatic selection
+            * generation (int): Query generation of the probe
+            * apply_selected (bool): Apply the configuration selected for the outputs (automatic selection)
+        """
+        if generation != self._query_generation:
+            # another query was done since the probe
+            return
+        self._logger.debug("Outputs probed, refresh availables configurations")
+        self._outputs = outputs
+        self._reconcile_buttons(self.config.available_randr(outputs))
+        if self._selector is None or edids is None:
+            return
+        randr = self._selector.update(outputs, edids)
+        if apply_selected and randr is not None and randr.code in self._buttons:
+            self._logger.info("Outputs changed, applying configuration '%s'", randr.code)
+            # toggled signal applies the configuration
+            self._buttons[randr.code].set_active(True)
+
+    def _reconcile_buttons(self, availables, changed=()):
+        """
+        Display the buttons of the available configurations, buttons are kept by configuration code :
+        buttons of configurations no more available are destroyed, missing ones are created,
+        others are kept as is (with their state), only updated if their configuration changed.
+
+        Args:
+            * availables (list of RandrConfig) : Configurations to display, in display order
+            * changed (list of RandrConfig) : Configurations modified since their buttons creation
+        """
+        codes = set(cfg.code for cfg in availables)
+        for code in [code for code in self._buttons if code not in codes]:
+            self._remove_button(code)
+        changed_codes = set(cfg.code for cfg in changed)
         for cfg in availables:
-            if cfg.title:
-                widget = Gtk.ToggleButton.new_with_label(cfg.title)
-            else:
-                widget = Gtk.ToggleButton.new()
-            if cfg.icon and cfg.icon != "":
-                widget.set_image(Gtk.Image.new_from_file(cfg.icon))
-                widget.set_image_position(Gtk.PositionType.TOP)
-            # select the active configuration
-            if self.config.active is not None and cfg.code == self.config.active:
-                widget.set_active(True)
-            widget.connect('toggled', self.on_select_choice, cfg)
-            self._widgets.append(widget)
-            self._box_content.pack_start(widget, True, True, 0)
-        self._box_content.show_all()
+            widget = self._buttons.get(cfg.code)
+            if widget is None:
+                widget = self._create_button(cfg)
+                self._box_content.pack_start(widget, True, True, 0)
+                widget.show_all()
+            elif cfg.code in changed_codes:
+                self._update_button(widget, cfg)
+        buttons = [self._buttons[cfg.code] for cfg in availables]
+        if self._box_content.get_children() != buttons:
+            for position, widget in enumerate(buttons):
+                self._box_content.reorder_child(widget, position)
+        self._buttons = dict((cfg.code, widget) for cfg, widget in zip(availables, buttons))
+        # commands of the displayed configurations prepared once the window is drawn
+        _idle_call(self.config.prepare_plans, self._outputs)
+
+    def _create_button(self, cfg):
+        """Returns a new button of a configuration, registered in the buttons."""
+        widget = Gtk.ToggleButton.new()
+        self._update_button(widget, cfg)
+        # select the active configuration
+        if self.config.active is not None and cfg.code == self.config.active:
+            widget.set_active(True)
+        widget.connect('toggled', self.on_select_choice, cfg.code)
+        self._buttons[cfg.code] = widget
+        return widget
+
+    def _update_button(self, widget, cfg):
+        """Set the label and the icon of a configuration button."""
+        if cfg.title or widget.get_label():
+            widget.set_label(cfg.title or '')
+        pixbuf = _icon_cache.get(cfg.icon) if cfg.icon else None
+        if pixbuf is not None:
+            widget.set_image(Gtk.Image.new_from_pixbuf(pixbuf))
+            widget.set_image_position(Gtk.PositionType.TOP)
+        else:
+            widget.set_image(None)
+
+    def _remove_button(self, code):
+        """Destroy the button of a configuration."""
+        self._buttons.pop(code).destroy()
+
+    def on_config_changed(self):
+        """
+        Configuration file changes callback : reload the changed configurations,
+        and update the buttons in place (unchanged buttons are kept).
+        """
+        try:
+            changes = self.config.reload()
+        except (OSError, configparser.Error) as e:
+            self._logger.warning("Configuration not reloaded: %s", e)
+            return
+        if not changes:
+            return
+        self._logger.info("Configuration reloaded: %s", changes)
+        self._reconcile_buttons(self.config.available_randr(self._outputs), changes.changed)
+
+    def on_outputs_changed(self):
+        """
+        Outputs changes callback : refresh the UI,
+        and apply the configuration selected for the new outputs if automatic selection is enabled.
+        The outputs are probed in a background thread, the UI is updated once probed (see _on_outputs_probed()).
+        """
+        self._query_generation += 1
+        generation = self._query_generation
+
+        def probe():
+            try:
+                outputs = chrandr.utils.query_outputs(chrandr.utils.QUERY_PROBE)
+                # EDID of the outputs just probed, not probed again
+                edids = chrandr.utils.get_output_edids(probe=False) if self._selector is not None else None
+            except Exception:
+                self._logger.warning("Outputs query failed", exc_info=True)
+                return
+            _idle_call(self._on_outputs_probed, outputs, edids, generation, True)
+
+        threading.Thread(target=probe, name='chrandr-outputs', daemon=True).start()
 
     def on_click_close(self, *args, **kwargs):
         """Gtk callback when close button is pressed, method name defined in glade file."""
+        for watcher in (self._watcher, self._config_watcher):
+            if watcher is not None:
+                watcher.close()
+        self._watcher = self._config_watcher = None
+        self._executor.cancel()
+        if self._error_dialog is not None:
+            self._error_dialog.destroy()
+            self._error_dialog = None
         Gtk.main_quit()
 
 
-def _configure_logging(args):
-    """Configure application logging."""
-    log_root = logging.getLogger()
-    if args.verbose:
-        log_root.setLevel(logging.DEBUG)
-        log_handler = logging.StreamHandler(sys.stdout)
-        log_formatter = logging.Formatter(
-            "%(asctime)s:%(levelname)s:%(name)s: %(message)s",
-            '%H:%M:%S')
-    else:
-        log_root.setLevel(logging.WARN)
-        log_handler = logging.StreamHandler(sys.stderr)
-        log_formatter = logging.Formatter(
-            os.path.basename(sys.argv[0]) + ": %(asctime)s:%(levelname)s:%(name)s: %(message)s",
-            '%H:%M:%S')
-    # add to format for debugging :
-    #   function name : %(funcName)s
-    log_handler.setFormatter(log_formatter)
-    log_root.addHandler(log_handler)
-
-
-def main():
-    """Entry point of chrandr."""
-    try:
-        current_version = pkg_resources.get_distribution('chrandr').version
-    except pkg_resources.DistributionNotFound:
-        current_version = 'dev'
-    # command line arguments
-    parser = argparse.ArgumentParser(
-        description="Change screen configuration."
-    )
-    parser.add_argument('--version', action='version', version="%(prog)s " + current_version)
-    parser.add_argument('--verbose', help="verbose output messages", action='store_true')
-    parser.add_argument('--config', help="set the configuration file")
-
-    args = parser.parse_args()
-    # configure logging
-    _configure_logging(args)
-    logger = logging.getLogger(__name__)
-
-    # restore default signal handler on SIGINT
-    # see also : https://bugzilla.gnome.org/show_bug.cgi?id=622084
-    signal.signal(signal.SIGINT, signal.SIG_DFL)
-
-    if args.config is None:
-        config_filename = chrandr.config.DEFAULT_CONFIGURATION_FILENAME
-        if not os.path.exists(config_filename):
-            logger.info("Create default configuration file: %s", config_filename)
-            try:
-                chrandr.config.create_default_configuration(config_filename)
-            except Exception as e:
-                logger.error("Failed to create default configuration", exc_info=True)
-                sys.stderr.write(sys.argv[0] + ": Failed to create the configuration file : " + str(e) + "\n")
-                sys.exit(1)
-    else:
-        config_filename = os.path.expanduser(args.config)
-
-    config = ChrandrConfig(config_filename)
-    try:
-        config.load()
-    except FileNotFoundError as e:
-        sys.stderr.write(sys.argv[0] + ": Failed to open the configuration file : " + str(e) + "\n")
-        sys.exit(1)
+def run(config, watch=True):
+    """
+    Open the window and run the GTK main loop.
 
+    Args:
+        * config (ChrandrConfig) : Loaded configuration
+        * watch (bool) : Refresh the window when outputs or the configuration file change
+    """
     # initialize GTK, create and open the window
     Gtk.init()
     ui = ChRandrSimpleUI(config)
     # first refresh of availables configurations
     GObject.idle_add(lambda ui:ui.on_click_refresh(), ui)
     ui.window.show_all()
+    if watch:
+        ui.watch_outputs()
+        ui.watch_config()
     Gtk.main()
 
+
+def main():
+    """Entry point of chrandr, see chrandr.cli."""
+    import chrandr.cli
+    return chrandr.cli.main()
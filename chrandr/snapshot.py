@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+"""
+chrandr - Layout snapshots and rollback.
+
+Before a configuration is applied, the layout of the outputs (mode, rate, position, rotation, reflection,
+primary output and screen size) is captured from the screen state (see chrandr.model).
+If the commands fail, or if the new configuration is not confirmed in time, the layout is restored
+with one xrandr invocation : all the outputs are changed by one RandR configuration.
+The last layouts are kept in a bounded history (see LayoutHistory), stored in the runtime directory,
+to restore one of them later (`chrandr rollback`).
+"""
+
+import os
+import json
+import shlex
+import time
+import logging
+import threading
+
+import chrandr.backends
+import chrandr.utils
+
+
+# xrandr --reflect argument of the screen state reflections
+_REFLECT_ARGS = {None: 'normal', 'X axis': 'x', 'Y axis': 'y', 'X and Y axis': 'xy'}
+
+
+class Layout:
+    """
+    Layout of the outputs.
+
+    Fields:
+        * size (tuple): Screen size (width, height), None if unknown
+        * outputs (list of tuple): (name, mode, rate, x, y, rotation, reflection, primary) of the enabled outputs,
+                                   (name, None, ...) of the disabled connected outputs
+        * time (float): Capture time (seconds since the epoch)
+        * code (str): Active configuration code when captured, None if unknown
+    """
+
+    __slots__ = ('size', 'outputs', 'time', 'code')
+
+    def __init__(self, size, outputs, capture_time=None, code=None):
+        self.size = size
+        self.outputs = outputs
+        self.time = time.time() if capture_time is None else capture_time
+        self.code = code
+
+    @classmethod
+    def from_screen(cls, screen, code=None):
+        """Returns the Layout of a screen state (chrandr.model.Screen)."""
+        outputs = []
+        for output in screen.outputs:
+            mode = output.current_mode
+            if output.enabled and mode is not None:
+                outputs.append((output.name, mode.name, mode.refresh, output.x, output.y, output.rotation,
+                    output.reflection, output.primary))
+            elif output.connected or output.enabled:
+                outputs.append((output.name, None, None, None, None, None, None, False))
+        size = (screen.width, screen.height) if screen.width and screen.height else None
+        return cls(size, outputs, code=code)
+
+    def args(self, program='xrandr'):
+        """Returns the xrandr arguments restoring this layout."""
+        args = [program]
+        if self.size is not None:
+            args.extend(('--fb', "{}x{}".format(*self.size)))
+        for name, mode, rate, x, y, rotation, reflection, primary in self.outputs:
+            args.extend(('--output', name))
+            if mode is None:
+                args.append('--off')
+                continue
+            args.extend(('--mode', mode))
+            if rate is not None:
+                args.extend(('--rate', "{:.2f}".format(rate)))
+            args.extend(('--pos', "{}x{}".format(x, y), '--rotate', rotation,
+                '--reflect', _REFLECT_ARGS.get(reflection, 'normal')))
+            if primary:
+                args.append('--primary')
+        return args
+
+    def command(self):
+        """Returns the xrandr command line restoring this layout."""
+        return shlex.join(self.args())
+
+    def describe(self):
+        """Returns a short description of the layout, ie 'eDP-1 1920x1080+0+0, DP-1 off'."""
+        parts = []
+        for name, mode, rate, x, y, rotation, reflection, primary in self.outputs:
+            if mode is None:
+                parts.append("{} off".format(name))
+            elif rotation == 'normal':
+                parts.append("{} {}+{}+{}".format(name, mode, x, y))
+            else:
+                parts.append("{} {}+{}+{} {}".format(name, mode, x, y, rotation))
+        return ', '.join(parts)
+
+    def as_dict(self):
+        """Returns the layout as a dict (JSON serializable)."""
+        return {'size': self.size, 'outputs': self.outputs, 'time': self.time, 'code': self.code}
+
+    @classmethod
+    def from_dict(cls, data):
+        """Returns the Layout of a dict returned by as_dict()."""
+        size = tuple(data['size']) if data.get('size') else None
+        return cls(size, [tuple(output) for output in data['outputs']], data.get('time'), data.get('code'))
+
+    def __str__(self):
+        return "Layout(code={}, outputs={})".format(self.code, self.describe())
+    def __repr__(self):
+        return self.__str__()
+
+
+class LayoutHistory:
+    """
+    Last captured layouts, most recent first, stored in a JSON file.
+    The file is read on first use, and written on each change.
+    """
+
+    def __init__(self, filename, size=8):
+        """
+        Args:
+            * filename (str): History file
+            * size (int): Maximum number of layouts kept
+        """
+        self._logger = logging.getLogger(self.__class__.__name__)
+        self.filename = filename
+        self.size = size
+        self._layouts = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._layouts is None:
+            try:
+                with open(self.filename) as fd:
+                    self._layouts = [Layout.from_dict(data) for data in json.load(fd)][:self.size]
+            except (OSError, ValueError, KeyError, TypeError):
+                self._logger.debug("No layouts history in %s", self.filename)
+                self._layouts = []
+        return self._layouts
+
+    def _save(self):
+        tmp_filename = self.filename + '.tmp'
+        try:
+            with open(tmp_filename, 'w') as fd:
+                json.dump([layout.as_dict() for layout in self._layouts], fd)
+            os.replace(tmp_filename, self.filename)
+        except OSError as e:
+            self._logger.warning("Cannot write the layouts history: %s", e)
+
+    def push(self, layout):
+        """Add a layout at the beginning of the history, the oldest one is dropped if the history is full."""
+        if self.size <= 0:
+            return
+        with self._lock:
+            layouts = self._load()
+            layouts.insert(0, layout)
+            del layouts[self.size:]
+            self._save()
+
+    def get(self, index=0):
+        """Returns the layout at index (0 is the most recent), None if not found."""
+        with self._lock:
+            layouts = self._load()
+            return layouts[index] if 0 <= index < len(layouts) else None
+
+    def list(self):
+        """Returns the layouts, most recent first."""
+        with self._lock:
+            return list(self._load())
+
+
+def capture(config, backend=None):
+    """
+    Capture the layout before an apply, if rollback is enabled in the configuration.
+    The layout is added to the history only if commands are executed (see record()).
+
+    Args:
+        * config (ChrandrConfig): Configuration, the active code is recorded with the layout
+        * backend (OutputBackend): Backend to use, None to use the default one (see chrandr.backends)
+    Returns:
+        (Layout, Screen) : the layout and the screen state it is captured from (ie to plan the commands),
+        (None, None) if rollback is disabled or if the state cannot be queried.
+    """
+    logger = logging.getLogger('capture')
+    if not config.rollback:
+        return None, None
+    try:
+        if backend is None:
+            backend = chrandr.backends.get_backend()
+        # outputs queried before the apply : the last known state, without probing them again
+        screen = backend.get_state(probe=False)
+    except Exception:
+        logger.warning("Cannot get the screen state, no rollback", exc_info=True)
+        return None, None
+    layout = Layout.from_screen(screen, code=config.active)
+    logger.debug("Layout captured: %s", layout)
+    return layout, screen
+
+
+def record(config, layout):
+    """
+    Add a captured layout to the history, before the commands of the apply are executed.
+
+    Args:
+        * config (ChrandrConfig): Configuration
+        * layout (Layout): Captured layout, None if not captured
+    """
+    history = config.get_layout_history()
+    if history is not None and layout is not None:
+        history.push(layout)
+
+
+def restore(layout, timeout=None, log=None, env=None):
+    """
+    Restore a layout, with one xrandr invocation.
+
+    Args:
+        * layout (Layout): Layout to restore
+        * timeout (float): Maximum duration in seconds, None for no limit
+        * log (CommandLog): Log of the command output, None for no log
+        * env (dict): Environment of xrandr (ie another DISPLAY), None to inherit it
+    Raises:
+        ProcessException: If xrandr fails.
+    """
+    logger = logging.getLogger('restore')
+    logger.info("Restoring the layout: %s", layout.describe())
+    chrandr.utils.run_command(layout.command(), timeout=timeout, log=log, env=env)
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""
+chrandr - Phases tracing.
+
+When tracing is enabled (`--trace FILE`), the main phases (configuration load, outputs query, refresh,
+apply, each command...) are recorded as spans : name, start, duration, thread and arguments.
+Spans are written as Chrome trace events (JSON, displayed by chrome://tracing or https://ui.perfetto.dev).
+Tracing is disabled by default, span() then returns a shared span doing nothing.
+
+The durations of the phases recorded by several runs are summarized with percentiles (see summarize()).
+"""
+
+import os
+import time
+import threading
+
+
+class Span:
+    """
+    A phase being recorded, ended by end() or at the end of a `with` block.
+
+    Fields:
+        * name (str): Phase name, ie 'config.load'
+        * args (dict): Arguments displayed with the span, JSON serializable values
+    """
+
+    __slots__ = ('name', 'args', '_tracer', '_start', '_thread')
+
+    def __init__(self, tracer, name, args):
+        self.name = name
+        self.args = args
+        self._tracer = tracer
+        self._thread = threading.current_thread()
+        self._start = time.perf_counter_ns()
+
+    def set_args(self, **args):
+        """Add arguments to the span."""
+        self.args.update(args)
+
+    def end(self, **args):
+        """End the span, with additional arguments."""
+        self.args.update(args)
+        self._tracer._add(self, time.perf_counter_ns())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.args['error'] = exc_type.__name__
+        self.end()
+
+
+class _NullSpan:
+    """Span of a disabled tracing."""
+
+    __slots__ = ()
+
+    def set_args(self, **args):
+        pass
+
+    def end(self, **args):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Tracer:
+    """Records the ended spans of all threads."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._events = []
+        self._threads = {}
+        self._pid = os.getpid()
+        self._origin = time.perf_counter_ns()
+
+    def span(self, name, **args):
+        """Start a span (see Span)."""
+        return Span(self, name, args)
+
+    def _add(self, span, end):
+        thread = span._thread
+        event = {'name': span.name, 'cat': 'chrandr', 'ph': 'X', 'pid': self._pid, 'tid': thread.ident,
+            'ts': (span._start - self._origin) / 1000, 'dur': (end - span._start) / 1000}
+        if span.args:
+            event['args'] = span.args
+        with self._lock:
+            self._events.append(event)
+            self._threads[thread.ident] = thread.name
+
+    def events(self):
+        """Returns the trace events (list of dict) : thread names and spans."""
+        with self._lock:
+            names = [{'name': 'thread_name', 'ph': 'M', 'pid': self._pid, 'tid': tid, 'args': {'name': name}}
+                for tid, name in self._threads.items()]
+            return names + list(self._events)
+
+    def write(self, filename):
+        """
+        Write the trace events in a JSON file.
+        If filename is a directory, a new file named with the current time and process id is written in it.
+
+        Returns:
+            The written filename.
+        """
+        import json
+        if os.path.isdir(filename):
+            filename = os.path.join(filename, "chrandr-{}-{}.json".format(time.strftime('%Y%m%d-%H%M%S'),
+                self._pid))
+        with open(filename, 'w') as fd:
+            json.dump({'traceEvents': self.events(), 'displayTimeUnit': 'ms'}, fd)
+        return filename
+
+
+_tracer = None
+
+
+def enable():
+    """Enable tracing, returns the Tracer recording the spans."""
+    global _tracer
+    if _tracer is None:
+        _tracer = Tracer()
+    return _tracer
+
+
+def get_tracer():
+    """Returns the Tracer, None if tracing is disabled."""
+    return _tracer
+
+
+def span(name, **args):
+    """
+    Start a span, to use in a `with` statement or ended by end().
+
+    Args:
+        * name (str): Phase name
+        * args: Arguments of the span, JSON serializable values
+    """
+    if _tracer is None:
+        return _NULL_SPAN
+    return _tracer.span(name, **args)
+
+
+def _percentile(values, percent):
+    """Returns the nearest-rank percentile of sorted values."""
+    rank = max(1, -(-len(values) * percent // 100))
+    return values[int(rank) - 1]
+
+
+def summarize(filenames):
+    """
+    Summarize the spans of trace files (or directories of trace files).
+
+    Returns:
+        A list of (phase name, count, p50 ms, p95 ms, max ms), in the order of first occurrence.
+    Raises:
+        OSError, ValueError: If a file cannot be read or is not a trace file.
+    """
+    import json
+    files = []
+    for filename in filenames:
+        if os.path.isdir(filename):
+            files.extend(os.path.join(filename, name) for name in sorted(os.listdir(filename))
+                if name.endswith('.json'))
+        else:
+            files.append(filename)
+    durations = {}
+    for filename in files:
+        with open(filename) as fd:
+            trace = json.load(fd)
+        events = trace['traceEvents'] if isinstance(trace, dict) else trace
+        for event in events:
+            if event.get('ph') == 'X':
+                durations.setdefault(event['name'], []).append(event['dur'] / 1000)
+    summary = []
+    for name, values in durations.items():
+        values.sort()
+        summary.append((name, len(values), _percentile(values, 50), _percentile(values, 95), values[-1]))
+    return summary
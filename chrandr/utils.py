@@ -1,15 +1,36 @@
 # -*- coding: utf-8 -*-
 """
 chrandr - Various utilities
+
+Commands execution : a command without shell syntax is split and its program is executed directly
+(no intermediate shell, see split_command()), or replaced by a built-in action (see chrandr.actions).
+Other commands are executed by the shell.
+Commands could be prepared before their execution (see PreparedCommand), ie when the outputs change.
+The output of a command is read while it is written : only its head and its tail are kept (see OutputBuffer),
+the whole output could be written into a log file (see CommandLog).
 """
 
 import os
 import os.path
+import re
+import errno
 import sys
+import codecs
+import collections
+import selectors
+import shlex
+import shutil
+import functools
 import logging
 import subprocess
-import re
-import pkg_resources
+import signal
+import threading
+import time
+import concurrent.futures
+
+import chrandr.backends
+import chrandr.metrics
+import chrandr.trace
 
 
 class ProcessException(Exception):
@@ -21,36 +42,540 @@ class ProcessException(Exception):
         return str(self.__cause__)
 
 
-def get_connected_outputs():
-    """Returns the list of connected outputs."""
-    logger = logging.getLogger('get_connected_outputs')
-    # execute xrandr query command
-    xrandr_output = subprocess.check_output(args=["xrandr", "--query"], universal_newlines=True)
-    # logger.debug("xrandr --query output :\n%s", xrandr_output)
-    # match output to find all connected outputs
-    connected_outputs = re.findall(r"^([\w\d-]*) connected .*$", xrandr_output, re.MULTILINE)
-    if connected_outputs:
-        logger.debug("Connected outputs: %s", connected_outputs)
-        return connected_outputs
-    return []
+class CommandTimeout(ProcessException):
+    """Raised when a command does not end in time."""
+    def __str__(self):
+        return "Command '{}' timed out".format(self.cmd)
+
+
+class CommandCancelled(ProcessException):
+    """Raised when the execution of commands is cancelled."""
+    def __str__(self):
+        return "Command '{}' cancelled".format(self.cmd)
+
+
+class CommandsFailed(ProcessException):
+    """
+    Raised when several commands groups fail (see execute_groups()).
+
+    Fields:
+        * errors (list of ProcessException): Error of each failed group
+    """
+    def __init__(self, errors):
+        super().__init__('; '.join(str(e.cmd) for e in errors), None,
+            '\n'.join("$ {}\n{}\n{}".format(e.cmd, e, e.output or '') for e in errors))
+        self.errors = errors
+    def __str__(self):
+        return "{} commands groups failed: {}".format(len(self.errors), '; '.join(str(e) for e in self.errors))
+
+
+# Outputs query policies (see query_outputs())
+QUERY_PROBE = 'probe'
+QUERY_CURRENT = 'current'
+QUERY_TIERED = 'tiered'
+QUERY_POLICIES = (QUERY_PROBE, QUERY_CURRENT, QUERY_TIERED)
+
+# Interval in seconds to check the cancellation of a running command
+_CANCEL_CHECK_INTERVAL = 0.1
+# Maximum number of commands groups executed concurrently
+DEFAULT_MAX_WORKERS = 4
+# Characters kept from the beginning and the end of a command output
+DEFAULT_OUTPUT_HEAD = 4096
+DEFAULT_OUTPUT_TAIL = 16384
+_READ_SIZE = 65536
+# Programs starting no other process : executed in the session of chrandr, so with posix_spawn()
+_LEAF_PROGRAMS = frozenset(('xrandr', 'xset', 'xinput'))
+
+
+class OutputBuffer:
+    """
+    Bounded capture of a command output : the head and the tail are kept, the middle is dropped.
+
+    Fields:
+        * head_size (int), tail_size (int): Number of characters kept at the beginning and at the end
+        * truncated (int): Number of characters dropped
+    """
+
+    def __init__(self, head_size=DEFAULT_OUTPUT_HEAD, tail_size=DEFAULT_OUTPUT_TAIL):
+        self.head_size = head_size
+        self.tail_size = tail_size
+        self.truncated = 0
+        self._head = ''
+        # ring of chunks
+        self._tail = collections.deque()
+        self._tail_length = 0
+
+    def write(self, text):
+        """Add text to the output."""
+        if len(self._head) < self.head_size:
+            size = self.head_size - len(self._head)
+            self._head += text[:size]
+            text = text[size:]
+        if not text:
+            return
+        self._tail.append(text)
+        self._tail_length += len(text)
+        while self._tail_length > self.tail_size:
+            excess = self._tail_length - self.tail_size
+            first = self._tail[0]
+            if len(first) <= excess:
+                self._tail.popleft()
+                dropped = len(first)
+            else:
+                self._tail[0] = first[excess:]
+                dropped = excess
+            self._tail_length -= dropped
+            self.truncated += dropped
+
+    def getvalue(self):
+        """Returns the kept output, with a marker where characters are dropped."""
+        tail = ''.join(self._tail)
+        if self.truncated:
+            return "{}\n[... {} characters truncated ...]\n{}".format(self._head, self.truncated, tail)
+        return self._head + tail
+
+
+class CommandLog:
+    """
+    Log file of the whole commands output, rotated when it is too large (the previous one is kept with '.1').
+    Could be shared by concurrent commands, their outputs are then mixed.
+
+    Fields:
+        * filename (str): Log filename
+        * max_size (int): Size in bytes, the file is rotated when it is exceeded
+    """
+
+    def __init__(self, filename, max_size=1024 * 1024):
+        self.filename = filename
+        self.max_size = max_size
+        self._lock = threading.Lock()
+
+    def _write(self, data):
+        with self._lock:
+            try:
+                if os.path.getsize(self.filename) + len(data) > self.max_size:
+                    os.replace(self.filename, self.filename + '.1')
+            except FileNotFoundError:
+                pass
+            fd = os.open(self.filename, os.O_WRONLY | os.O_APPEND | os.O_CREAT | os.O_CLOEXEC, 0o600)
+            try:
+                os.write(fd, data)
+            finally:
+                os.close(fd)
+
+    def start(self, cmd):
+        """Log the start of a command."""
+        self._write("$ {}  # {}\n".format(cmd, time.strftime('%Y-%m-%d %H:%M:%S')).encode('utf-8'))
+
+    def write(self, data):
+        """Log output data (bytes)."""
+        self._write(data)
+
+    def end(self, cmd, status):
+        """Log the end of a command, with its exit status or error."""
+        self._write("# end of '{}': {}\n".format(cmd, status).encode('utf-8'))
+
+
+# characters with a special meaning for the shell, commands containing them are executed by the shell
+_SHELL_CHARS_RE = re.compile(r"[|&;<>()$`\\\n*?\[\]{}~#!]")
+
+
+def split_command(cmd):
+    """
+    Split a command line into arguments, without shell.
+
+    Returns:
+        The list of arguments, None if the command needs a shell (pipes, variables...).
+    """
+    if _SHELL_CHARS_RE.search(cmd):
+        return None
+    try:
+        return shlex.split(cmd)
+    except ValueError:
+        return None
+
+
+@functools.lru_cache(maxsize=64)
+def _which(program, path):
+    return shutil.which(program, path=path)
+
+
+def resolve_program(program):
+    """Returns the absolute path of a program, searched in $PATH, None if not found."""
+    if os.path.dirname(program):
+        return os.path.abspath(program) if os.access(program, os.X_OK) else None
+    # cached until $PATH changes
+    return _which(program, os.environ.get('PATH', os.defpath))
+
+
+class PreparedCommand(str):
+    """
+    A command line prepared for run_command() : split into arguments,
+    its built-in action found and its program resolved in $PATH.
+    It is used as the command line (str), run_command() executes it without preparing it again.
+
+    Fields:
+        * args (list of str): Arguments, None if the command needs a shell
+        * action (callable): Built-in action replacing the program, None if there is no one
+        * program (str): Absolute path of the program, None if not found or if the command needs a shell
+    """
+
+    def __new__(cls, cmd):
+        self = super().__new__(cls, cmd)
+        self.args = split_command(cmd)
+        self.action = None
+        self.program = None
+        if self.args:
+            import chrandr.actions
+            self.action = chrandr.actions.get_action(self.args[0])
+            self.program = resolve_program(self.args[0])
+        return self
+
 
+def get_connected_outputs(backend=None, probe=True):
+    """
+    Returns the list of connected outputs.
+
+    Args:
+        * backend (OutputBackend): Backend to use, None to use the default one (see chrandr.backends)
+        * probe (bool): Probe the outputs, False to get the last known outputs of the X server
+    """
+    if backend is None:
+        backend = chrandr.backends.get_backend()
+    return backend.get_connected_outputs(probe=probe)
+
+
+def query_outputs(policy=QUERY_PROBE, backend=None, on_probed=None):
+    """
+    Returns the list of connected outputs, queried with a policy :
+        * QUERY_PROBE : the outputs are probed (exact, slow : the X server checks every connector)
+        * QUERY_CURRENT : the last known outputs of the X server (fast, could miss an unprobed change)
+        * QUERY_TIERED : the last known outputs are returned, and the outputs are probed in a background thread,
+                         on_probed is then called in this thread with the probed outputs if they differ
+
+    Args:
+        * policy (str): One of QUERY_POLICIES
+        * backend (OutputBackend): Backend to use, None to use the default one (see chrandr.backends)
+        * on_probed (callable): Called with the probed outputs (list of str) if they differ (tiered policy)
+    """
+    logger = logging.getLogger('query_outputs')
+    if backend is None:
+        backend = chrandr.backends.get_backend()
+    start = time.perf_counter()
+    with chrandr.trace.span('outputs.query', policy=policy) as span:
+        outputs = backend.get_connected_outputs(probe=(policy == QUERY_PROBE))
+        span.set_args(outputs=outputs)
+    duration = time.perf_counter() - start
+    chrandr.metrics.record_query(policy == QUERY_PROBE, duration)
+    logger.debug("Outputs queried (%s) in %.1f ms", 'probe' if policy == QUERY_PROBE else 'current',
+        duration * 1000)
+    if policy != QUERY_TIERED:
+        return outputs
+
+    def probe():
+        probe_start = time.perf_counter()
+        try:
+            with chrandr.trace.span('outputs.probe') as span:
+                probed = backend.get_connected_outputs(probe=True)
+                span.set_args(outputs=probed, changed=(probed != outputs))
+        except Exception:
+            logger.warning("Background outputs probe failed", exc_info=True)
+            return
+        probe_duration = time.perf_counter() - probe_start
+        chrandr.metrics.record_query(True, probe_duration)
+        logger.debug("Outputs probed in background in %.1f ms", probe_duration * 1000)
+        if probed != outputs and on_probed is not None:
+            logger.debug("Probed outputs differ: %s", probed)
+            on_probed(probed)
+
+    threading.Thread(target=probe, name='chrandr-probe', daemon=True).start()
+    return outputs
+
+
+def get_output_edids(backend=None, probe=True):
+    """
+    Returns the EDID of the connected outputs, in a dict {output name: EDID bytes}.
+
+    Args:
+        * backend (OutputBackend): Backend to use, None to use the default one (see chrandr.backends)
+        * probe (bool): Probe the outputs, False to get the EDID of the last known outputs of the X server
+    """
+    if backend is None:
+        backend = chrandr.backends.get_backend()
+    return backend.get_output_edids(probe=probe)
+
+
+def run_command(cmd, timeout=None, cancel_event=None, on_output=None, log=None, env=None):
+    """
+    Execute a command and returns its output (stdout and stderr, see OutputBuffer).
+    Commands without shell syntax are executed directly or by a built-in action, others by the shell.
+
+    Args:
+        * cmd (str) : Command to execute, or PreparedCommand
+        * timeout (float) : Maximum duration in seconds, None for no limit
+        * cancel_event (threading.Event) : The command is killed when this event is set
+        * on_output (callable) : Called with the output text while it is read
+        * log (CommandLog) : Log of the whole output, None for no log
+        * env (dict) : Environment of the command (ie another DISPLAY), None to inherit it
+    Raises:
+        ProcessException : If the command fails.
+        CommandTimeout : If the command does not end in time.
+        CommandCancelled : If the command is cancelled.
+    """
+    logger = logging.getLogger('run_command')
+    prepared = cmd if isinstance(cmd, PreparedCommand) else PreparedCommand(cmd)
+    if prepared.action is not None:
+        import chrandr.actions
+        try:
+            output = prepared.action(prepared.args, timeout=timeout)
+        except chrandr.actions.ActionUnavailable as e:
+            logger.debug("Built-in action unavailable, program executed: %s", e)
+        else:
+            logger.debug("Command executed by a built-in action: %s", cmd)
+            return output
+    if prepared.program is not None:
+        return _run_process(cmd, [prepared.program] + prepared.args[1:], timeout, cancel_event, on_output, log,
+            env)
+    return _run_process(cmd, cmd, timeout, cancel_event, on_output, log, env)
+
+
+def _run_process(cmd, args, timeout, cancel_event, on_output, log, env=None):
+    """
+    Execute a command, see run_command().
+
+    Args:
+        * cmd (str) : Command line, used in errors
+        * args (list of str or str) : Arguments, with the absolute program path, or the command line for the shell
+    """
+    logger = logging.getLogger('_run_process')
+    deadline = None if timeout is None else time.monotonic() + timeout
+    shell = isinstance(args, str)
+    # new session to kill the command and its children together,
+    # leaf programs are killed alone : without new session nor closed fds, Popen() uses posix_spawn()
+    group = shell or os.path.basename(args[0]) not in _LEAF_PROGRAMS
+    try:
+        process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+            shell=shell, start_new_session=group, close_fds=group, env=env)
+    except OSError as e:
+        if not shell and e.errno in (errno.ENOEXEC, errno.ENOENT):
+            # script without shebang, or program moved since resolved : executed by the shell, as before
+            logger.debug("Cannot execute %s directly (%s), executed by the shell", args[0], e)
+            _which.cache_clear()
+            return _run_process(cmd, cmd, timeout, cancel_event, on_output, log, env)
+        raise ProcessException(cmd, None, str(e)) from e
+    output = OutputBuffer()
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+
+    def feed(data, final=False):
+        if log is not None and data:
+            log.write(data)
+        text = decoder.decode(data, final)
+        if text:
+            output.write(text)
+            if on_output is not None:
+                on_output(text)
+
+    if log is not None:
+        log.start(cmd)
+    with process, selectors.DefaultSelector() as selector:
+        stdout = process.stdout.fileno()
+        selector.register(stdout, selectors.EVENT_READ)
+        try:
+            while True:
+                if cancel_event is not None and cancel_event.is_set():
+                    feed(_kill_process(process, group), True)
+                    raise CommandCancelled(cmd, None, output.getvalue())
+                if deadline is not None and time.monotonic() >= deadline:
+                    feed(_kill_process(process, group), True)
+                    raise CommandTimeout(cmd, None, output.getvalue())
+                wait = _CANCEL_CHECK_INTERVAL
+                if deadline is not None:
+                    wait = min(wait, max(0.0, deadline - time.monotonic()))
+                if selector.get_map():
+                    if selector.select(wait):
+                        data = os.read(stdout, _READ_SIZE)
+                        if data:
+                            feed(data)
+                        else:
+                            selector.unregister(stdout)
+                    continue
+                # output closed, wait the end of the process
+                try:
+                    process.wait(timeout=wait)
+                    break
+                except subprocess.TimeoutExpired:
+                    pass
+            feed(b'', True)
+        except ProcessException as e:
+            if log is not None:
+                log.end(cmd, e)
+            raise
+    if log is not None:
+        log.end(cmd, process.returncode)
+    if process.returncode:
+        raise ProcessException(cmd, process.returncode, output.getvalue()) \
+            from subprocess.CalledProcessError(process.returncode, cmd, output.getvalue())
+    return output.getvalue()
 
-def execute_commands(commands):
+
+def _kill_process(process, group=True):
+    """
+    Kill a process started by run_command(), with its process group (new session),
+    and returns its remaining output (bytes).
+
+    Args:
+        * process (subprocess.Popen) : Process to kill
+        * group (bool) : Kill the process group, False to kill the process alone (leaf program)
+    """
+    logger = logging.getLogger('_kill_process')
+    for sig in (signal.SIGTERM, signal.SIGKILL):
+        logger.debug("Sending signal %s to process %d", sig, process.pid)
+        try:
+            if group:
+                os.killpg(process.pid, sig)
+            else:
+                process.send_signal(sig)
+        except ProcessLookupError:
+            pass
+        try:
+            process.wait(timeout=1)
+            break
+        except subprocess.TimeoutExpired:
+            pass
+    # remaining output, without waiting the processes still writing it
+    os.set_blocking(process.stdout.fileno(), False)
+    try:
+        return process.stdout.read() or b''
+    except OSError:
+        return b''
+
+
+def execute_commands(commands, timeout=None, total_timeout=None, cancel_event=None, on_progress=None,
+        on_output=None, log=None, env=None):
     """
     Execute a list of commands, one by one.
     Returns on first error, and following commands are not executed.
 
     Args:
         * commands (list of str) : List of commands to execute
+        * timeout (float) : Maximum duration of each command in seconds, None for no limit
+        * total_timeout (float) : Maximum duration of all commands in seconds, None for no limit
+        * cancel_event (threading.Event) : Stop the execution when this event is set
+        * on_progress (callable) : Called with (index, command) before each command
+        * on_output (callable) : Called with the commands output text while it is read
+        * log (CommandLog) : Log of the whole commands output, None for no log
+        * env (dict) : Environment of the commands (ie another DISPLAY), None to inherit it
     Raises:
         ProcessException : If a command fails.
+        CommandTimeout : If a command does not end in time.
+        CommandCancelled : If the execution is cancelled.
     """
     logger = logging.getLogger('execute_commands')
-    try:
-        for cmd in commands:
-            logger.debug("Executing command: %s", cmd)
-            subprocess.check_output(cmd, stderr=subprocess.STDOUT,
-                universal_newlines=True, shell=True)
-    except subprocess.CalledProcessError as e:
-        logger.debug("Command error: %s", e.cmd, exc_info=True)
-        raise ProcessException(e.cmd, e.returncode, e.output) from e
+    deadline = None if total_timeout is None else time.monotonic() + total_timeout
+    for index, cmd in enumerate(commands):
+        if cancel_event is not None and cancel_event.is_set():
+            raise CommandCancelled(cmd)
+        cmd_timeout = timeout
+        if deadline is not None:
+            remaining = max(0.0, deadline - time.monotonic())
+            cmd_timeout = remaining if cmd_timeout is None else min(cmd_timeout, remaining)
+        if on_progress is not None:
+            on_progress(index, cmd)
+        logger.debug("Executing command: %s", cmd)
+        start = time.monotonic()
+        try:
+            with chrandr.trace.span('command', cmd=cmd, index=index):
+                run_command(cmd, timeout=cmd_timeout, cancel_event=cancel_event, on_output=on_output, log=log,
+                    env=env)
+        except ProcessException as e:
+            logger.debug("Command error: %s", e.cmd, exc_info=True)
+            chrandr.metrics.record_command(cmd, time.monotonic() - start, e)
+            raise
+        chrandr.metrics.record_command(cmd, time.monotonic() - start)
+
+
+def execute_groups(groups, after=None, timeout=None, total_timeout=None, cancel_event=None, on_progress=None,
+        on_output=None, log=None, max_workers=DEFAULT_MAX_WORKERS, env=None):
+    """
+    Execute commands groups : the commands of a group are executed one by one (see execute_commands()),
+    groups are executed concurrently once the groups they depend on succeeded.
+    When a group fails, the groups depending on it are not executed, others continue.
+
+    Args:
+        * groups (dict) : Commands groups {group name: list of commands}
+        * after (dict) : Groups dependencies {group name: list of groups names executed before}, without cycle
+        * timeout (float) : Maximum duration of each command in seconds, None for no limit
+        * total_timeout (float) : Maximum duration of all commands in seconds, None for no limit
+        * cancel_event (threading.Event) : Stop the execution when this event is set
+        * on_progress (callable) : Called with (index, command) before each command,
+                                   index counts the commands of all groups in execution order
+        * on_output (callable) : Called with the commands output text while it is read
+        * log (CommandLog) : Log of the whole commands output, None for no log
+        * max_workers (int) : Maximum number of groups executed concurrently
+        * env (dict) : Environment of the commands (ie another DISPLAY), None to inherit it
+    Raises:
+        ProcessException : If a group fails (error of this group).
+        CommandsFailed : If several groups fail.
+        CommandCancelled : If the execution is cancelled.
+    """
+    logger = logging.getLogger('execute_groups')
+    after = after or {}
+    deadline = None if total_timeout is None else time.monotonic() + total_timeout
+    counter_lock = threading.Lock()
+    counter = [0]
+
+    def progress(index, cmd):
+        with counter_lock:
+            index = counter[0]
+            counter[0] += 1
+        if on_progress is not None:
+            on_progress(index, cmd)
+
+    def run_group(name):
+        remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+        logger.debug("Executing commands group '%s'", name)
+        execute_commands(groups[name], timeout=timeout, total_timeout=remaining, cancel_event=cancel_event,
+            on_progress=progress, on_output=on_output, log=log, env=env)
+
+    names = [name for name in groups if groups[name] or after.get(name)]
+    if len(names) <= 1 and not any(after.get(name) for name in names):
+        # no concurrency
+        for name in names:
+            run_group(name)
+        return
+
+    pending = list(names)
+    succeeded = set()
+    errors = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers,
+            thread_name_prefix='chrandr-group') as pool:
+        running = {}
+        while True:
+            for name in list(pending):
+                # empty groups are not executed, depending on them is always satisfied
+                if all(d in succeeded or d not in names for d in after.get(name, ())):
+                    pending.remove(name)
+                    running[pool.submit(run_group, name)] = name
+            if not running:
+                break
+            done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    future.result()
+                except ProcessException as e:
+                    logger.debug("Commands group '%s' failed: %s", name, e)
+                    errors[name] = e
+                else:
+                    succeeded.add(name)
+    for name in pending:
+        logger.debug("Commands group '%s' not executed, a group it depends on failed", name)
+    if not errors:
+        return
+    failures = [errors[name] for name in names if name in errors]
+    cancelled = next((e for e in failures if isinstance(e, CommandCancelled)), None)
+    if cancelled is not None and cancel_event is not None and cancel_event.is_set():
+        raise cancelled
+    if len(failures) == 1:
+        raise failures[0]
+    raise CommandsFailed(failures)
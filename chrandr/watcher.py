@@ -0,0 +1,417 @@
+# -*- coding: utf-8 -*-
+"""
+chrandr - Output hotplug and configuration file watchers
+
+Watch outputs changes (screen plugged, unplugged...) and call a callback once per burst of events.
+Events sources (first available is used) :
+    * RandR screen/output change notifications (python-xlib module)
+    * DRM uevents from the kernel (netlink socket)
+
+Watch the configuration file changes, with inotify (ctypes) or by polling the file status.
+
+The watchers could be fed by the GLib main loop (attach_glib) or run their own loop (run).
+"""
+
+import os
+import os.path
+import ctypes
+import ctypes.util
+import logging
+import selectors
+import socket
+import struct
+import time
+
+
+# from linux/netlink.h, not exported by the socket module
+NETLINK_KOBJECT_UEVENT = 15
+# kernel uevents multicast group
+_UEVENT_KERNEL_GROUP = 1
+
+# from linux/inotify.h
+_IN_MODIFY = 0x00000002
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_Q_OVERFLOW = 0x00004000
+_IN_NONBLOCK = os.O_NONBLOCK
+_IN_CLOEXEC = os.O_CLOEXEC
+# struct inotify_event : int wd, uint32 mask, uint32 cookie, uint32 len, char name[len]
+_INOTIFY_EVENT = struct.Struct('iIII')
+
+
+class Debouncer:
+    """
+    Coalesce a burst of events into one callback call.
+    The callback is due `delay` seconds after the last event of the burst.
+
+    Fields:
+        * delay (float): Quiet time, in seconds, after the last event
+        * callback (callable): Called without argument when due
+    """
+
+    def __init__(self, delay, callback):
+        self.delay = delay
+        self.callback = callback
+        self._deadline = None
+
+    def poke(self):
+        """Register an event, the callback is postponed."""
+        self._deadline = time.monotonic() + self.delay
+
+    def remaining(self):
+        """Returns the seconds before the callback is due, None if no event is pending."""
+        if self._deadline is None:
+            return None
+        return max(0.0, self._deadline - time.monotonic())
+
+    def fire_if_due(self):
+        """Call the callback if due. Returns True if called."""
+        if self._deadline is None or time.monotonic() < self._deadline:
+            return False
+        self._deadline = None
+        self.callback()
+        return True
+
+
+class EventSource:
+    """
+    Base class of events sources.
+    A source is a file descriptor, read() is called when this one is readable.
+    A source without file descriptor (fileno() returns None) is polled : read() is called every `interval` seconds.
+    """
+
+    name = None
+    interval = None
+
+    def fileno(self):
+        raise NotImplementedError()
+
+    def read(self):
+        """Read pending events. Returns True if an output may have changed."""
+        raise NotImplementedError()
+
+    def close(self):
+        pass
+
+
+class RandrEventSource(EventSource):
+    """Screen and output change notifications of the RandR extension (python-xlib)."""
+
+    name = 'randr'
+
+    def __init__(self):
+        """
+        Raises:
+            OSError: If python-xlib is missing or the display/extension is not available.
+        """
+        try:
+            from Xlib import display, X
+            from Xlib.ext import randr
+            from Xlib.error import DisplayError
+        except ImportError as e:
+            raise OSError("python-xlib module not found") from e
+        try:
+            self._display = display.Display()
+        except DisplayError as e:
+            raise OSError("Cannot open the X display") from e
+        if not self._display.has_extension('RANDR'):
+            self._display.close()
+            raise OSError("RANDR extension not available")
+        self._events = (self._display.extension_event.ScreenChangeNotify,
+            self._display.extension_event.CrtcChangeNotify[0],
+            self._display.extension_event.OutputChangeNotify[0])
+        root = self._display.screen().root
+        root.xrandr_select_input(randr.RRScreenChangeNotifyMask
+            | randr.RROutputChangeNotifyMask | randr.RRCrtcChangeNotifyMask)
+        self._display.flush()
+
+    def fileno(self):
+        return self._display.fileno()
+
+    def read(self):
+        changed = False
+        # python-xlib reads the socket in pending_events()
+        while self._display.pending_events():
+            event = self._display.next_event()
+            if event.type in self._events:
+                changed = True
+        return changed
+
+    def close(self):
+        self._display.close()
+
+
+class UeventSource(EventSource):
+    """DRM hotplug uevents read on a kernel netlink socket."""
+
+    name = 'uevent'
+
+    def __init__(self):
+        """
+        Raises:
+            OSError: If the netlink socket cannot be opened.
+        """
+        if not hasattr(socket, 'AF_NETLINK'):
+            raise OSError("Netlink sockets not supported")
+        self._socket = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_KOBJECT_UEVENT)
+        try:
+            self._socket.bind((0, _UEVENT_KERNEL_GROUP))
+        except OSError:
+            self._socket.close()
+            raise
+        self._socket.setblocking(False)
+
+    def fileno(self):
+        return self._socket.fileno()
+
+    def read(self):
+        changed = False
+        while True:
+            try:
+                data = self._socket.recv(8192)
+            except BlockingIOError:
+                break
+            # message : "action@devpath\0KEY=value\0KEY=value..."
+            fields = data.split(b'\0')
+            if b'SUBSYSTEM=drm' in fields:
+                changed = True
+        return changed
+
+    def close(self):
+        self._socket.close()
+
+
+class InotifySource(EventSource):
+    """
+    Changes of a file, notified by inotify (libc functions called with ctypes).
+    The directory is watched : editors often replace the file instead of writing it.
+    """
+
+    name = 'inotify'
+
+    def __init__(self, filename):
+        """
+        Raises:
+            OSError: If inotify is not available or the directory cannot be watched.
+        """
+        libc_name = ctypes.util.find_library('c')
+        try:
+            libc = ctypes.CDLL(libc_name, use_errno=True)
+            inotify_init1 = libc.inotify_init1
+            inotify_add_watch = libc.inotify_add_watch
+        except (OSError, AttributeError, TypeError) as e:
+            raise OSError("inotify not available") from e
+        inotify_add_watch.argtypes = (ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32)
+        self._basename = os.fsencode(os.path.basename(filename))
+        self._fd = inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if self._fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        directory = os.path.dirname(os.path.abspath(filename))
+        mask = _IN_MODIFY | _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE
+        if inotify_add_watch(self._fd, os.fsencode(directory), mask) < 0:
+            errno = ctypes.get_errno()
+            os.close(self._fd)
+            raise OSError(errno, os.strerror(errno), directory)
+
+    def fileno(self):
+        return self._fd
+
+    def read(self):
+        changed = False
+        while True:
+            try:
+                data = os.read(self._fd, 65536)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset + _INOTIFY_EVENT.size <= len(data):
+                wd, mask, cookie, length = _INOTIFY_EVENT.unpack_from(data, offset)
+                offset += _INOTIFY_EVENT.size
+                name = data[offset:offset + length].rstrip(b'\0')
+                offset += length
+                if name == self._basename or mask & _IN_Q_OVERFLOW:
+                    changed = True
+        return changed
+
+    def close(self):
+        os.close(self._fd)
+
+
+class StatPollSource(EventSource):
+    """Changes of a file, detected by polling its status (modification time, size and inode)."""
+
+    name = 'poll'
+
+    def __init__(self, filename, interval=2.0):
+        self.filename = filename
+        self.interval = interval
+        self._status = self._get_status()
+
+    def _get_status(self):
+        try:
+            stat = os.stat(self.filename)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+    def fileno(self):
+        return None
+
+    def read(self):
+        status = self._get_status()
+        if status == self._status:
+            return False
+        self._status = status
+        return True
+
+
+EVENT_SOURCES = (RandrEventSource, UeventSource)
+
+
+def create_event_source():
+    """Returns the first available EventSource, None if there is no one."""
+    logger = logging.getLogger('create_event_source')
+    for source_class in EVENT_SOURCES:
+        try:
+            source = source_class()
+        except OSError as e:
+            logger.info("Event source '%s' unavailable: %s", source_class.name, e)
+        else:
+            logger.debug("Using event source '%s'", source_class.name)
+            return source
+    return None
+
+
+def create_file_source(filename):
+    """Returns the EventSource of a file changes : inotify if available, polling otherwise."""
+    logger = logging.getLogger('create_file_source')
+    try:
+        return InotifySource(filename)
+    except OSError as e:
+        logger.info("Event source '%s' unavailable, polling %s: %s", InotifySource.name, filename, e)
+        return StatPollSource(filename)
+
+
+class EventWatcher:
+    """
+    Watch the events of a source and call a callback once per burst of events.
+
+    Fields:
+        * source (EventSource): Events source, None if no source is available
+    """
+
+    def __init__(self, callback, delay=0.3, source=None):
+        """
+        Args:
+            * callback (callable): Called without argument after a burst of events
+            * delay (float): Debounce delay in seconds
+            * source (EventSource): Events source
+        """
+        self._logger = logging.getLogger(self.__class__.__name__)
+        self.source = source
+        self._debouncer = Debouncer(delay, callback)
+        self._glib_watch = None
+        self._glib_timeout = None
+
+    def available(self):
+        """Returns True if changes could be watched."""
+        return self.source is not None
+
+    def _read(self):
+        if self.source.read():
+            self._logger.debug("Change event from '%s'", self.source.name)
+            self._debouncer.poke()
+            return True
+        return False
+
+    def attach_glib(self):
+        """Feed the watcher from the GLib main loop."""
+        from gi.repository import GLib
+        if self.source is None:
+            return
+
+        def on_timeout():
+            remaining = self._debouncer.remaining()
+            if remaining:
+                # new events during the delay, wait again
+                self._glib_timeout = GLib.timeout_add(int(remaining * 1000) + 1, on_timeout)
+            else:
+                self._glib_timeout = None
+                self._debouncer.fire_if_due()
+            return GLib.SOURCE_REMOVE
+
+        def on_readable(*args):
+            if self._read() and self._glib_timeout is None:
+                self._glib_timeout = GLib.timeout_add(int(self._debouncer.delay * 1000), on_timeout)
+            return GLib.SOURCE_CONTINUE
+
+        fileno = self.source.fileno()
+        if fileno is None:
+            self._glib_watch = GLib.timeout_add(int(self.source.interval * 1000), on_readable)
+        else:
+            self._glib_watch = GLib.io_add_watch(fileno, GLib.PRIORITY_DEFAULT, GLib.IO_IN, on_readable)
+
+    def run(self, stop_event=None, poll_interval=1.0):
+        """
+        Run the watcher loop until stop_event (threading.Event) is set.
+        stop_event is checked every poll_interval seconds.
+        """
+        if self.source is None:
+            return
+        fileno = self.source.fileno()
+        if fileno is None:
+            poll_interval = min(poll_interval, self.source.interval)
+        with selectors.DefaultSelector() as selector:
+            if fileno is not None:
+                selector.register(fileno, selectors.EVENT_READ)
+            while stop_event is None or not stop_event.is_set():
+                remaining = self._debouncer.remaining()
+                timeout = poll_interval if remaining is None else min(remaining, poll_interval)
+                # without file descriptor, select() only waits
+                if selector.select(timeout) or fileno is None:
+                    self._read()
+                self._debouncer.fire_if_due()
+
+    def close(self):
+        """Detach the watcher from the main loop and close the source."""
+        if self._glib_watch is not None or self._glib_timeout is not None:
+            from gi.repository import GLib
+            for source_id in (self._glib_watch, self._glib_timeout):
+                if source_id is not None:
+                    GLib.source_remove(source_id)
+            self._glib_watch = self._glib_timeout = None
+        if self.source is not None:
+            self.source.close()
+            self.source = None
+
+
+class OutputWatcher(EventWatcher):
+    """Watch outputs changes and call a callback once per burst of events."""
+
+    def __init__(self, callback, delay=0.3, source=None):
+        """
+        Args:
+            * callback (callable): Called without argument after outputs changes
+            * delay (float): Debounce delay in seconds
+            * source (EventSource): Events source, None to use the first available
+        """
+        super().__init__(callback, delay=delay, source=source if source is not None else create_event_source())
+
+
+class FileWatcher(EventWatcher):
+    """Watch a file changes (ie the configuration file) and call a callback once per burst of changes."""
+
+    def __init__(self, filename, callback, delay=0.3, source=None):
+        """
+        Args:
+            * filename (str): File to watch, could not exist yet
+            * callback (callable): Called without argument after the file changes
+            * delay (float): Debounce delay in seconds
+            * source (EventSource): Events source, None to use inotify or polling (see create_file_source())
+        """
+        super().__init__(callback, delay=delay,
+            source=source if source is not None else create_file_source(filename))
@@ -46,17 +46,20 @@ setup(
 
     # TODO Add GTK 3 dependency
     # install_requires=['gtk>=3'],
+    extras_require={
+        'randr': ['python-xlib'],
+    },
 
     packages=['chrandr'],
     package_data={
-        'chrandr': ['ui/*.glade']
+        'chrandr': ['ui/*.glade', 'ui/*.gresource']
     },
     data_files=[
         ('share/applications/', ['data/chrandr.desktop'])
     ],
     entry_points={
-        'gui_scripts': [
-            'chrandr = chrandr.simple_gui:main'
+        'console_scripts': [
+            'chrandr = chrandr.cli:main'
         ]
     }
 )